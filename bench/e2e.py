@@ -0,0 +1,347 @@
+"""
+End-to-end benchmark: synthetic device traffic published to a broker stand-in, ingested by blueprints/mqtt.py,
+treated by MqttTransfer.process and dispatched by MysqlDispatcher, with the database servers replaced by the
+in-memory stand-ins of bench/standins.py.
+
+    python bench/e2e.py [--messages 5000] [--rate 500] [--devices 100] [--interval 1] [--logging-dir DIR] [--output FILE] [--compare FILE]
+
+Reports the transfer throughput (msgs/s), the end-to-end latency (publish to message processed: p50/p90/p99/max),
+the database queries per message (ingest, transfer, client destinations) and the peak RSS, and writes them to a JSON
+file (default bench/results/e2e_<commit>.json) that --compare reads back to print the differences between two runs.
+
+Devices publish LoRaWAN uplinks decoded by bench/parsers/lorawan_frames_1_0_0.py (one plain topic and route per device,
+one MySQL destination per client). The transfer job runs every --interval seconds while traffic flows, in the same process:
+the RSS includes the stand-in tables. Queries are statements counted by the stand-ins, not timed against a server:
+the figures compare commits, they don't size a MySQL instance.
+"""
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from uuid import uuid4
+
+import subprocess
+import threading
+import argparse
+import atexit
+import platform
+import binascii
+import builtins
+import resource
+import tempfile
+import logging
+import random
+import shutil
+import base64
+import json
+import math
+import time
+import sys
+import os
+
+ROOT_DIR = Path(os.path.realpath(__file__)).parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from bench.standins import MemoryDatabase, MemoryEntityStorage, MemoryTransaction, BrokerStandIn, DestinationServer, install_entity_helpers
+from bench.parsers import lorawan_frames_1_0_0 as lorawan
+
+PARSER_NAME, PARSER_VERSION = "LoRaWAN frames", "1.0.0"
+PARSER_FILE = "lorawan_frames_1_0_0"
+METRICS = [("temperature", "C"), ("humidity", "%"), ("battery", "V"), ("pressure", "hPa")]
+
+# metrics compared by --compare: (path in the results, label, higher is better)
+COMPARED = [
+    (("throughput_msgs_s",), "throughput (msgs/s)", True),
+    (("latency_ms", "p50"), "latency p50 (ms)", False),
+    (("latency_ms", "p99"), "latency p99 (ms)", False),
+    (("queries_per_message", "ingest"), "ingest queries/msg", False),
+    (("queries_per_message", "transfer"), "transfer queries/msg", False),
+    (("queries_per_message", "destination"), "destination statements/msg", False),
+    (("rss_mb", "peak"), "peak RSS (MB)", False),
+]
+
+# --- environment -----------------------------------------------------------
+
+def load_web_context(database):
+    """ Entities as the web app sees them (temod holders, registered in the builtins), stored in the memory database """
+    from temod.ext.holders import entities, joins
+    from context import init_registry
+    init_registry({"temod": {"core_directory": os.path.join(ROOT_DIR, "core"), "bound_database": "mysql"}, "storage": {"credentials": {}}})
+    for category, name, entity in entities.tuples():
+        entity.storage = MemoryEntityStorage(entity, database=database, origin="ingest")
+        setattr(builtins, name, entity)
+    for category, name, join in joins.tuples():
+        setattr(builtins, name, join)
+    install_entity_helpers(builtins)
+
+
+def load_transfer(database, destinations, parsers_dir, parser_workers):
+    """ The mqtt_transfer module with the globals set by its __main__ block, its storages and the mysql dispatcher on the stand-ins """
+    from temod.storage.directory import DirectoryStorage
+    from services.mqtt_transfer.dispatchers import DISPATCHERS
+    from services.mqtt_transfer.dispatchers import mysql as mysql_dispatcher
+    from services.mqtt_transfer import sandbox
+    from tools.json_conditions import eval_mongo_dsl
+    from tools import cold_archive, json_codec, metrics, tracing
+    from tools.topic_trie import TopicTrie
+    from tools.credentials import CREDENTIALS
+    from tools.points import PointBatch
+    import services.mqtt_transfer.mqtt_transfer as transfer
+    import core.entity as entities
+
+    install_entity_helpers(entities)
+    mysql_dispatcher.pymysql = destinations
+    for name, value in {
+        "ROOT_DIR": str(ROOT_DIR), "PARSERS_DB": DirectoryStorage(parsers_dir), "DISPATCHERS": DISPATCHERS, "eval_mongo_dsl": eval_mongo_dsl,
+        "SANDBOX_DEFAULTS": sandbox.SANDBOX_DEFAULTS, "ParserPool": sandbox.ParserPool, "ParserSandboxError": sandbox.ParserSandboxError,
+        "ParserFunctionMissing": sandbox.ParserFunctionMissing, "cold_archive": cold_archive, "json_codec": json_codec, "metrics": metrics,
+        "NULL_TRACE": tracing.NULL_TRACE, "Tracer": tracing.Tracer, "now_ns": tracing.now_ns, "trace_file": tracing.trace_file,
+        "TopicTrie": TopicTrie, "CREDENTIALS": CREDENTIALS, "PointBatch": PointBatch, "entities": entities, "MysqlEntityStorage": MemoryEntityStorage,
+    }.items():
+        setattr(transfer, name, value)
+    parser_pool = sandbox.ParserPool(workers=parser_workers) if parser_workers > 0 else None
+    return transfer, parser_pool
+
+
+def install_parser(directory):
+    """ The example parser, where MqttTransfer looks for it (db/parsers file, db.parsers module) """
+    for filename in (PARSER_FILE, PARSER_FILE + ".py"):
+        shutil.copy(lorawan.__file__, os.path.join(directory, filename))
+    sys.modules[f"db.parsers.{PARSER_FILE}"] = lorawan
+
+
+def seed(database, clients, devices):
+    """ Clients, devices (one topic, route and destination each), metrics and the parser: the topics of the devices """
+    import core.entity as entities
+    storage = lambda entity: MemoryEntityStorage(entity, database=database, origin="seed")
+    now = datetime.now()
+
+    parser_id = storage(entities.Parser).create(entities.Parser(id=-1, name=PARSER_NAME, version=PARSER_VERSION, language="python", active=1))
+    metric_ids = [
+        storage(entities.Metric).create(entities.Metric(id=-1, key_name=key_name, default_unit=unit, digiupagri_ref=f"{i:03d}"))
+        for i, (key_name, unit) in enumerate(METRICS)
+    ]
+    device_type_id = storage(entities.DeviceType).create(entities.DeviceType(id=-1, vendor="bench", model="lorawan", kind="sensor", created_at=now))
+    parser_config = json.dumps({f"{key_name}_metric": metric_id for (key_name, unit), metric_id in zip(METRICS, metric_ids)})
+
+    # destination passwords are real tokens: the transfer decrypts them through the credential cache
+    key_b64 = base64.b64encode(bytes(range(32))).decode("ascii")
+    storage(entities.CryptoKey).create(entities.CryptoKey(key_id="PRIMARY", key_b64=key_b64, version=1, updated_at=now))
+    crypto_config = entities.CryptoConfig(
+        id=1, algorithm="aes-256-gcm", key_source="db", key_id="PRIMARY", iv_bytes=12, tag_bytes=16, encoding="base64", version=1, updated_at=now
+    )
+    storage(entities.CryptoConfig).create(crypto_config)
+    password_enc = crypto_config.encrypt("bench", base64.b64decode(key_b64)).encode("ascii")
+
+    client_ids = [
+        storage(entities.Client).create(entities.Client(id=-1, slug=f"client{i}", name=f"Client {i}", status="active", created_at=now))
+        for i in range(clients)
+    ]
+    destination_ids = [
+        storage(entities.ClientDestination).create(entities.ClientDestination(
+            id=-1, client_id=client_id, type="mysql", host="127.0.0.1", port=3306, database_name=f"client{i}", username="relay",
+            password_enc=password_enc, encryption_version="PRIMARY.1", options_json=json.dumps({"table": "parsed_points"}), active=1, created_at=now
+        ))
+        for i, client_id in enumerate(client_ids)
+    ]
+
+    topics = []
+    for i in range(devices):
+        client = i % clients
+        topic = f"client{client}/gw{i % 10}/dev{i}"
+        device_id = storage(entities.Device).create(entities.Device(
+            id=-1, client_id=client_ids[client], device_type_id=device_type_id, name=f"Device {i}", topic=topic, created_at=now
+        ))
+        topic_id = storage(entities.MqttTopic).create(entities.MqttTopic(
+            id=-1, topic=topic, client_id=client_ids[client], device_id=device_id, active=1, created_at=now
+        ))
+        rule_id = str(uuid4())
+        storage(entities.RoutingRule).create(entities.RoutingRule(
+            id=rule_id, client_id=client_ids[client], topic_id=topic_id, parser_id=parser_id, parser_config=parser_config,
+            active=1, priority=100, created_at=now
+        ))
+        storage(entities.RouteDeposit).create(entities.RouteDeposit(rule_id=rule_id, destination_id=destination_ids[client]))
+        topics.append(topic)
+    return topics
+
+
+def uplink(seq, rng):
+    frame = lorawan.FRAME.pack(rng.randint(-2000, 4000), rng.randint(0, 200), rng.randint(2800, 3600), rng.randint(95000, 105000), seq % 65536)
+    return json.dumps({"fCnt": seq, "fPort": 2, "data": binascii.b2a_base64(frame, newline=False).decode()})
+
+# --- measures --------------------------------------------------------------
+
+def percentile(values, q):
+    """ Nearest rank percentile of sorted values """
+    if len(values) == 0:
+        return None
+    return values[max(0, math.ceil(q/100*len(values)) - 1)]
+
+
+def rss_mb():
+    # peak resident set size of the process (kilobytes on linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip() != ""
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+# --- run -------------------------------------------------------------------
+
+def run(args):
+    database = MemoryDatabase()
+    destinations = DestinationServer()
+    parsers_dir = tempfile.mkdtemp(prefix="mqttrelay_bench_")
+    try:
+        install_parser(parsers_dir)
+        load_web_context(database)
+        transfer_module, parser_pool = load_transfer(database, destinations, parsers_dir, args.parser_workers)
+        topics = seed(database, args.clients, args.devices)
+        seeded_queries = dict(database.queries)
+        baseline_rss = current_rss_mb()
+
+        from blueprints.mqtt import mqtt_blueprint
+        sys.modules["blueprints.mqtt"].Transaction = MemoryTransaction
+        broker = BrokerStandIn()
+        mqtt_blueprint.setup({"sample_interval": args.sample_interval}).setup_mqtt(broker)
+        broker.connect()
+
+        published_at, processed_at = {}, {}
+        database.on_update("mqtt_message", lambda row, changes: processed_at.setdefault(row['id'], time.perf_counter()) if changes.get('processed') else None)
+        transfer = transfer_module.MqttTransfer(
+            parser_pool=parser_pool, parse_batch_size=args.parse_batch_size, database=database, origin="transfer"
+        )
+
+        rng = random.Random(args.seed)
+        def publish():
+            started = time.perf_counter()
+            for seq in range(args.messages):
+                if args.rate > 0:
+                    delay = started + seq/args.rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                published_at[seq] = time.perf_counter()
+                broker.publish(topics[seq % len(topics)], uplink(seq, rng))
+        publisher = threading.Thread(target=publish, name="publisher", daemon=True)
+
+        runs = 0
+        started = time.perf_counter()
+        # temod and the dispatcher print debugging output on stdout
+        with redirect_stdout(open(os.devnull, "w")):
+            publisher.start()
+            while True:
+                traffic = publisher.is_alive() or broker.backlog() > 0
+                transfer.process(None)
+                runs += 1
+                if not traffic and len(database.table("pending_message")) == 0:
+                    break
+                if time.perf_counter() - started > args.timeout:
+                    LOGGER.warning(f"Timed out after {args.timeout}s with {len(database.table('pending_message'))} pending messages")
+                    break
+                time.sleep(args.interval)
+        elapsed = time.perf_counter() - started
+        broker.disconnect()
+        if parser_pool is not None:
+            parser_pool.close()
+    finally:
+        shutil.rmtree(parsers_dir, ignore_errors=True)
+
+    # mqtt_message ids map to the published sequence numbers through the payloads
+    latencies = sorted(
+        round(1000*(processed_at[row['id']] - published_at[json.loads(row['payload'])['fCnt']]), 3)
+        for row in database.table("mqtt_message").values() if row['id'] in processed_at
+    )
+    processed = len(latencies)
+    queries = {origin: count - seeded_queries.get(origin, 0) for origin, count in database.queries.items() if origin != "seed"}
+    last_processed = max(processed_at.values()) if processed else None
+    commit, dirty = git_revision()
+    from tools import json_codec
+    return {
+        "commit": commit, "dirty": dirty, "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "json_codec": json_codec.backend(),
+        "config": {
+            "messages": args.messages, "rate": args.rate, "devices": args.devices, "clients": args.clients, "interval": args.interval,
+            "parse_batch_size": args.parse_batch_size, "parser_workers": args.parser_workers, "sample_interval": args.sample_interval, "seed": args.seed,
+        },
+        "published": len(published_at), "ingested": broker.delivered, "processed": processed, "transfer_runs": runs,
+        "duration_s": round(elapsed, 3),
+        "throughput_msgs_s": round(processed/(last_processed - min(published_at.values())), 1) if processed else 0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50), "p90": percentile(latencies, 90), "p99": percentile(latencies, 99),
+            "max": latencies[-1] if processed else None
+        },
+        "queries_per_message": {
+            "ingest": round(queries.get("ingest", 0)/max(1, broker.delivered), 2),
+            "transfer": round(queries.get("transfer", 0)/max(1, processed), 2),
+            "destination": round(destinations.statements/max(1, processed), 2),
+        },
+        "destination_rows": sum(destinations.rows.values()),
+        "rss_mb": {"baseline": baseline_rss, "peak": rss_mb(), "end": current_rss_mb()},
+    }
+
+
+def compare(previous, current):
+    def pick(results, path):
+        for key in path:
+            results = (results or {}).get(key)
+        return results
+    print(f"{'':<28} {previous.get('commit') or '?':>12} {current.get('commit') or '?':>12}")
+    for path, label, higher_is_better in COMPARED:
+        before, after = pick(previous, path), pick(current, path)
+        if before is None or after is None:
+            continue
+        change = "" if before == 0 else f"{100*(after - before)/before:+7.1f}%"
+        worse = (after < before) if higher_is_better else (after > before)
+        print(f"{label:<28} {before:>12.2f} {after:>12.2f} {change:>9}{'  (worse)' if worse and change else ''}")
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(prog="End-to-end benchmark of the ingest, transfer and dispatch of mqtt messages")
+    argparser.add_argument('--messages', type=int, default=5000, help='Number of published messages')
+    argparser.add_argument('--rate', type=float, default=500, help='Published messages per second (0: as fast as possible)')
+    argparser.add_argument('--devices', type=int, default=100, help='Number of publishing devices')
+    argparser.add_argument('--clients', type=int, default=5, help='Number of clients owning the devices')
+    argparser.add_argument('--interval', type=float, default=1, help='Seconds between two transfer runs')
+    argparser.add_argument('--parse-batch-size', type=int, default=256, help='parse_batch_size of the transfer')
+    argparser.add_argument('--parser-workers', type=int, default=0, help='Parser sandbox workers (0: parsers run in-process)')
+    argparser.add_argument('--sample-interval', type=float, default=300, help='sample_interval of the ingest blueprint')
+    argparser.add_argument('--seed', type=int, default=0, help='Seed of the generated payloads')
+    argparser.add_argument('--timeout', type=float, default=600, help='Seconds after which the run stops')
+    argparser.add_argument('--logging-dir', help='Log the transfer at INFO to this directory, as the service does (default: warnings only, on stderr)', default=None)
+    argparser.add_argument('--log-sample-rate', type=float, default=1.0, help='log_sample_rate of the transfer with --logging-dir')
+    argparser.add_argument('--output', help='Results file (default bench/results/e2e_<commit>.json)', default=None)
+    argparser.add_argument('--compare', help='Results file of a previous run to compare with', default=None)
+    args = argparser.parse_args()
+
+    if args.logging_dir:
+        from tools import logs
+        atexit.register(logs.setup(args.logging_dir, "MqttTransfer", sample_rate=args.log_sample_rate).close)
+        setattr(builtins, 'LOGGER', logging.getLogger())
+    else:
+        setattr(builtins, 'LOGGER', logging.getLogger("mqtt_transfer"))
+        logging.basicConfig(level=logging.WARNING)
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+
+    output = args.output or os.path.join(ROOT_DIR, "bench", "results", f"e2e_{results['commit'] or 'local'}{'_dirty' if results['dirty'] else ''}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,87 @@
+"""
+JSON serialisation cost per message of the parsing pipeline, before and after the shared codec (tools/json_codec.py):
+
+ - before: stdlib json, meta_json encoded for every point then decoded again for every point by the dispatcher
+ - after: codec backend, meta_json encoded once per extraction and decoded once per dispatch
+
+    python bench/json_codec.py [--messages 20000] [--metrics 12]
+
+Only the serialisation work is measured (payload decode, meta/json values encode, dispatcher meta decode).
+"""
+from pathlib import Path
+
+import argparse
+import random
+import json
+import time
+import sys
+import os
+
+sys.path.append(str(Path(os.path.realpath(__file__)).parent.parent))
+
+from tools import json_codec
+
+
+def generate_messages(count, metrics, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        payload = {
+            "deviceInfo": {"devEui": f"{rng.getrandbits(64):016x}", "deviceName": f"sensor-{i % 500}"},
+            "fCnt": i, "fPort": 2, "rxInfo": [{"gatewayId": f"{rng.getrandbits(64):016x}", "rssi": rng.randint(-120, -40), "snr": rng.uniform(-10, 10)}],
+            "object": {f"m{k}": rng.uniform(0, 100) for k in range(metrics)},
+        }
+        messages.append(json.dumps(payload))
+    return messages
+
+
+def parse(payload):
+    # what a parser typically returns: metric values keyed by metric id, plus meta keys
+    results = {k+1: value for k, value in enumerate(payload["object"].values())}
+    results.update({"fcnt": payload["fCnt"], "rssi": payload["rxInfo"][0]["rssi"], "devices": {}, "metrics": {}})
+    return results
+
+
+def before(message):
+    results = parse(json.loads(message))
+    points = [
+        {"num_value": value, "meta_json": json.dumps({k:v for k,v in results.items() if not type(k) is int})}
+        for metric_id, value in results.items() if type(metric_id) is int
+    ]
+    for point in points:
+        json.loads(point["meta_json"])
+    return len(points)
+
+
+def after(message):
+    results = parse(json_codec.loads(message))
+    meta_json = json_codec.dumps({k:v for k,v in results.items() if not type(k) is int})
+    points = [{"num_value": value, "meta_json": meta_json} for metric_id, value in results.items() if type(metric_id) is int]
+    metas = {}
+    for point in points:
+        if not point["meta_json"] in metas:
+            metas[point["meta_json"]] = json_codec.loads(point["meta_json"])
+    return len(points)
+
+
+def measure(label, function, messages):
+    started = time.process_time()
+    for message in messages:
+        function(message)
+    elapsed = time.process_time() - started
+    print(f"{label:<28} {len(messages):>8} messages  {elapsed:8.3f}s CPU  {1e6*elapsed/len(messages):10.2f} us/message")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Benchmarks the JSON serialisation cost per message")
+    parser.add_argument('--messages', type=int, default=20000, help='Number of generated messages')
+    parser.add_argument('--metrics', type=int, default=12, help='Metrics (points) per message')
+    args = parser.parse_args()
+
+    messages = generate_messages(args.messages, args.metrics)
+    reference = measure("before (stdlib, per point)", before, messages)
+    for backend in json_codec.available():
+        json_codec.use(backend)
+        elapsed = measure(f"after ({backend})", after, messages)
+        print(f"speedup: x{reference/elapsed:.2f}")
@@ -0,0 +1,245 @@
+"""
+Micro-benchmarks of the CPU hot spots of the pipeline, with regression thresholds against a saved baseline:
+
+  - json_conditions: eval_mongo_dsl over a nested routing rule ($and/$or/$not, $regex, $between, $elemMatch)
+  - load_parse_function: MqttTransfer.load_parse_function of an already imported parser (run for every message)
+  - build_points: the point batch construction loop of an extraction (12 metrics)
+  - row_from_point: MysqlDispatcher._row_from_point over the points of an extraction
+  - decrypt_data: crypto_envelopes.decrypt_data of a destination password, for each token algorithm
+
+    python bench/micro.py [-k build_points] [--min-time 0.2] [--rounds 7]
+    python bench/micro.py --save-baseline              # bench/results/micro_baseline.json
+    python bench/micro.py --compare                    # exit code 1 when a median regressed past its threshold
+
+Like pytest-benchmark, each benchmark is calibrated to run at least --min-time per round and reports min, median,
+mean and stddev per call over --rounds rounds; baselines are only meaningful on the machine that saved them.
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import statistics
+import argparse
+import platform
+import builtins
+import tempfile
+import logging
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+ROOT_DIR = Path(os.path.realpath(__file__)).parent.parent
+sys.path.append(str(ROOT_DIR))
+
+BASELINE = os.path.join(ROOT_DIR, "bench", "results", "micro_baseline.json")
+
+# name -> (setup, max_regression): setup() returns the function to measure, called without arguments
+BENCHMARKS = {}
+
+
+def benchmark(name, max_regression=0.2):
+    """ Registers a benchmark; it regresses when its median gets slower than the baseline by more than max_regression """
+    def register(setup):
+        BENCHMARKS[name] = (setup, max_regression)
+        return setup
+    return register
+
+# --- fixtures --------------------------------------------------------------
+
+def route_context(rng):
+    """ The context routing conditions are evaluated against (see MqttTransfer.select_route) """
+    received_at = datetime(2025, 9, 16, 19, 20, 25) + timedelta(seconds=rng.randrange(86400))
+    return {
+        "device": {"id": 42, "client_id": 3, "name": "Greenhouse north", "external_ref": "GH-N-0042", "working": True, "installed": True,
+                   "topic": "acme/gw7/soil-42", "metadata_json": '{"zone": "north"}', "emission_rate": 600000},
+        "device_type": {"id": 5, "vendor": "Dragino", "model": "LSE01", "kind": "soil", "capabilities": '{"battery": true}'},
+        "topic": {"id": 17, "topic": "acme/gw7/soil-42", "active": 1, "client_id": 3, "device_id": 42},
+        "message": {"id": 981234, "client": "acme", "topic": "acme/gw7/soil-42", "qos": 1, "processed": False, "at": received_at.isoformat()},
+        "payload": {
+            "fPort": 2, "battery": 3.61, "alarms": ["LOW_BATT"],
+            "rxInfo": [{"gatewayId": f"gw{i}-{rng.getrandbits(48):012x}", "rssi": rng.randint(-120, -40), "snr": round(rng.uniform(-10, 10), 1)} for i in range(8)],
+        },
+    }
+
+
+ROUTE_RULE = {"$and": [
+    {"device_type.kind": {"$in": ["soil", "weather"]}},
+    {"topic.topic": {"$regex": {"pattern": "^acme/gw[0-9]+/", "flags": "i"}}},
+    {"$or": [
+        {"payload.battery": {"$lt": 3.3}},
+        {"payload.alarms": {"$contains": "LOW_BATT"}},
+    ]},
+    {"$not": {"device.working": False}},
+    {"message.at": {"$between": ["2025-09-16T00:00:00", "2025-09-18T00:00:00"]}},
+    {"payload.alarms": {"$elemMatch": {"this": {"$in": ["LOW_BATT", "TAMPER"]}}}},
+    # matched by the last gateway of the uplink: every element is evaluated
+    {"payload.rxInfo": {"$elemMatch": {"this.gatewayId": {"$startswith": "gw7-"}, "this.rssi": {"$exists": True}}}},
+]}
+
+
+def transfer_module():
+    """ mqtt_transfer with the globals of its __main__ block (storages are not used) """
+    from bench.e2e import load_transfer
+    from bench.standins import MemoryDatabase, DestinationServer
+    transfer, parser_pool = load_transfer(MemoryDatabase(), DestinationServer(), PARSERS_DIR, 0)
+    return transfer
+
+
+def extraction_points(count=12, seed=0):
+    import core.entity as entities
+    transfer = transfer_module()
+    mqttt = transfer.MqttTransfer.__new__(transfer.MqttTransfer)
+    mqttt.metrics_cache = {
+        i: entities.Metric(id=i, key_name=f"metric_{i}", default_unit="unit", digiupagri_ref=f"{i:03d}") for i in range(1, count+1)
+    }
+    rng = random.Random(seed)
+    results = {i: round(rng.uniform(0, 100), 2) for i in range(1, count+1)}
+    results.update({"fcnt": 1234, "rssi": -97, "devices": {}, "metrics": {}})
+    message = entities.MqttMessage(id=981234, client="acme", topic="acme/gw7/soil-42", payload="{}", qos=1, at=datetime(2025, 9, 16, 19, 20, 25))
+    device = entities.Device(id=42, client_id=3, device_type_id=5, topic="acme/gw7/soil-42", created_at=datetime(2025, 1, 1))
+    return mqttt, results, message, device
+
+# --- benchmarks ------------------------------------------------------------
+
+@benchmark("json_conditions")
+def bench_json_conditions():
+    from tools.json_conditions import eval_mongo_dsl
+    context = route_context(random.Random(0))
+    assert eval_mongo_dsl(ROUTE_RULE, context)
+    return lambda: eval_mongo_dsl(ROUTE_RULE, context)
+
+
+@benchmark("load_parse_function")
+def bench_load_parse_function():
+    transfer = transfer_module()
+    parser = {"id": 1, "name": "LoRaWAN frames", "version": "1.0.0", "language": "python"}
+    transfer.MqttTransfer.load_parse_function(parser)
+    return lambda: transfer.MqttTransfer.load_parse_function(parser)
+
+
+@benchmark("build_points")
+def bench_build_points():
+    mqttt, results, message, device = extraction_points()
+    return lambda: mqttt.build_points(results, message, device, "6f1c6a52-4c1e-4b8e-9a57-2b8f3f0b7d11")
+
+
+@benchmark("row_from_point")
+def bench_row_from_point():
+    from services.mqtt_transfer.dispatchers.mysql import MysqlDispatcher
+    mqttt, results, message, device = extraction_points()
+    points = mqttt.build_points(results, message, device, "6f1c6a52-4c1e-4b8e-9a57-2b8f3f0b7d11").to_dicts()
+    src_keys = ["device_id", "key_name", "ts", "value", "unit", "quality", "meta_json"]
+    def rows():
+        # metas lives for one dispatch call: the meta_json of an extraction is decoded once
+        metas = {}
+        return [MysqlDispatcher._row_from_point(point, src_keys, metas) for point in points]
+    return rows
+
+
+def bench_decrypt(algorithm):
+    def setup():
+        from tools.crypto_envelopes import encrypt_data, decrypt_data
+        key = bytes(range(32))
+        token = encrypt_data("s3cr3t-destination-password", key, algorithm=algorithm, key_id="PRIMARY")
+        return lambda: decrypt_data(token, key, key_id="PRIMARY")
+    return setup
+
+for algorithm in ("aes-256-gcm", "chacha20-poly1305", "aes-256-cbc-hmac"):
+    benchmark(f"decrypt_data[{algorithm}]")(bench_decrypt(algorithm))
+
+# --- runner ----------------------------------------------------------------
+
+def calibrate(function, min_time):
+    """ Calls per round so that a round lasts at least min_time """
+    iterations = 1
+    while True:
+        started = time.perf_counter()
+        for i in range(iterations):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return iterations
+        iterations *= 2 if elapsed < min_time/10 else max(2, int(min_time/max(elapsed, 1e-9)) + 1)
+
+
+def measure(function, min_time, rounds):
+    iterations = calibrate(function, min_time)
+    timings = []
+    for r in range(rounds):
+        started = time.perf_counter()
+        for i in range(iterations):
+            function()
+        timings.append((time.perf_counter() - started)/iterations)
+    return {
+        "min_us": 1e6*min(timings), "median_us": 1e6*statistics.median(timings), "mean_us": 1e6*statistics.mean(timings),
+        "stddev_us": 1e6*(statistics.stdev(timings) if len(timings) > 1 else 0), "ops": 1/statistics.median(timings),
+        "rounds": rounds, "iterations": iterations,
+    }
+
+
+def compare(baseline, results):
+    """ Names of the benchmarks whose median regressed past their threshold """
+    regressed = []
+    print(f"\n{'benchmark':<36} {'baseline':>12} {'current':>12} {'change':>9}  threshold")
+    for name, result in results.items():
+        if not name in baseline.get("benchmarks", {}):
+            continue
+        before, after = baseline["benchmarks"][name]["median_us"], result["median_us"]
+        change = (after - before)/before
+        threshold = BENCHMARKS[name][1]
+        flag = ""
+        if change > threshold:
+            regressed.append(name); flag = "REGRESSED"
+        print(f"{name:<36} {before:>10.2f}us {after:>10.2f}us {100*change:>+8.1f}%  {100*threshold:.0f}% {flag}")
+    return regressed
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(prog="Micro-benchmarks of the pipeline hot spots")
+    argparser.add_argument('-k', dest="selection", action="append", help='Only run the benchmarks whose name contains this (repeatable)', default=None)
+    argparser.add_argument('--min-time', type=float, default=0.2, help='Minimum seconds per round')
+    argparser.add_argument('--rounds', type=int, default=7, help='Rounds per benchmark')
+    argparser.add_argument('--baseline', help='Baseline results file', default=BASELINE)
+    argparser.add_argument('--save-baseline', action="store_true", help='Save the results as the baseline', default=False)
+    argparser.add_argument('--compare', action="store_true", help='Compare with the baseline, failing on regressions', default=False)
+    argparser.add_argument('--output', help='Also write the results to this file', default=None)
+    args = argparser.parse_args()
+
+    setattr(builtins, 'LOGGER', logging.getLogger("mqtt_transfer"))
+    logging.basicConfig(level=logging.WARNING)
+
+    PARSERS_DIR = tempfile.mkdtemp(prefix="mqttrelay_bench_")
+    try:
+        from bench.e2e import install_parser
+        install_parser(PARSERS_DIR)
+
+        results = {}
+        print(f"{'benchmark':<36} {'min':>10} {'median':>10} {'mean':>10} {'stddev':>10} {'ops/s':>12}")
+        for name, (setup, threshold) in BENCHMARKS.items():
+            if args.selection and not any(selected in name for selected in args.selection):
+                continue
+            results[name] = measure(setup(), args.min_time, args.rounds)
+            result = results[name]
+            print(f"{name:<36} {result['min_us']:>8.2f}us {result['median_us']:>8.2f}us {result['mean_us']:>8.2f}us {result['stddev_us']:>8.2f}us {result['ops']:>12.0f}")
+    finally:
+        shutil.rmtree(PARSERS_DIR, ignore_errors=True)
+
+    report = {"created_at": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(), "machine": platform.node(), "benchmarks": results}
+    for path in [args.output] + ([args.baseline] if args.save_baseline else []):
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {path}")
+
+    if args.compare:
+        if not os.path.isfile(args.baseline):
+            print(f"No baseline at {args.baseline}: run with --save-baseline first")
+            sys.exit(2)
+        with open(args.baseline) as f:
+            regressed = compare(json.load(f), results)
+        if regressed:
+            print(f"\n{len(regressed)} benchmark(s) regressed: {', '.join(regressed)}")
+            sys.exit(1)
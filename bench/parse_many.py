@@ -0,0 +1,77 @@
+"""
+Batch parsing benchmark: parse() called per message against one parse_many() call per batch,
+in-process and through the parser sandbox pool (services/mqtt_transfer/sandbox.py).
+
+    python bench/parse_many.py [--messages 20000] [--batch-size 256] [--pool-workers 2]
+
+Uses the example parser bench/parsers/lorawan_frames_1_0_0.py on generated uplinks.
+"""
+from pathlib import Path
+
+import argparse
+import builtins
+import binascii
+import logging
+import random
+import struct
+import json
+import time
+import sys
+import os
+
+ROOT_DIR = Path(os.path.realpath(__file__)).parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from bench.parsers import lorawan_frames_1_0_0 as parser
+
+PARSER_MODULE = "bench.parsers.lorawan_frames_1_0_0"
+
+
+def generate_payloads(count, seed=0):
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        frame = parser.FRAME.pack(rng.randint(-2000, 4000), rng.randint(0, 200), rng.randint(2800, 3600), rng.randint(95000, 105000), i % 65536)
+        payloads.append(json.dumps({"fPort": 2, "data": binascii.b2a_base64(frame, newline=False).decode()}))
+    return payloads
+
+
+def batches(payloads, size):
+    for start in range(0, len(payloads), size):
+        yield [json.loads(payload) for payload in payloads[start:start+size]]
+
+
+def measure(label, function, count):
+    started = time.perf_counter()
+    results = function()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34} {count:>8} messages  {elapsed:8.3f}s  {1e6*elapsed/count:10.2f} us/message")
+    return elapsed, results
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(prog="Benchmarks the parse_many batch parser entry point")
+    argparser.add_argument('--messages', type=int, default=20000, help='Number of generated messages')
+    argparser.add_argument('--batch-size', type=int, default=256, help='Payloads per parse_many call')
+    argparser.add_argument('--pool-workers', type=int, default=2, help='Sandbox pool workers (0: skip the pool measures)')
+    args = argparser.parse_args()
+
+    setattr(builtins, 'LOGGER', logging.getLogger())
+    payloads = generate_payloads(args.messages)
+    print(f"numpy: {'yes' if parser.numpy is not None else 'no (struct.iter_unpack)'}")
+
+    single, expected = measure("in-process parse", lambda: [result for batch in batches(payloads, args.batch_size) for result in map(parser.parse, batch)], len(payloads))
+    batched, results = measure("in-process parse_many", lambda: [result for batch in batches(payloads, args.batch_size) for result in parser.parse_many(batch)], len(payloads))
+    assert results == expected
+    print(f"speedup: x{single/batched:.2f}")
+
+    if args.pool_workers > 0:
+        from services.mqtt_transfer.sandbox import ParserPool
+        pool = ParserPool(workers=args.pool_workers)
+        try:
+            single, _ = measure("sandbox parse", lambda: [pool.call(PARSER_MODULE, payload, {})[0] for batch in batches(payloads, args.batch_size) for payload in batch], len(payloads))
+            batched, results = measure("sandbox parse_many", lambda: [result for batch in batches(payloads, args.batch_size) for result in pool.call(PARSER_MODULE, batch, {}, function="parse_many", calls=len(batch))[0]], len(payloads))
+            assert results == expected
+            print(f"speedup: x{single/batched:.2f}")
+        finally:
+            pool.close()
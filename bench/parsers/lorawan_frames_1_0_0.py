@@ -0,0 +1,60 @@
+"""
+Example parser ("LoRaWAN frames", version 1.0.0) with a batch entry point, used by bench/parse_many.py.
+Copy it to db/parsers/ to use it.
+
+Payloads are uplinks as forwarded by a LoRaWAN network server: {"fPort": 2, "data": "<base64 frame>"}.
+A frame is 11 bytes, big endian: temperature (int16, 1/100 C), humidity (uint8, 1/2 %), battery (uint16, mV),
+pressure (uint32, Pa), frame counter (uint16).
+
+parse_many decodes every frame of a batch in one pass (numpy when installed, struct.iter_unpack otherwise);
+like parse, it gives None for frames of an unexpected size.
+"""
+import binascii
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FRAME = struct.Struct(">hBHIH")
+FRAME_DTYPE = None if numpy is None else numpy.dtype([
+    ("temperature", ">i2"), ("humidity", "u1"), ("battery", ">u2"), ("pressure", ">u4"), ("counter", ">u2")
+])
+
+
+def _point(temperature, humidity, battery, pressure, counter, temperature_metric, humidity_metric, battery_metric, pressure_metric):
+    return {
+        temperature_metric: temperature/100, humidity_metric: humidity/2, battery_metric: battery/1000, pressure_metric: pressure/100,
+        "fcnt": counter
+    }
+
+
+def parse(payload, temperature_metric=1, humidity_metric=2, battery_metric=3, pressure_metric=4):
+    frame = binascii.a2b_base64(payload["data"])
+    if len(frame) != FRAME.size:
+        return None
+    return _point(*FRAME.unpack(frame), temperature_metric, humidity_metric, battery_metric, pressure_metric)
+
+
+def parse_many(payloads, temperature_metric=1, humidity_metric=2, battery_metric=3, pressure_metric=4):
+    metrics = (temperature_metric, humidity_metric, battery_metric, pressure_metric)
+    frames = [binascii.a2b_base64(payload["data"]) for payload in payloads]
+    regular = [i for i, frame in enumerate(frames) if len(frame) == FRAME.size]
+    buffer = b"".join(frames[i] for i in regular)
+
+    results = [None]*len(payloads)
+    if numpy is not None:
+        decoded = numpy.frombuffer(buffer, dtype=FRAME_DTYPE)
+        columns = zip(
+            (decoded["temperature"]/100).tolist(), (decoded["humidity"]/2).tolist(), (decoded["battery"]/1000).tolist(),
+            (decoded["pressure"]/100).tolist(), decoded["counter"].tolist()
+        )
+        for i, (temperature, humidity, battery, pressure, counter) in zip(regular, columns):
+            results[i] = {
+                temperature_metric: temperature, humidity_metric: humidity, battery_metric: battery, pressure_metric: pressure, "fcnt": counter
+            }
+    else:
+        for i, values in zip(regular, FRAME.iter_unpack(buffer)):
+            results[i] = _point(*values, *metrics)
+    return results
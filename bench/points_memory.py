@@ -0,0 +1,108 @@
+"""
+Memory benchmark of the in-flight parsed points: RSS held by --points points (default 100k) kept as ParsedPoint
+entities (the representation of the transfer before tools/points.py) and as point batches, each in a fresh interpreter.
+
+    python bench/points_memory.py [--points 100000] [--per-extraction 12] [--output FILE]
+
+Representations:
+  - entities: a temod ParsedPoint per point, as build_points made them
+  - entities_dicts: the entities plus their to_dict() copies, as dispatch_to_deposit made them
+  - batch: a PointBatch per extraction, as build_points makes them now
+  - batch_dicts: the batches plus the to_dicts() of one extraction at a time, as dispatched now
+
+Points are generated as by the transfer: numeric values, one extraction id, device, timestamp and meta_json per
+extraction. RSS is read from /proc/self/statm before and after building them, so it includes the allocator overhead.
+"""
+from datetime import datetime
+from pathlib import Path
+
+import subprocess
+import argparse
+import platform
+import json
+import sys
+import os
+
+ROOT_DIR = Path(os.path.realpath(__file__)).parent.parent
+
+PRELUDE = f"""
+import gc, json, os, random, resource, sys, uuid
+from datetime import datetime, timedelta
+sys.path.insert(0, {str(ROOT_DIR)!r})
+
+def rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+POINTS, PER_EXTRACTION = int(sys.argv[1]), int(sys.argv[2])
+rng = random.Random(0)
+extractions = [
+    (str(uuid.UUID(int=rng.getrandbits(128), version=4)), rng.randrange(1, 1000), datetime(2025, 9, 16) + timedelta(seconds=i),
+     json.dumps({{"fcnt": i, "rssi": -97, "devices": {{}}, "metrics": {{}}}}))
+    for i in range((POINTS + PER_EXTRACTION - 1) // PER_EXTRACTION)
+]
+units = ["unit_%d" % metric_id for metric_id in range(PER_EXTRACTION)]
+"""
+
+# representation -> python statements building 'kept' (what stays in memory) after the imports
+BUILD = {
+    "entities": ("import core.entity as entities", """
+kept = []
+for e, (extraction_id, device_id, ts, meta_json) in enumerate(extractions):
+    for metric_id in range(min(PER_EXTRACTION, POINTS - e*PER_EXTRACTION)):
+        kept.append(entities.ParsedPoint(
+            id=-1, extraction_id=extraction_id, device_id=device_id, metric_id=metric_id, ts=ts, unit=units[metric_id],
+            quality="good", meta_json=meta_json, num_value=round(rng.uniform(0, 100), 2)
+        ))
+"""),
+    "batch": ("from tools.points import PointBatch", """
+kept = []
+for e, (extraction_id, device_id, ts, meta_json) in enumerate(extractions):
+    batch = PointBatch(extraction_id, device_id, ts, meta_json)
+    for metric_id in range(min(PER_EXTRACTION, POINTS - e*PER_EXTRACTION)):
+        batch.append(metric_id, "num_value", round(rng.uniform(0, 100), 2), unit=units[metric_id], quality="good")
+    kept.append(batch)
+"""),
+}
+DISPATCH = {
+    "entities_dicts": ("entities", "dicts = [point.to_dict() for point in kept]"),
+    "batch_dicts": ("batch", "dicts = max((batch.to_dicts() for batch in kept), key=len)"),
+}
+
+
+def measure(name, points, per_extraction):
+    base = name if name in BUILD else DISPATCH[name][0]
+    imports, build = BUILD[base]
+    extra = "" if name in BUILD else DISPATCH[name][1]
+    code = PRELUDE + imports + "\ngc.collect(); before = rss()\n" + build + extra + "\ngc.collect()\nprint(json.dumps(rss() - before))\n"
+    process = subprocess.run([sys.executable, "-c", code, str(points), str(per_extraction)], capture_output=True, text=True, cwd=ROOT_DIR)
+    if process.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{process.stderr}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(prog="Memory benchmark of the in-flight parsed points")
+    argparser.add_argument('--points', type=int, default=100000, help='Points kept in memory')
+    argparser.add_argument('--per-extraction', type=int, default=12, help='Points per extraction')
+    argparser.add_argument('--output', help='Write the results to this file', default=None)
+    args = argparser.parse_args()
+
+    results = {}
+    print(f"{'representation':<16} {'RSS (MB)':>10} {'bytes/point':>12}")
+    for name in ["entities", "entities_dicts", "batch", "batch_dicts"]:
+        held = measure(name, args.points, args.per_extraction)
+        results[name] = {"rss_mb": held / 2**20, "bytes_per_point": held / args.points}
+        print(f"{name:<16} {results[name]['rss_mb']:>10.1f} {results[name]['bytes_per_point']:>12.0f}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(), "points": args.points,
+                "per_extraction": args.per_extraction, "representations": results
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,500 @@
+"""
+In-process stand-ins of the servers the relay talks to, used by the end-to-end benchmark (bench/e2e.py):
+
+  - MemoryDatabase / MemoryEntityStorage: a MysqlEntityStorage keeping its tables in dicts and counting every query
+  - install_entity_helpers: in-memory versions of the entity helpers that run raw SQL (upserts, pending queue join)
+  - MemoryTransaction: tools.transactions.Transaction over a memory storage
+  - BrokerStandIn: the flask_mqtt extension as seen by blueprints/mqtt.py, delivering published messages from a network thread
+  - DestinationServer: the pymysql module as used by MysqlDispatcher, client databases only counting the rows they receive
+
+Queries are counted per origin (the web app ingest, the transfer service, ...) so that the cost of a message can be
+broken down by process. Rows are python values (enums by name): entities are rebuilt from them on every read, as temod does.
+"""
+from types import SimpleNamespace
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from temod.base.attribute import Attribute
+from temod.storage import MysqlEntityStorage
+from temod.storage.exceptions import EntityStorageException
+
+from tools.topic_trie import covers
+
+from collections import namedtuple
+from datetime import timedelta
+
+import threading
+import logging
+import queue
+
+
+# --- database --------------------------------------------------------------
+
+class MemoryDatabase(object):
+
+    def __init__(self):
+        self.tables: Dict[str, Dict[tuple, Dict[str, Any]]] = {}
+        self.sequences: Dict[str, int] = {}
+        self.queries: Dict[str, int] = {}
+        self.listeners: Dict[str, List[Callable]] = {}
+        self.lock = threading.RLock()
+
+    def table(self, name: str) -> Dict[tuple, Dict[str, Any]]:
+        return self.tables.setdefault(name, {})
+
+    def next_id(self, name: str) -> int:
+        self.sequences[name] = self.sequences.get(name, 0) + 1
+        return self.sequences[name]
+
+    def count_query(self, origin: str) -> None:
+        with self.lock:
+            self.queries[origin] = self.queries.get(origin, 0) + 1
+
+    def on_update(self, name: str, listener: Callable[[Dict[str, Any], Dict[str, Any]], None]) -> None:
+        """ listener(row, changes) is called after every update of a row of the table """
+        self.listeners.setdefault(name, []).append(listener)
+
+    def updated(self, name: str, row: Dict[str, Any], changes: Dict[str, Any]) -> None:
+        for listener in self.listeners.get(name, []):
+            listener(row, changes)
+
+
+def _scalar(value: Any) -> Any:
+    return value.name if isinstance(value, Enum) else value
+
+
+class MemoryEntityStorage(MysqlEntityStorage):
+
+    """
+    Entity storage over a MemoryDatabase, with the API of MysqlEntityStorage the relay uses: equality conditions
+    (keyword arguments or attributes), orderby ("field [desc], ..."), skip and limit. Statements are not SQL:
+    getOne, getMany and executeAndCommit run a function of the storage (see install_entity_helpers), any SQL string is refused.
+    """
+    def __init__(self, entity_type, database: MemoryDatabase = None, origin: str = "app", **credentials):
+        super(MemoryEntityStorage, self).__init__(entity_type)
+        self.database = database
+        self.origin = origin
+        self.ids = [name for name, attribute in self.entity_attributes.items() if attribute.get('is_id', False)]
+
+    def connect(self, force=False):
+        raise EntityStorageException("The memory storage has no database server to connect to")
+
+    # --- rows ---------------------------------------------------------------
+
+    @property
+    def rows(self) -> Dict[tuple, Dict[str, Any]]:
+        return self.database.table(self.entity_name)
+
+    def entity_generator(self, dct, copy=False):
+        return self.entity_type(**{name: value for name, value in dct.items() if name in self.entity_attributes})
+
+    def _row(self, entity) -> Dict[str, Any]:
+        return {name: _scalar(attribute.value) for name, attribute in entity.attributes.items()}
+
+    def _key(self, row: Dict[str, Any]) -> tuple:
+        return tuple(row.get(name) for name in self.ids)
+
+    def _equalities(self, conditions: Iterable[Any], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        equalities = {name: _scalar(value) for name, value in kwargs.items()}
+        for condition in conditions:
+            if not isinstance(condition, Attribute):
+                raise NotImplementedError(f"The memory storage only handles equality conditions, not {type(condition).__name__}")
+            equalities[condition.name] = _scalar(condition.value)
+        return equalities
+
+    def _select(self, equalities: Dict[str, Any], orderby: Optional[str] = None, skip: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self.database.lock:
+            if len(self.ids) and set(equalities) == set(self.ids):
+                row = self.rows.get(self._key(equalities))
+                selected = [] if row is None else [row]
+            else:
+                selected = [row for row in self.rows.values() if all(row.get(name) == value for name, value in equalities.items())]
+        if orderby is not None:
+            for order in reversed([order.split() for order in orderby.split(",")]):
+                selected.sort(key=lambda row: (row.get(order[0]) is not None, row.get(order[0])), reverse=len(order) > 1 and order[1].lower() == "desc")
+        start = skip or 0
+        return selected[start:None if limit is None else start+limit]
+
+    def _apply(self, row: Dict[str, Any], changes: Dict[str, Any]) -> None:
+        with self.database.lock:
+            key = self._key(row)
+            row.update(changes)
+            if self._key(row) != key:
+                self.rows[self._key(row)] = self.rows.pop(key)
+        self.database.updated(self.entity_name, row, changes)
+
+    # --- queries ------------------------------------------------------------
+
+    def get(self, *conditions, orderby=None, skip=None, **kwargs):
+        self.database.count_query(self.origin)
+        selected = self._select(self._equalities(conditions, kwargs), orderby=orderby, skip=skip, limit=1)
+        return self.entity_generator(selected[0]) if len(selected) else None
+
+    def list(self, *conditions, orderby=None, skip=None, limit=None, **kwargs):
+        self.database.count_query(self.origin)
+        for row in self._select(self._equalities(conditions, kwargs), orderby=orderby, skip=skip, limit=limit):
+            yield self.entity_generator(row)
+
+    def count(self, *conditions, skip=None, **kwargs):
+        self.database.count_query(self.origin)
+        return len(self._select(self._equalities(conditions, kwargs), skip=skip))
+
+    def create(self, *entities):
+        if len(entities) == 0:
+            raise EntityStorageException("At least one entity is needed")
+        self.database.count_query(self.origin)
+        lastrowid = 0
+        with self.database.lock:
+            for entity in entities:
+                self._verify_entity(entity)
+                row = self._row(entity)
+                for name, attribute in entity.attributes.items():
+                    if attribute.is_auto:
+                        row[name] = lastrowid = self.database.next_id(self.entity_name)
+                if self._key(row) in self.rows:
+                    raise EntityStorageException(f"Duplicate entry {self._key(row)} for the primary key of {self.entity_name}")
+                self.rows[self._key(row)] = row
+        return lastrowid
+
+    def update(self, updates, *conditions, limit=None, skip=None, updateID=False, **kwargs):
+        self.database.count_query(self.origin)
+        if isinstance(updates, Attribute):
+            updates = {updates.name: updates.value}
+        changes = {name: _scalar(value) for name, value in updates.items()}
+        for row in self._select(self._equalities(conditions, kwargs), skip=skip, limit=limit):
+            self._apply(row, changes)
+        return 0
+
+    def updateOne(self, entity, attributes=None, updateID=False):
+        self._verify_entity(entity)
+        self.database.count_query(self.origin)
+        names = [attribute if type(attribute) is str else attribute.name for attribute in (attributes or [])]
+        changes = {
+            name: _scalar(entity.attributes[name].value) for name in names
+            if not entity.attributes[name].is_auto and (updateID or not entity.attributes[name].is_id)
+        }
+        if entity.snapshot is not None:
+            key = tuple(_scalar(entity.snapshot[name].value) for name in self.ids)
+        else:
+            key = self._key(self._row(entity))
+        row = self.rows.get(key)
+        if row is not None and len(changes):
+            self._apply(row, changes)
+        return 0
+
+    def delete(self, *conditions, many=False, skip=None, limit=None, **kwargs):
+        self.database.count_query(self.origin)
+        selected = self._select(self._equalities(conditions, kwargs), skip=skip, limit=None if many else 1)
+        with self.database.lock:
+            for row in selected:
+                self.rows.pop(self._key(row), None)
+        return 0
+
+    def getOne(self, query):
+        return self._run(query)
+
+    def getMany(self, query):
+        return self._run(query)
+
+    def executeAndCommit(self, query):
+        return self._run(query)
+
+    def _run(self, statement):
+        if not callable(statement):
+            raise NotImplementedError(f"The memory storage doesn't run SQL: {str(statement)[:80]}")
+        self.database.count_query(self.origin)
+        with self.database.lock:
+            return statement(self)
+
+
+class MemoryTransaction(object):
+
+    """
+    tools.transactions.Transaction over a MemoryEntityStorage: statements are counted one by one and applied at once,
+    rollbacks are not simulated (the in-memory helpers don't fail halfway).
+    """
+    def __init__(self, storage: MemoryEntityStorage):
+        self.storage = storage
+
+    def __enter__(self) -> "MemoryTransaction":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def executeAndCommit(self, statement: Callable) -> Any:
+        return self.storage.executeAndCommit(statement)
+
+    def getOne(self, statement: Callable) -> Any:
+        return self.storage.getOne(statement)
+
+    def getMany(self, statement: Callable) -> Any:
+        return self.storage.getMany(statement)
+
+    def savepoint(self, name: str) -> None:
+        pass
+
+    def rollback_to(self, name: str) -> None:
+        pass
+
+
+# --- entity helpers --------------------------------------------------------
+
+def install_entity_helpers(namespace: Any) -> None:
+    """
+    Replaces the raw SQL helpers of the entities of a namespace (the core.entity module, or the entity classes loaded by temod holders)
+    with equivalents over a MemoryEntityStorage, keeping one statement (one counted query) per call.
+    """
+    MqttMessage, PendingMessage = namespace.MqttMessage, namespace.PendingMessage
+    DeviceActivity, MqttSender = namespace.DeviceActivity, namespace.MqttSender
+    PayloadSample, LatestValue = namespace.PayloadSample, namespace.LatestValue
+    ParsedPoint = namespace.ParsedPoint
+
+    def pending(limit=None, after=None, storage=None):
+        storage = MqttMessage.storage if storage is None else storage
+        def statement(storage):
+            messages = storage.database.table(MqttMessage.ENTITY_NAME)
+            rows = []
+            for (message_id,), queued in sorted(storage.database.table(PendingMessage.ENTITY_NAME).items()):
+                if after is not None and message_id <= after:
+                    continue
+                row = messages.get((message_id,))
+                if row is not None and row['at'] == queued['at']:
+                    rows.append(dict(row))
+            return rows if limit is None else rows[:int(limit)]
+        for row in storage.getMany(statement):
+            yield storage.entity_generator(row)
+
+    def receive(topic, payload, qos, at, storage=None):
+        storage = MqttMessage.storage if storage is None else storage
+        def insert_message(storage):
+            message_id = storage.database.next_id(MqttMessage.ENTITY_NAME)
+            storage.database.table(MqttMessage.ENTITY_NAME)[(message_id,)] = {
+                "id": message_id, "client": topic.split("/")[0], "topic": topic, "payload": payload, "qos": qos,
+                "processed": False, "processor": None, "at": at
+            }
+            return message_id
+        message_id = storage.executeAndCommit(insert_message)
+        def queue_message(storage):
+            storage.database.table(PendingMessage.ENTITY_NAME)[(message_id,)] = {"id": message_id, "topic": topic, "at": at}
+        storage.executeAndCommit(queue_message)
+        return message_id
+
+    def record_activity(topic, client, at, storage=None):
+        storage = DeviceActivity.storage if storage is None else storage
+        def statement(storage):
+            rows = storage.database.table(DeviceActivity.ENTITY_NAME)
+            row = rows.get((topic,))
+            if row is None:
+                rows[(topic,)] = {
+                    "topic": topic, "client": client, "first_seen": at, "last_seen": at, "message_count": 1, "window_start": at,
+                    "window_count": 1, "previous_count": 0
+                }
+                return
+            period = timedelta(seconds=DeviceActivity.WINDOW)
+            period_over, periods_over = at >= row['window_start'] + period, at >= row['window_start'] + 2*period
+            row.update(
+                previous_count=0 if periods_over else (row['window_count'] if period_over else row['previous_count']),
+                window_count=1 if period_over else row['window_count'] + 1,
+                window_start=at if periods_over else (row['window_start'] + period if period_over else row['window_start']),
+                first_seen=min(row['first_seen'], at), last_seen=max(row['last_seen'], at), message_count=row['message_count'] + 1
+            )
+        return storage.executeAndCommit(statement)
+
+    def record_sender(slug, at, storage=None):
+        storage = MqttSender.storage if storage is None else storage
+        def statement(storage):
+            rows = storage.database.table(MqttSender.ENTITY_NAME)
+            row = rows.setdefault((slug,), {"slug": slug, "first_seen": at, "last_seen": at, "message_count": 0})
+            row.update(first_seen=min(row['first_seen'], at), last_seen=max(row['last_seen'], at), message_count=row['message_count'] + 1)
+        return storage.executeAndCommit(statement)
+
+    def record_sample(topic, payload, at, storage=None):
+        storage = PayloadSample.storage if storage is None else storage
+        def ring(storage):
+            device = next((row for row in storage.database.table("device").values() if row['topic'] == topic), None)
+            if device is None:
+                return []
+            samples = [
+                {"device_type_id": row['device_type_id'], "slot": row['slot'], "at": row['at']}
+                for row in storage.database.table(PayloadSample.ENTITY_NAME).values() if row['device_type_id'] == device['device_type_id']
+            ]
+            # the LEFT JOIN of an empty ring
+            return samples or [{"device_type_id": device['device_type_id'], "slot": None, "at": None}]
+        rows = list(storage.getMany(ring))
+        if len(rows) == 0:
+            return None
+        samples = {row['slot']: row['at'] for row in rows if row['slot'] is not None}
+        free = [slot for slot in range(PayloadSample.SLOTS) if slot not in samples]
+        slot = free[0] if len(free) else min(samples, key=lambda slot: (samples[slot], slot))
+        def statement(storage):
+            storage.database.table(PayloadSample.ENTITY_NAME)[(rows[0]['device_type_id'], slot)] = {
+                "device_type_id": rows[0]['device_type_id'], "slot": slot, "topic": topic, "payload": payload, "at": at
+            }
+        return storage.executeAndCommit(statement)
+
+    def upsert(*values, storage=None):
+        if len(values) == 0:
+            return
+        storage = LatestValue.storage if storage is None else storage
+        def statement(storage):
+            rows = storage.database.table(LatestValue.ENTITY_NAME)
+            for value in values:
+                row = {name: _scalar(attribute.value) for name, attribute in value.attributes.items()}
+                current = rows.get((row['device_id'], row['key_name']))
+                if current is None or row['ts'] >= current['ts']:
+                    rows[(row['device_id'], row['key_name'])] = row
+        return storage.executeAndCommit(statement)
+
+    def insert(*batches, storage=None):
+        storage = ParsedPoint.storage if storage is None else storage
+        fields = [attribute['name'] for attribute in ParsedPoint.ATTRIBUTES if not attribute.get('is_auto', False)]
+        if sum(len(batch) for batch in batches) == 0:
+            return
+        def statement(storage):
+            rows = storage.database.table(ParsedPoint.ENTITY_NAME)
+            for batch in batches:
+                for row in batch.rows(fields):
+                    point_id = storage.database.next_id(ParsedPoint.ENTITY_NAME)
+                    rows[(point_id,)] = {"id": point_id, **dict(zip(fields, row))}
+        return storage.executeAndCommit(statement)
+
+    MqttMessage.pending = pending
+    MqttMessage.receive = receive
+    DeviceActivity.record = record_activity
+    MqttSender.record = record_sender
+    PayloadSample.record = record_sample
+    LatestValue.upsert = upsert
+    ParsedPoint.insert = insert
+
+
+# --- broker ----------------------------------------------------------------
+
+BrokerMessage = namedtuple("BrokerMessage", ["topic", "payload", "qos"])
+
+
+class BrokerStandIn(object):
+
+    """
+    The flask_mqtt Mqtt extension, as used by blueprints/mqtt.py: hooks are registered with its decorators and
+    published messages matching a subscription are delivered one at a time by a network thread, as paho's loop does.
+    """
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        self.app = SimpleNamespace(logger=logger or logging.getLogger("broker"))
+        self.handlers: Dict[str, Callable] = {}
+        self.subscriptions: List[str] = []
+        self.inbox: "queue.Queue[Optional[BrokerMessage]]" = queue.Queue()
+        self.delivered = 0
+        self.dropped = 0
+        self.thread: Optional[threading.Thread] = None
+
+    def _hook(self, event: str) -> Callable:
+        def register(handler: Callable) -> Callable:
+            self.handlers[event] = handler
+            return handler
+        return register
+
+    def on_connect(self) -> Callable:
+        return self._hook("connect")
+
+    def on_disconnect(self) -> Callable:
+        return self._hook("disconnect")
+
+    def on_message(self) -> Callable:
+        return self._hook("message")
+
+    def subscribe(self, topic: str, qos: int = 0) -> Tuple[int, int]:
+        self.subscriptions.append(topic)
+        return 0, len(self.subscriptions)
+
+    def connect(self) -> None:
+        if "connect" in self.handlers:
+            self.handlers["connect"](None, None, {}, 0)
+        self.thread = threading.Thread(target=self._loop, name="broker", daemon=True)
+        self.thread.start()
+
+    def publish(self, topic: str, payload: str, qos: int = 0) -> None:
+        self.inbox.put(BrokerMessage(topic, payload.encode("utf-8") if isinstance(payload, str) else payload, qos))
+
+    def backlog(self) -> int:
+        return self.inbox.qsize()
+
+    def _loop(self) -> None:
+        while True:
+            message = self.inbox.get()
+            if message is None:
+                return
+            if any(covers(subscription, message.topic) for subscription in self.subscriptions):
+                self.handlers["message"](None, None, message)
+                self.delivered += 1
+            else:
+                self.dropped += 1
+
+    def disconnect(self) -> None:
+        """ Delivers the messages already published, then stops the network thread """
+        self.inbox.put(None)
+        if self.thread is not None:
+            self.thread.join()
+        if "disconnect" in self.handlers:
+            self.handlers["disconnect"](None, None, 0)
+
+
+# --- client destinations ---------------------------------------------------
+
+class DestinationServer(object):
+
+    """ Stands for the pymysql module of MysqlDispatcher: statements and rows received are counted per (database, table) """
+    def __init__(self):
+        self.statements = 0
+        self.rows: Dict[Tuple[str, str], int] = {}
+        self.lock = threading.Lock()
+
+    def connect(self, database=None, **kwargs) -> "_DestinationConnection":
+        return _DestinationConnection(self, database)
+
+
+class _DestinationConnection(object):
+
+    def __init__(self, server: DestinationServer, database: str):
+        self.server = server
+        self.database = database
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def cursor(self) -> "_DestinationCursor":
+        return _DestinationCursor(self)
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _DestinationCursor(object):
+
+    def __init__(self, connection: _DestinationConnection):
+        self.connection = connection
+        self.rowcount = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def executemany(self, sql: str, values: List[List[Any]]) -> None:
+        table = sql.split("`")[1]
+        server = self.connection.server
+        with server.lock:
+            server.statements += 1
+            key = (self.connection.database, table)
+            server.rows[key] = server.rows.get(key, 0) + len(values)
+        self.rowcount = len(values)
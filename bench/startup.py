@@ -0,0 +1,138 @@
+"""
+Startup benchmark of the web app: the phases of run.py timed in fresh interpreters, since import costs only show
+up once per process (and once per gunicorn worker without --preload).
+
+    python bench/startup.py [--repeat 5] [--output FILE]
+    python bench/startup.py --importtime [--top 25]     # slowest imports of run.py's dependencies (python -X importtime)
+    python bench/startup.py --profile [--top 25]        # cProfile of the registry and blueprints phases
+
+Phases (median seconds over --repeat fresh processes, each measured after the phases it depends on):
+  - interpreter: python -c pass, wall time measured by the parent
+  - context: import context (temod, temod_flask, flask)
+  - init_holders: entity and join holders filled by temod's directory scan (what run.py did before the registry)
+  - registry_cold / registry_warm: context.init_registry without / with a valid registry cache
+  - blueprints_lazy: import blueprints (attributes are imported on first access)
+  - blueprints_all: every blueprint module imported, as when all of them are enabled
+
+The database and the broker are not touched: build_app itself (languages query, MQTT connection) is not measured.
+"""
+from datetime import datetime
+from pathlib import Path
+
+import subprocess
+import statistics
+import argparse
+import platform
+import tempfile
+import json
+import time
+import sys
+import os
+
+ROOT_DIR = Path(os.path.realpath(__file__)).parent.parent
+
+CONFIG = {"temod": {"core_directory": "core", "bound_database": "mysql"}, "storage": {"credentials": {}}}
+
+PRELUDE = f"""
+import contextlib, json, os, sys, time
+sys.path.insert(0, {str(ROOT_DIR)!r})
+os.chdir({str(ROOT_DIR)!r})
+CONFIG = {CONFIG!r}
+quiet = lambda: contextlib.redirect_stdout(open(os.devnull, "w"))
+"""
+
+# phase -> (setup, measured): both are python statements run in a fresh interpreter
+PHASES = {
+    "interpreter": ("", "pass"),
+    "context": ("", "import context"),
+    "init_holders": ("import context; from temod.ext.holders import init_holders", """
+with quiet():
+    init_holders(entities_dir="core/entity", joins_dir="core/join", databases="mysql", db_credentials={})
+"""),
+    "registry_cold": ("import context; CACHE = sys.argv[1]; os.path.isfile(CACHE) and os.remove(CACHE)", "context.init_registry(CONFIG, cache_file=CACHE)"),
+    "registry_warm": ("import context; CACHE = sys.argv[1]", "context.init_registry(CONFIG, cache_file=CACHE)"),
+    "blueprints_lazy": ("import context; context.init_registry(CONFIG); context.init_context(CONFIG)", "import blueprints"),
+    "blueprints_all": ("import context; context.init_registry(CONFIG); context.init_context(CONFIG); import blueprints", """
+with quiet():
+    for name in blueprints.BLUEPRINTS:
+        getattr(blueprints, name)
+"""),
+}
+
+
+def run_phase(name, cache_file):
+    setup, measured = PHASES[name]
+    code = PRELUDE + setup + "\nstarted = time.perf_counter()\n" + measured + "\nprint(json.dumps(time.perf_counter() - started))\n"
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", code, cache_file], capture_output=True, text=True, cwd=ROOT_DIR)
+    wall = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"Phase {name} failed:\n{process.stderr}")
+    return wall if name == "interpreter" else json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def importtime(top):
+    """ Slowest cumulative imports of the web app dependencies, from python -X importtime """
+    code = PRELUDE + "import context; context.init_registry(CONFIG); context.init_context(CONFIG); import blueprints\n" + \
+        "for name in blueprints.BLUEPRINTS: getattr(blueprints, name)\n"
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, cwd=ROOT_DIR)
+    rows = []
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:") and not "cumulative" in line:
+            self_us, cumulative_us, module = [part.strip() for part in line[len("import time:"):].split("|")]
+            rows.append((int(cumulative_us), int(self_us), module))
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative_us, self_us, module in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_us/1000:>10.1f}ms {self_us/1000:>8.1f}ms  {module}")
+
+
+def profile(top):
+    """ cProfile of the registry and blueprints phases, in this process """
+    import contextlib
+    import cProfile
+    import pstats
+    os.chdir(ROOT_DIR)
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        import context
+        import blueprints
+    profiler = cProfile.Profile()
+    profiler.enable()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        context.init_registry(CONFIG)
+        context.init_context(CONFIG)
+        for name in blueprints.BLUEPRINTS:
+            getattr(blueprints, name)
+    profiler.disable()
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(prog="Startup benchmark of the web app")
+    argparser.add_argument('--repeat', type=int, default=5, help='Fresh processes per phase')
+    argparser.add_argument('--output', help='Write the results to this file', default=None)
+    argparser.add_argument('--importtime', action="store_true", help='Print the slowest imports instead', default=False)
+    argparser.add_argument('--profile', action="store_true", help='Print a cProfile of the registry and blueprints phases instead', default=False)
+    argparser.add_argument('--top', type=int, default=25, help='Lines printed by --importtime and --profile')
+    args = argparser.parse_args()
+
+    sys.path.insert(0, str(ROOT_DIR))
+    if args.importtime:
+        importtime(args.top)
+        sys.exit(0)
+    if args.profile:
+        profile(args.top)
+        sys.exit(0)
+
+    cache_file = os.path.join(tempfile.mkdtemp(prefix="mqttrelay_startup_"), "registry.json")
+    results = {}
+    print(f"{'phase':<18} {'median':>10} {'min':>10} {'max':>10}")
+    for name in PHASES:
+        timings = [run_phase(name, cache_file) for i in range(args.repeat)]
+        results[name] = {"median_s": statistics.median(timings), "min_s": min(timings), "max_s": max(timings)}
+        print(f"{name:<18} {1000*results[name]['median_s']:>8.1f}ms {1000*results[name]['min_s']:>8.1f}ms {1000*results[name]['max_s']:>8.1f}ms")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({"created_at": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(), "repeat": args.repeat, "phases": results}, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,83 @@
+"""
+Topic resolution benchmark: TopicTrie against a linear scan of the topic filters.
+
+    python bench/topic_trie.py [--patterns 100000] [--lookups 20000]
+
+Filters look like the ones of an installation: one plain topic per device (<client>/<gateway>/<device>),
+plus per client and per gateway wildcard filters.
+"""
+from pathlib import Path
+
+import argparse
+import random
+import time
+import sys
+import os
+
+sys.path.append(str(Path(os.path.realpath(__file__)).parent.parent))
+
+from tools.topic_trie import TopicTrie, covers, specificity
+
+
+def generate_patterns(count, seed=0):
+    rng = random.Random(seed)
+    patterns = []
+    clients = max(1, count // 1000)
+    while len(patterns) < count:
+        client, gateway, device = rng.randrange(clients), rng.randrange(50), rng.randrange(10**6)
+        roll = rng.random()
+        if roll < 0.9:
+            patterns.append(f"client{client}/gw{gateway}/dev{device}")
+        elif roll < 0.97:
+            patterns.append(f"client{client}/gw{gateway}/+")
+        else:
+            patterns.append(f"client{client}/#")
+    return patterns
+
+
+def generate_topics(patterns, count, seed=1):
+    rng = random.Random(seed)
+    topics = []
+    for i in range(count):
+        levels = rng.choice(patterns).split("/")
+        levels = [f"x{rng.randrange(10**6)}" if level == "+" else level for level in levels]
+        if levels[-1] == "#":
+            levels[-1:] = [f"gw{rng.randrange(50)}", f"dev{rng.randrange(10**6)}"]
+        topics.append("/".join(levels))
+    return topics
+
+
+def linear_best(patterns, topic):
+    matched = [pattern for pattern in patterns if covers(pattern, topic)]
+    return min(matched, key=specificity) if matched else None
+
+
+def measure(label, function, topics):
+    started = time.perf_counter()
+    for topic in topics:
+        function(topic)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {len(topics):>8} lookups  {elapsed:8.3f}s  {1e6*elapsed/len(topics):10.2f} us/lookup")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Benchmarks topic filters resolution")
+    parser.add_argument('--patterns', type=int, default=100000, help='Number of topic filters')
+    parser.add_argument('--lookups', type=int, default=20000, help='Number of topics resolved with the trie')
+    parser.add_argument('--linear-lookups', type=int, default=200, help='Number of topics resolved with the linear scan')
+    args = parser.parse_args()
+
+    patterns = generate_patterns(args.patterns)
+    topics = generate_topics(patterns, args.lookups)
+
+    started = time.perf_counter()
+    trie = TopicTrie((pattern, i) for i, pattern in enumerate(patterns))
+    print(f"{'trie build':<28} {len(trie):>8} filters  {time.perf_counter() - started:8.3f}s")
+
+    for topic in topics[:args.linear_lookups]:
+        assert (trie.best(topic) or (None,))[0] == linear_best(patterns, topic), topic
+
+    trie_time = measure("trie", trie.best, topics)
+    linear_time = measure("linear scan", lambda topic: linear_best(patterns, topic), topics[:args.linear_lookups])
+    print(f"speedup: x{(linear_time/args.linear_lookups)/(trie_time/len(topics)):.0f}")
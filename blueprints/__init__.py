@@ -1,12 +1,29 @@
-from .destinations import destinations_blueprint
-from .dashboard import dashboard_blueprint
-from .clients import clients_blueprint
-from .devices import devices_blueprint
-from .parsers import parsers_blueprint
-from .general import general_blueprint
-from .metrics import metrics_blueprint
-from .routes import routes_blueprint
-from .topics import topics_blueprint
-from .users import users_blueprint
-from .mqtt import mqtt_blueprint
-from .auth import auth_blueprint
\ No newline at end of file
+import importlib
+
+# Blueprints are imported on first access (PEP 562): "import blueprints" stays cheap and the
+# blueprints disabled in the configuration are never imported. Registration order of run.py.
+BLUEPRINTS = {
+	"destinations_blueprint":"destinations",
+	"dashboard_blueprint":"dashboard",
+	"clients_blueprint":"clients",
+	"devices_blueprint":"devices",
+	"parsers_blueprint":"parsers",
+	"general_blueprint":"general",
+	"metrics_blueprint":"metrics",
+	"telemetry_blueprint":"telemetry",
+	"topics_blueprint":"topics",
+	"routes_blueprint":"routes",
+	"users_blueprint":"users",
+	"mqtt_blueprint":"mqtt",
+	"auth_blueprint":"auth",
+}
+
+def __getattr__(name):
+	if not name in BLUEPRINTS:
+		raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+	blueprint = getattr(importlib.import_module(f".{BLUEPRINTS[name]}", __name__), name)
+	globals()[name] = blueprint
+	return blueprint
+
+def __dir__():
+	return sorted(list(globals()) + list(BLUEPRINTS))
@@ -40,12 +40,7 @@ def listClients(pagination):
 @login_required
 @clients_blueprint.with_dictionnary
 def newClient():
-	mqtt_messages = list(MqttMessage.storage.list())
-	client_ids = list(set([m['client'] for m in mqtt_messages]))
-	unused = []
-	for client_id in client_ids:
-		if Client.storage.get(slug=client_id) is None:
-			unused.append(client_id)
+	unused = [sender['slug'] for sender in MqttSender.unknown()]
 	return AuthenticatedUserTemplate(
 		Path(clients_blueprint.configuration["templates_folder"].format(
 				language=g.language['code'])
@@ -73,25 +68,28 @@ def viewClient(client_id):
 	if client is None:
 		return abort(404)
 
+	devices = list(DeviceFile.storage.list(client_id=client_id))
+	topics = [device['topic'] for device in devices if device['topic'] is not None]
+
+	scope = [Equals(StringAttribute("client",value=client['slug']))]
+	if len(topics):
+		scope.append(In(StringAttribute("topic"),*[StringAttribute("topic",value=topic) for topic in topics]))
+	activities = list(DeviceActivity.storage.list(Or(*scope)))
+
+	client_activities = [activity for activity in activities if activity['client'] == client['slug']]
 	client_stats = {"devices":{}}
-	lastest_message = list(MqttMessage.storage.list(client=client['slug'],orderby="at DESC",limit=1)) 
-	client_stats['lastest_message'] = lastest_message[0]['at'] if len(lastest_message) else None
-	client_stats['total_messages'] = MqttMessage.storage.count(client=client['slug'])
+	client_stats['lastest_message'] = max([activity['last_seen'] for activity in client_activities]) if len(client_activities) else None
+	client_stats['total_messages'] = sum([activity['message_count'] for activity in client_activities])
 
-	devices = list(DeviceFile.storage.list(client_id=client_id))
+	activities = {activity['topic']:activity for activity in activities}
+	now = datetime.now()
 	for device in devices:
 		if device['topic'] is not None:
-
-			messages = list(MqttMessage.storage.list(topic=device['topic'],orderby="at DESC",limit=1)) 
-			client_stats['devices'][device['id']] = {"last_message":messages[0]['at'] if len(messages) else None}
-
-			first_message = list(MqttMessage.storage.list(client=client['slug'],orderby="at ASC",limit=1))
-			first_message = first_message[0] if len(first_message) else None
-			if first_message is not None:
-				therical_output = (datetime.now()-first_message['at']).total_seconds()/(device['emission_rate']/1000)
-				client_stats['devices'][device['id']]['availability'] = 100*MqttMessage.storage.count(topic=device['topic'])/therical_output
-			else:
-				client_stats['devices'][device['id']]['availability'] = 0
+			activity = activities.get(device['topic'])
+			client_stats['devices'][device['id']] = {
+				"last_message":activity['last_seen'] if activity is not None else None,
+				"availability":activity.availability(device['emission_rate'], now=now) if activity is not None else 0
+			}
 
 	client_stats['availability'] = ((sum([device_stats['availability'] for device, device_stats in client_stats['devices'].items()])/len(client_stats['devices'])) if len(client_stats['devices']) else 0)
 
@@ -146,6 +144,23 @@ def getDevice(client_id,device_id):
 	return device
 
 
+@clients_blueprint.route('/client/<int:client_id>/device/<int:device_id>/latest', methods=["GET"])
+@login_required
+def getDeviceSnapshot(client_id,device_id):
+	device = Device.storage.get(id=device_id)
+	if device is None or device['client_id'] != client_id:
+		return abort(404)
+
+	keys = [key.strip() for key in request.args.get('keys','').split(',') if key.strip() != ""]
+	conditions = [In(StringAttribute("key_name"),*[StringAttribute("key_name",value=key) for key in keys])] if len(keys) else []
+
+	values = {}
+	for value in LatestValue.storage.list(*conditions, device_id=device['id']):
+		values[value['key_name']] = {k:v for k,v in value.to_dict().items() if not k in ["device_id","key_name"]}
+		values[value['key_name']]['quality'] = value['quality'].name
+	return {"device_id":device['id'], "values":values}
+
+
 @clients_blueprint.route('/client/<int:client_id>/device', methods=["POST"])
 @login_required
 @body_content('json')
@@ -223,8 +238,10 @@ def addDestination(form, client_id):
 	if cc is None:
 		return {"status":"error","error":"No secret crypto defined"}
 
+	key = cc.key()
 	destination = ClientDestination(
-		id=-1, client_id=client_id,created_at=datetime.now(),password_enc=cc.encrypt(form['password'], CryptoKey.get_key_bytes(cc['key_source'], cc['key_id'])).encode('ascii'),**form
+		id=-1, client_id=client_id,created_at=datetime.now(),password_enc=cc.encrypt(form['password'], key, subkeys=cc.subkeys(key)).encode('ascii'),
+		encryption_version=f"{cc['key_id']}.{cc['version']}",**form
 	)
 	destination = ClientDestination.storage.create(destination)
 	return {"status":"created", "data":client.to_dict()}
@@ -247,7 +264,9 @@ def editDestination(form,client_id,destination_id):
 
 
 	if not(form.get('password','') in [None,""]):
-		destination['password_enc'] = cc.encrypt(form['password'], CryptoKey.get_key_bytes(cc['key_source'], cc['key_id'])).encode('ascii')
+		key = cc.key()
+		destination['password_enc'] = cc.encrypt(form['password'], key, subkeys=cc.subkeys(key)).encode('ascii')
+		destination['encryption_version'] = f"{cc['key_id']}.{cc['version']}"
 
 	destination.setAttributes(
 		**{field: form.get(field, destination[field]) for field in ClientDestination.UPDATABLE_FIELDS}
@@ -1,4 +1,4 @@
-from flask import current_app, render_template, request, redirect, url_for, abort, session,g,jsonify
+from flask import current_app, render_template, request, redirect, url_for, abort, session,g,jsonify,Response
 from flask_login import LoginManager, login_required, current_user
 
 from temod_flask.utils.content_readers import body_content
@@ -19,6 +19,9 @@ import json
 dashboard_blueprint = MultiLanguageBlueprint('dashboard',__name__, load_in_g=True, default_config={
 	"templates_folder":"{language}/dashboard",
 	"general_per_page":100,
+	"kpi_refresh":15, # seconds between two database refreshes of the streamed KPIs
+	"kpi_push_interval":5, # seconds between two stream checks
+	"kpi_stream_duration":300, # seconds before a stream is closed (the browser reconnects)
 }, dictionnary_selector=lambda lg:lg['code'])
 
 
@@ -189,4 +192,36 @@ def dispatch_series_data():
 		return jsonify(payload)
 	except Exception as e:
 		traceback.print_exc()
-		return jsonify({"labels": [], "datasets": [], "error": str(e)}), 500
\ No newline at end of file
+		return jsonify({"labels": [], "datasets": [], "error": str(e)}), 500
+
+
+
+@dashboard_blueprint.route('/dashboard/api/critical/stream', methods=['GET'])
+@login_required
+def critical_kpis_stream():
+	"""
+	Server-Sent Events stream of the critical KPIs (ingest_rate, parse_success, dispatch_success, processing_backlog).
+	Query params: same as the single KPI endpoints (range, client).
+	Events: 'kpi' with the KPIs that changed since the previous event.
+	"""
+	rng = request.args.get("range", "2h")
+	client_raw = request.args.get("client")
+
+	client_id: Optional[int] = None
+	client_slug: Optional[str] = None
+	if client_raw:
+		try:
+			client_id = int(client_raw)
+		except ValueError:
+			client_slug = client_raw
+
+	live.AGGREGATOR.refresh_interval = dashboard_blueprint.configuration["kpi_refresh"]
+	return Response(
+		live.AGGREGATOR.stream(
+			range_str=rng, client_id=client_id, client_slug=client_slug,
+			push_interval=dashboard_blueprint.configuration["kpi_push_interval"],
+			max_duration=dashboard_blueprint.configuration["kpi_stream_duration"]
+		),
+		mimetype="text/event-stream",
+		headers={"Cache-Control":"no-cache", "X-Accel-Buffering":"no"}
+	)
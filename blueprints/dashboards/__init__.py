@@ -1 +1 @@
-from . import ingest_rate, parse_success, dispatch_success, processing_backlog, throughput_series, dispatch_series
\ No newline at end of file
+from . import ingest_rate, parse_success, dispatch_success, processing_backlog, throughput_series, dispatch_series, live
\ No newline at end of file
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, Tuple, Iterator
+from collections import deque
+
+from tools import json_codec
+
+import threading
+import time
+
+from . import ingest_rate, parse_success, dispatch_success, processing_backlog
+
+
+# ---------- helpers ----------
+
+def _parse_range_to_seconds(s: str) -> int:
+    if not s:
+        return 2 * 60 * 60
+    s = s.strip().lower()
+    try:
+        if s.endswith("m"): return int(s[:-1]) * 60
+        if s.endswith("h"): return int(s[:-1]) * 3600
+        if s.endswith("d"): return int(s[:-1]) * 86400
+        return int(s) * 60  # bare minutes
+    except Exception:
+        return 2 * 60 * 60
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json_codec.dumps(data)}\n\n"
+
+
+# ---------- aggregator ----------
+
+class KpiAggregator(object):
+    """
+    In-process KPI source shared by every dashboard stream of a worker.
+
+    - Ingest counts are fed by the mqtt blueprint (record_ingest) into per-minute buckets,
+      so the global ingest rate costs no query once ingestion has run here for the requested range.
+      They are not kept per client: client-scoped rates are computed in SQL.
+    - KPIs produced by the transfer service (parse/dispatch success, backlog) live in the database:
+      they are recomputed at most once per refresh_interval per (range, client), whatever the
+      number of connected viewers.
+    """
+
+    MAX_BUCKETS = 24 * 60  # 24h of per-minute buckets
+
+    def __init__(self, refresh_interval: int = 15):
+        super(KpiAggregator, self).__init__()
+        self.refresh_interval = refresh_interval
+        self.started_at: Optional[float] = None  # set when the ingestor runs in this process
+        self.buckets = deque(maxlen=KpiAggregator.MAX_BUCKETS)  # (minute epoch, count)
+        self.cache: Dict[Tuple, Tuple[float, Dict[str, Any]]] = {}
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()  # a single database refresh at a time, shared by all streams
+
+    def attach_ingest(self) -> None:
+        """Declare that messages are ingested by this process: counters start being trusted from now on."""
+        self.started_at = time.time()
+
+    def record_ingest(self, count: int = 1, at: Optional[float] = None) -> None:
+        minute = int((time.time() if at is None else at) // 60)
+        with self.lock:
+            if len(self.buckets) and self.buckets[-1][0] == minute:
+                self.buckets[-1] = (minute, self.buckets[-1][1] + count)
+            else:
+                self.buckets.append((minute, count))
+
+    def ingest_rate(self, seconds: int) -> Optional[float]:
+        """Messages per minute over the last 'seconds', None if the counters don't cover the window."""
+        now = time.time()
+        if self.started_at is None or seconds > KpiAggregator.MAX_BUCKETS * 60 or now - self.started_at < seconds:
+            return None
+        since = int((now - seconds) // 60)
+        with self.lock:
+            count = sum(c for minute, c in self.buckets if minute >= since)
+        return float(count) / (seconds / 60.0)
+
+    def snapshot(self, range_str: str = "2h", client_id: Optional[int] = None, client_slug: Optional[str] = None) -> Dict[str, Any]:
+        key = (range_str, client_id, client_slug)
+        with self.refresh_lock:
+            cached = self.cache.get(key)
+            if cached is not None and time.time() - cached[0] < self.refresh_interval:
+                return cached[1]
+            values = self._compute(range_str, client_id, client_slug)
+            self.cache[key] = (time.time(), values)
+        return values
+
+    def _compute(self, range_str: str, client_id: Optional[int], client_slug: Optional[str]) -> Dict[str, Any]:
+        seconds = max(_parse_range_to_seconds(range_str), 60)
+        # the in-process counters are global: a client-scoped dashboard gets its rate from the database
+        rate = self.ingest_rate(seconds) if client_id is None and not client_slug else None
+        if rate is None:
+            rate = ingest_rate.compute(range_str=range_str, client_id=client_id, client_slug_or_name=client_slug)
+
+        return {
+            "ingest_rate": round(rate, 1),
+            "parse_success": round(parse_success.compute(range_str=range_str, client_id=client_id, client_slug_or_name=client_slug), 1),
+            "dispatch_success": round(dispatch_success.compute(range_str=range_str, client_id=client_id, client_slug_or_name=client_slug), 1),
+            "processing_backlog": processing_backlog.compute(client_id=client_id, client_slug_or_name=client_slug),
+        }
+
+    def stream(
+        self,
+        range_str: str = "2h",
+        client_id: Optional[int] = None,
+        client_slug: Optional[str] = None,
+        push_interval: int = 5,
+        max_duration: int = 300,
+    ) -> Iterator[str]:
+        """
+        Server-Sent Events generator: a full 'kpi' event first, then only the changed KPIs.
+        The stream ends after max_duration so workers are released; EventSource reconnects by itself.
+        """
+        last: Dict[str, Any] = {}
+        ends_at = time.time() + max_duration
+        yield f"retry: {push_interval * 1000}\n\n"
+        while time.time() < ends_at:
+            try:
+                current = self.snapshot(range_str=range_str, client_id=client_id, client_slug=client_slug)
+                delta = {k: v for k, v in current.items() if last.get(k) != v}
+                if delta:
+                    yield _sse("kpi", delta)
+                    last.update(delta)
+                else:
+                    yield ": keep-alive\n\n"
+            except Exception as e:
+                yield _sse("kpi-error", {"error": str(e)})
+            time.sleep(push_interval)
+
+
+AGGREGATOR = KpiAggregator()
@@ -29,6 +29,7 @@ def compute(
     Count unprocessed MQTT messages.
 
     Schema:
+      pending_message(id, topic, at): queue of the unprocessed messages (filled at ingest, emptied by the transfer)
       mqtt_messages(id, client, topic, at, processed, ...)
       mqtt_topic(topic UNIQUE, client_id, device_id, ...)
       device(id, client_id, ...)
@@ -40,8 +41,7 @@ def compute(
 
     Returns: integer count
 
-    Performance tip: add an index like
-      CREATE INDEX idx_processed_at ON mqtt_messages (processed, at);
+    The count reads pending_message, so it costs O(backlog) instead of O(history).
     """
     '''where = ["m.processed = 0"]
     params = []
@@ -70,4 +70,4 @@ def compute(
         if secs > 0:
             since = datetime.now(timezone.utc) - timedelta(seconds=secs)
 
-    return MqttMessage.storage.count(*([Superior(DateTimeAttribute("at",value=since))] if since else []),processed=False)
\ No newline at end of file
+    return PendingMessage.storage.count(*([Superior(DateTimeAttribute("at",value=since))] if since else []))
\ No newline at end of file
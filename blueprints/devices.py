@@ -79,14 +79,24 @@ def viewExampleData(device_id):
 	if device is None:
 		return abort(404)
 
-	examples = list(Device.storage.list(Not(Equals(StringAttribute("topic"))),device_type_id=device['id']))
-	for example in examples:
-		message = MqttMessage.storage.get(topic=example['topic'])
-		if message is not None:
-			return message['payload']
+	samples = list(PayloadSample.storage.list(device_type_id=device['id'],orderby="at DESC",limit=1))
+	if len(samples):
+		return samples[0]['payload']
 	return {}
 
 
+@devices_blueprint.route('/device/<int:device_id>/examples')
+@login_required
+def listExampleData(device_id):
+	device = DeviceType.storage.get(id=device_id)
+	if device is None:
+		return abort(404)
+
+	return {"samples":[
+		sample.to_dict() for sample in PayloadSample.storage.list(device_type_id=device['id'],orderby="at DESC",limit=PayloadSample.SLOTS)
+	]}
+
+
 @devices_blueprint.route('/device/unique')
 @login_required
 @devices_blueprint.with_dictionnary
@@ -11,6 +11,8 @@ from temod.base.attribute import *
 from front.renderers.users import AuthenticatedUserTemplate
 from typing import Optional, Iterable, Tuple
 
+from tools.credentials import CREDENTIALS
+from tools import reencryption
 from tools.crypto_envelopes import (
 	encrypt_aes_gcm, decrypt_aes_gcm,
 	encrypt_chacha20poly1305, decrypt_chacha20poly1305,
@@ -53,6 +55,9 @@ def _decrypt_token(token: str, key_for_id) -> bytes:
 general_blueprint = MultiLanguageBlueprint('general',__name__, load_in_g=True, default_config={
 	"templates_folder":"{language}/general",
 	"general_per_page":100,
+	"reencryption_state_file":"db/jobs/reencryption.json",
+	"reencryption_chunk_size":200,
+	"reencryption_workers":4,
 }, dictionnary_selector=lambda lg:lg['code'])
 
 
@@ -94,6 +99,8 @@ def updateCrypto(form):
 	crypto_config.setAttributes(**form)
 
 	CryptoConfig.storage.updateOnSnapshot(crypto_config)
+	# the key source, key id or algorithm may have changed
+	CREDENTIALS.invalidate()
 	return crypto_config.to_dict()
 
 
@@ -107,14 +114,14 @@ def testCrypto(form):
 	plaintext = form.get("plaintext", "")
 
 	try:
-		key = CryptoKey.get_key_bytes(crypto_config['key_source'], crypto_config['key_id'])
+		key = crypto_config.key()
 	except Exception as e:
 		traceback.print_exc()
 		return _bad(f"Key load failed: {e}", 400)
 
 	try:
-		token = crypto_config.encrypt(plaintext, key)
-		out = decrypt_data(token, key, key_id=crypto_config['key_id'])
+		token = crypto_config.encrypt(plaintext, key, subkeys=crypto_config.subkeys(key))
+		out = crypto_config.decrypt(token)
 		return jsonify({
 			"ciphertext": token,
 			"decrypted": out.decode("utf-8", "replace")
@@ -166,6 +173,10 @@ def rotateCryptoKey(form):
 		return _bad(f"Unsupported key_source: {cfg['key_source']}", 400)
 
 	CryptoConfig.storage.updateOnSnapshot(cfg)
+	# cached keys, subkeys and secrets of the rotated key must not outlive the rotation
+	CREDENTIALS.invalidate(key_id)
+	if key_id != cfg['key_id']:
+		CREDENTIALS.invalidate(cfg['key_id'])
 
 	return jsonify({"message": msg, "config": cfg.to_dict()})
 
@@ -175,49 +186,34 @@ def rotateCryptoKey(form):
 @general_blueprint.with_dictionnary
 def reCrypto():
 	"""
-	Re-encrypt all stored passwords in ServiceCredential that are not using
-	the active (algorithm, key_id). Assumes each row stores the key_id used.
+	Starts re-encrypting, in the background, the stored passwords that are not encrypted under the
+	active (key_id, version). Progress is served by getReCryptoProgress; an interrupted job resumes where it stopped.
 	"""
-	cfg = CryptoConfig.storage.get().takeSnapshot()
-
-	# load active key once
-	try:
-		active_key = CryptoKey.get_key_bytes(cfg['key_source'], cfg['key_id'])
-	except Exception as e:
-		traceback.print_exc()
-		return _bad(f"Key load failed: {e}", 400)
-
-	updated = 0
-	failed  = 0
-
-	objects_with_credentials = [ClientDestination]
-
-	for object_with_credentials in objects_with_credentials:
-		for obj in object_with_credentials.storage.list(Not(Equals(StringAttribute("encryption_version",value=f"{cfg['key_id']}.{cfg['version']}"))),Not(Equals(StringAttribute("encryption_version")))):
-			try:
-				# old key source & id assumed same as current cfg.key_source but row.key_id may differ.
-				# If you mix sources per-row, add a column and branch key retrieval here.
-				obj.takeSnapshot()
-
-				old_key_id = CryptoKey.storage.get(version=int(obj['encryption_version'].split('.')[1]),key_id=obj['encryption_version'].split('.')[0])['key_id']
-				old_key = CryptoKey.get_key_bytes(cfg['key_source'], old_key_id)
-				print(old_key_id, old_key, obj['password_enc'].decode('ascii'))
-
-				# Decrypt using old key id (our tokens include alg but not key id)
-				plaintext = decrypt_data(obj['password_enc'].decode('ascii'), old_key, key_id=old_key_id)
-
-				# Encrypt with active cfg & active_key
-				new_token = cfg.encrypt(plaintext, active_key)
-
-				obj['password_enc'] = new_token.encode('ascii')
-				obj['encryption_version'] = f"{cfg['key_id']}.{cfg['version']}"
-				updated += 1
-
-				object_with_credentials.storage.updateOnSnapshot(obj)
+	state_file = general_blueprint.configuration["reencryption_state_file"]
+	# checking that no job runs and starting one is atomic across the threads and worker processes of the app
+	with reencryption.locked(state_file):
+		state = reencryption.load_state(state_file)
+		if state.get("state") == "running":
+			return jsonify({"message": "A re-encryption is already running", "progress": reencryption.progress(state)}), 409
+
+		cfg = CryptoConfig.storage.get()
+
+		# check the active key once before starting
+		try:
+			cfg.key()
+		except Exception as e:
+			traceback.print_exc()
+			return _bad(f"Key load failed: {e}", 400)
+
+		job = reencryption.ReencryptionJob(
+			[ClientDestination], cfg, state_file,
+			chunk_size=general_blueprint.configuration["reencryption_chunk_size"], workers=general_blueprint.configuration["reencryption_workers"]
+		)
+		job.start()
+	return jsonify({"message": "Re-encryption started", "progress": reencryption.progress(reencryption.load_state(state_file))}), 202
 
-			except Exception:
-				traceback.print_exc()
-				failed += 1
-				# (Optional) collect IDs to report
 
-	return jsonify({"message": "Re-encryption complete", "updated_count": updated, "failed_count": failed})
+@general_blueprint.route('/crypto/progress', methods=['GET'])
+@login_required
+def getReCryptoProgress():
+	return jsonify(reencryption.progress(reencryption.load_state(general_blueprint.configuration["reencryption_state_file"])))
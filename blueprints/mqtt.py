@@ -1,22 +1,48 @@
 from temod_flask.blueprint import Blueprint
 
+from .dashboards import live
+
+from tools.topic_trie import covers
+from tools.transactions import Transaction
+from tools import metrics
+
 from datetime import datetime, date
 
 import traceback
 import json
+import time
 import os
 
 
-mqtt_blueprint = Blueprint('mqtt',__name__, default_config={})
+mqtt_blueprint = Blueprint('mqtt',__name__, default_config={
+    "sample_interval":300, # min seconds between two payload samples of a same topic
+    "subscriptions":["+/+/+"], # topic filters always subscribed to
+    "subscribe_topics":True, # also subscribe to the active mqtt_topic definitions (plain or +/# filters) not covered above
+})
 
 
 def setup_mqtt(mqtt):
 
+    # declared by the ingesting process only: a web app without ingest serves those of the ingestor (its textfile)
+    INGESTED = metrics.counter("mqttrelay_ingested_messages_total", "Mqtt messages stored by the ingestor")
+    INGEST_FAILURES = metrics.counter("mqttrelay_ingest_failures_total", "Ingest steps that failed", ["stage"])
+    INGEST_DURATION = metrics.histogram("mqttrelay_ingest_duration_seconds", "Time spent handling a received mqtt message")
+
+    last_sampled = {}
+    live.AGGREGATOR.attach_ingest()
+
     # MQTT hooks
     @mqtt.on_connect()
     def handle_connect(client, userdata, flags, rc):
         mqtt.app.logger.info(f"Connected to MQTT broker with result code {rc}")
-        mqtt.subscribe("+/+/+", qos=0)
+        subscriptions = list(mqtt_blueprint.configuration["subscriptions"])
+        if mqtt_blueprint.configuration["subscribe_topics"]:
+            for topic in MqttTopic.storage.list(active=True):
+                if not any(covers(subscription, topic['topic']) for subscription in subscriptions):
+                    subscriptions.append(topic['topic'])
+        for subscription in subscriptions:
+            mqtt.subscribe(subscription, qos=0)
+        mqtt.app.logger.info(f"Subscribed to {len(subscriptions)} topic filters")
 
     @mqtt.on_disconnect()
     def handle_disconnect(client, userdata, rc):
@@ -24,13 +50,35 @@ def setup_mqtt(mqtt):
 
     @mqtt.on_message()
     def handle_mqtt_message(client, userdata, message):
+        started = time.perf_counter()
+        received_at = datetime.now()
+        payload = message.payload.decode("utf-8", errors="replace") if message.payload else None
+        sample = (received_at - last_sampled.get(message.topic, datetime.min)).total_seconds() >= mqtt_blueprint.configuration["sample_interval"]
         try:
-            MqttMessage.storage.create(MqttMessage(
-                id=-1, client=message.topic.split("/")[0], topic=message.topic, payload=message.payload.decode("utf-8", errors="replace") if message.payload else None,
-                qos=message.qos, at=datetime.now()
-            ))
+            # one connection and one commit per message: the message and its queue entry are stored atomically,
+            # the activity, sender and sample upserts are rolled back alone when they fail
+            with Transaction(MqttMessage.storage) as transaction:
+                message_id = MqttMessage.receive(message.topic, payload, message.qos, received_at, storage=transaction)
+                transaction.savepoint("bookkeeping")
+                try:
+                    DeviceActivity.record(message.topic, message.topic.split("/")[0], received_at, storage=transaction)
+                    MqttSender.record(message.topic.split("/")[0], received_at, storage=transaction)
+                    if sample:
+                        PayloadSample.record(message.topic, payload, received_at, storage=transaction)
+                except Exception as e:
+                    transaction.rollback_to("bookkeeping")
+                    INGEST_FAILURES.inc(stage="activity")
+                    mqtt.app.logger.exception(f"Failed to update activity of topic {message.topic}: {e}")
+                else:
+                    if sample:
+                        last_sampled[message.topic] = received_at
         except Exception as e:
+            INGEST_FAILURES.inc(stage="store")
             mqtt.app.logger.exception(f"Failed to store message from topic {message.topic}: {e}")
+            return
+        live.AGGREGATOR.record_ingest()
+        INGESTED.inc()
+        INGEST_DURATION.observe(time.perf_counter() - started)
 
     return mqtt_blueprint
 
@@ -0,0 +1,50 @@
+from flask import request, abort, Response
+from flask_login import login_required
+
+from temod_flask.blueprint import Blueprint
+
+from tools import metrics
+
+import traceback
+import hmac
+import os
+
+
+telemetry_blueprint = Blueprint('telemetry',__name__, default_config={
+	"token":"", # when set, scrapers must send 'Authorization: Bearer <token>', otherwise the metrics require a logged in user
+	"textfiles":["db/metrics/ingestor.prom","db/metrics/mqtt_transfer.prom"], # metrics written by the services, relative to the app root
+})
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+metrics.gauge("mqttrelay_backlog_messages", "Messages waiting to be processed by the Mqtt Transfer service").set_function(
+	lambda: PendingMessage.storage.count()
+)
+
+
+@telemetry_blueprint.route('/telemetry/metrics', methods=['GET'])
+def prometheusMetrics():
+	"""
+	Metrics of this web app process (ingest, backlog), followed by the ones last written by the services.
+	Scrapers authenticate with the configured token; without one, the metrics are served to logged in users only.
+	"""
+	token = telemetry_blueprint.configuration["token"]
+	if not token:
+		return login_required(_exposition)()
+	if not hmac.compare_digest(request.headers.get("Authorization",""), f"Bearer {token}"):
+		return abort(401)
+	return _exposition()
+
+
+def _exposition():
+	exposition = [metrics.REGISTRY.render()]
+	for textfile in telemetry_blueprint.configuration["textfiles"]:
+		path = os.path.join(ROOT_DIR, textfile)
+		if not os.path.isfile(path):
+			continue
+		try:
+			with open(path, encoding='utf-8') as file:
+				exposition.append(file.read())
+		except OSError:
+			traceback.print_exc()
+	return Response("".join(exposition), mimetype=None, content_type=metrics.CONTENT_TYPE)
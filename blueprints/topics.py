@@ -6,6 +6,7 @@ from temod_flask.blueprint import MultiLanguageBlueprint
 from temod_flask.blueprint.utils import Paginator
 
 from front.renderers.users import AuthenticatedUserTemplate
+from tools.topic_trie import validate as validate_topic_filter
 
 from temod.base.attribute import *
 from temod.base.condition import *
@@ -65,6 +66,10 @@ def newTopic():
 @body_content('form')
 def createTopic(form):
 	topic = MqttTopic(id=-1,active=form.pop('active','on').lower() in ["on","1"],created_at=datetime.now(),**form)
+	try:
+		validate_topic_filter(topic['topic'])
+	except ValueError:
+		return abort(400)
 	MqttTopic.storage.create(topic)
 	return redirect(url_for("topics.listTopics"))
 
@@ -1,9 +1,14 @@
-from temod.ext.holders import clusters, joins, entities
+from temod.ext.holders import clusters, joins, entities, STORAGE_FROM_NAME
 from temod_flask.ext import _readers_holder as _FormReaders
 from temod.storage.directory import DirectoryStorage
+from temod.base import Entity, Join
 
+import importlib
+import threading
+import hashlib
 import dotenv
 import random
+import json
 import os
 
 
@@ -33,6 +38,117 @@ def init_context(config):
 	dotenv.load_dotenv()
 
 
+# ** Section ** EntityRegistry
+REGISTRY_KINDS = [("entity", Entity, entities, "_entities_"), ("join", Join, joins, "_joins_")]
+
+def _registry_signature(core_directory):
+	files = []
+	for kind, base, holder, attribute in REGISTRY_KINDS:
+		directory = os.path.join(core_directory, kind)
+		for file in sorted(os.listdir(directory)):
+			if file.endswith('.py') and file != "__init__.py":
+				stat = os.stat(os.path.join(directory, file))
+				files.append([kind, file, stat.st_mtime_ns, stat.st_size])
+	return hashlib.sha1(json.dumps(files).encode()).hexdigest()
+
+def _core_package(core_directory):
+	# the parent of core_directory is on sys.path: the join modules import core.constraints
+	return os.path.basename(os.path.normpath(core_directory))
+
+def build_registry(core_directory):
+	"""
+	{"entity":{module:[class names]}, "join":{...}}: the temod classes defined in each module of core/entity and core/join
+	"""
+	registry = {"signature":_registry_signature(core_directory)}
+	for kind, base, holder, attribute in REGISTRY_KINDS:
+		registry[kind] = {}
+		for file in sorted(os.listdir(os.path.join(core_directory, kind))):
+			if not file.endswith('.py') or file == "__init__.py":
+				continue
+			module = importlib.import_module(f"{_core_package(core_directory)}.{kind}.{file[:-3]}")
+			registry[kind][file[:-3]] = [
+				name for name, value in vars(module).items()
+				if isinstance(value, type) and issubclass(value, base) and value is not base and value.__module__ == module.__name__
+			]
+	return registry
+
+def load_registry(core_directory, cache_file=None):
+	"""
+	The registry compiled in cache_file, rebuilt (and saved) when a module of core/entity or core/join changed
+	"""
+	if cache_file and os.path.isfile(cache_file):
+		try:
+			with open(cache_file) as file:
+				registry = json.load(file)
+			if registry.get("signature") == _registry_signature(core_directory):
+				return registry
+		except (OSError, ValueError):
+			pass
+	registry = build_registry(core_directory)
+	if cache_file:
+		os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+		with open(cache_file+".part", "w") as file:
+			json.dump(registry, file)
+		os.replace(cache_file+".part", cache_file)
+	return registry
+
+def init_registry(config, cache_file=None):
+	"""
+	Fills the temod holders like init_holders does, from the registry: modules are imported once as packages
+	(core.entity.*, core.join.*: bytecode cached and shared with core.constraints and the services, instead of
+	being executed a second time from their file) and the directories are not scanned while the cache is valid.
+	"""
+	core_directory = config['temod']['core_directory']
+	registry = load_registry(core_directory, cache_file=cache_file)
+	for kind, base, holder, attribute in REGISTRY_KINDS:
+		modules = getattr(holder, attribute)
+		for module_name, names in registry[kind].items():
+			module = importlib.import_module(f"{_core_package(core_directory)}.{kind}.{module_name}")
+			modules[module_name] = {"__module__":module, **{name:getattr(module, name) for name in names}}
+		holder.set_unique_storage(thread_safe_storage(STORAGE_FROM_NAME[config['temod']['bound_database']][kind]), config['storage']['credentials'])
+	return registry
+
+class _ThreadConnexion(object):
+	"""
+	The 'connexion' attribute of a thread safe storage: each thread opens, uses and closes a connection of its own
+	"""
+	def __get__(self, storage, owner=None):
+		if storage is None:
+			return self
+		return getattr(storage._connexions, "connexion", None)
+
+	def __set__(self, storage, connexion):
+		storage._connexions.connexion = connexion
+
+_THREAD_SAFE_STORAGES = {}
+
+def thread_safe_storage(storage_type):
+	"""
+	A subclass of a temod storage type whose connection is per thread. temod storages keep a single connection,
+	opened on first use and closed after each query: a storage shared by the threads of a gunicorn worker (or of a
+	ThreadPoolExecutor) would have a thread run its query on a connection another thread is closing.
+	"""
+	if storage_type not in _THREAD_SAFE_STORAGES:
+		def __init__(self, *args, **kwargs):
+			self._connexions = threading.local()
+			storage_type.__init__(self, *args, **kwargs)
+		_THREAD_SAFE_STORAGES[storage_type] = type(storage_type.__name__, (storage_type,), {"__init__":__init__, "connexion":_ThreadConnexion()})
+	return _THREAD_SAFE_STORAGES[storage_type]
+
+def reset_connections():
+	"""
+	Forgets the database connections opened by the storages of the holders, e.g. in a gunicorn worker forked from a
+	preloaded master: the inherited sockets belong to the master, each worker opens its own on first use.
+	Connections are per thread (see thread_safe_storage): the ones of the calling thread are forgotten.
+	"""
+	for holder in (entities, joins, clusters):
+		for entity in holder.list():
+			storage = getattr(entity, 'storage', None)
+			if getattr(storage, 'connexion', None) is not None:
+				storage.connexion = None
+# ** EndSection ** EntityRegistry
+
+
 # ** Section ** GenerateSecretKey
 def generate_secret_key(length=8):
 	alphabet = "abcdefghijklmnopqrstuvwxyz0123456789?!,;:./§$£*µù%+=°)àç_è-('é&²~"
@@ -3,12 +3,9 @@ from temod.base.entity import Entity
 from temod.base.attribute import *
 from copy import deepcopy
 
-from tools.crypto_envelopes import (
-    encrypt_aes_gcm, decrypt_aes_gcm,
-    encrypt_chacha20poly1305, decrypt_chacha20poly1305,
-    encrypt_aes_cbc_hmac, decrypt_aes_cbc_hmac,
-    decrypt_data 
-)
+# tools.crypto_envelopes (and the cryptography package) is imported by the methods using it: loading the entities
+# stays cheap for the processes that never encrypt
+from tools.credentials import CREDENTIALS
 
 import base64
 import os
@@ -62,11 +59,42 @@ class CryptoConfig(Entity):
 	]
 
 
-	def encrypt(self, plaintext: bytes | str, key: bytes) -> str:
+	def key(self, key_id: str = None, version: int = None, storage=None) -> bytes:
+		"""
+		Master key of the configuration, or of an older (key_id, version) when decrypting old tokens.
+		Memoized per (key_source, key_id, version) in CREDENTIALS until its TTL or the next rotation.
+		storage: CryptoKey storage, for processes where CryptoKey.storage isn't bound (mqtt_transfer)
+		"""
+		active = key_id is None and version is None
+		key_id = self['key_id'] if key_id is None else key_id
+		version = self['version'] if version is None else version
+		return CREDENTIALS.master_key(self['key_source'], key_id, version, lambda key_source, key_id: CryptoKey.get_key_bytes(
+			key_source, key_id, version=None if active else version, storage=storage
+		))
+
+	def subkeys(self, key: bytes, key_id: str = None, version: int = None):
+		""" Memoized CBC-HMAC subkeys of key (None for the AEAD algorithms, which use the key directly) """
+		if self['algorithm'].name.lower() != "aes-256-cbc-hmac":
+			return None
+		return CREDENTIALS.cbc_hmac_keys(key, self['key_id'] if key_id is None else key_id, self['version'] if version is None else version)
+
+	def decrypt(self, token: str, key_id: str = None, version: int = None, storage=None) -> bytes:
+		""" Decrypts a token encrypted under (key_id, version), the active key by default """
+		key_id = self['key_id'] if key_id is None else key_id
+		key = self.key(key_id, version, storage=storage)
+		subkeys = None
+		if token.split(".", 2)[1:2] == ["aes-256-cbc-hmac"]:
+			subkeys = CREDENTIALS.cbc_hmac_keys(key, key_id, self['version'] if version is None else version)
+		from tools.crypto_envelopes import decrypt_data
+		return decrypt_data(token, key, key_id=key_id, subkeys=subkeys)
+
+	def encrypt(self, plaintext: bytes | str, key: bytes, subkeys=None) -> str:
 		"""
 		Produce a versioned token that matches the UI expectation:
 		  v1.<alg>.<parts...>
+		subkeys: pre-derived CBC-HMAC keys (see subkeys), derived from key otherwise
 		"""
+		from tools.crypto_envelopes import encrypt_aes_gcm, encrypt_chacha20poly1305, encrypt_aes_cbc_hmac
 		alg = self['algorithm'].name.lower()
 		if alg == "aes-256-gcm":
 			inner = encrypt_aes_gcm(plaintext, key, iv_bytes=self['iv_bytes'])
@@ -75,7 +103,7 @@ class CryptoConfig(Entity):
 			inner = encrypt_chacha20poly1305(plaintext, key, nonce_bytes=self['iv_bytes'])
 			return f"v1.chacha20-poly1305.{inner}"
 		elif alg == "aes-256-cbc-hmac":
-			inner = encrypt_aes_cbc_hmac(plaintext, master_key=key, key_id=self['key_id'], iv_bytes=max(self['iv_bytes'], 16))
+			inner = encrypt_aes_cbc_hmac(plaintext, master_key=key, key_id=self['key_id'], iv_bytes=max(self['iv_bytes'], 16), subkeys=subkeys)
 			return f"v1.aes-256-cbc-hmac.{inner}"
 		else:
 			raise ValueError(f"Unknown algorithm: {self['algorithm']}")
@@ -124,15 +152,18 @@ class CryptoKey(Entity):
 			raise RuntimeError(f"Missing environment variable {env_name}")
 		return CryptoKey._parse_key_material(raw)
 
-	def _load_key_from_db(key_id: str) -> bytes:
+	def _load_key_from_db(key_id: str, version: int = None, storage=None) -> bytes:
 		"""
 		If you choose to store keys in DB (discouraged), implement a model
 		that returns encrypted or wrapped key material, unwrap it here.
 		For demo, we read a table 'crypto_keys' with columns (key_id, key_b64).
+		The latest version is returned unless a version is given.
 		"""
-		keys = list(CryptoKey.storage.list(key_id=key_id, orderby="version DESC", limit=1))
+		storage = CryptoKey.storage if storage is None else storage
+		conditions = {"key_id":key_id} if version is None else {"key_id":key_id, "version":version}
+		keys = list(storage.list(**conditions, orderby="version DESC", limit=1))
 		if len(keys) == 0:
-			raise RuntimeError(f"Key not found in DB for key_id={key_id}")
+			raise RuntimeError(f"Key not found in DB for key_id={key_id}" + ("" if version is None else f" and version={version}"))
 		return CryptoKey._parse_key_material(keys[0]["key_b64"])
 
 	def _load_key_from_kms(key_id: str) -> bytes:
@@ -142,12 +173,17 @@ class CryptoKey(Entity):
 		"""
 		raise NotImplementedError("KMS key retrieval not implemented")
 
-	def get_key_bytes(key_source: str, key_id: str) -> bytes:
-		if key_source.name == "env":
+	def get_key_bytes(key_source: str, key_id: str, version: int = None, storage=None) -> bytes:
+		"""
+		Reads the key material (env, KMS or db) on every call: go through CryptoConfig.key to use the credential cache.
+		key_source is the enum value of CryptoConfig or its name.
+		"""
+		source = getattr(key_source, 'name', key_source)
+		if source == "env":
 			return CryptoKey._load_key_from_env(key_id)
-		elif key_source.name == "db":
-			return CryptoKey._load_key_from_db(key_id)
-		elif key_source.name == "kms":
+		elif source == "db":
+			return CryptoKey._load_key_from_db(key_id, version=version, storage=storage)
+		elif source == "kms":
 			return CryptoKey._load_key_from_kms(key_id)
 		else:
 			raise RuntimeError(f"Unsupported key_source: {key_source}")
@@ -1,5 +1,6 @@
 from temod.base.entity import Entity
 from temod.base.attribute import *
+from temod.storage.mysql.mysqlAttributesTranslator import MysqlAttributesTranslator
 
 
 class Client(Entity):
@@ -37,6 +38,47 @@ class ClientDestination(Entity):
 
 	UPDATABLE_FIELDS = ['type','host',"port","database_name","username","password_enc","uri","options_json","active"]
 
+	def _not_encrypted_under(encryption_version):
+		version = MysqlAttributesTranslator.translate(StringAttribute("encryption_version",value=encryption_version))
+		return f"encryption_version IS NOT NULL AND encryption_version <> {version}"
+
+	def count_to_reencrypt(encryption_version, storage=None):
+		""" Number of secrets encrypted under another version than encryption_version ("<key_id>.<version>") """
+		storage = ClientDestination.storage if storage is None else storage
+		row = storage.getOne(f"SELECT COUNT(*) AS c FROM {ClientDestination.ENTITY_NAME} WHERE {ClientDestination._not_encrypted_under(encryption_version)}")
+		return 0 if row is None else row['c']
+
+	def to_reencrypt(encryption_version, after_id=0, limit=200, storage=None):
+		""" Next destinations (by id, after after_id) whose secret is encrypted under another version than encryption_version """
+		storage = ClientDestination.storage if storage is None else storage
+		for row in storage.getMany(
+			f"SELECT * FROM {ClientDestination.ENTITY_NAME} WHERE id > {int(after_id)} AND {ClientDestination._not_encrypted_under(encryption_version)} "
+			f"ORDER BY id LIMIT {int(limit)}"
+		):
+			yield storage.entity_generator(row)
+
+	def update_secrets(*rewrapped, storage=None):
+		"""
+		Writes a chunk of re-encrypted secrets in a single statement (one transaction).
+		rewrapped: (destination as read, new password_enc, new encryption_version). A destination whose password_enc
+		changed since it was read (edited meanwhile) is left untouched.
+		"""
+		if len(rewrapped) == 0:
+			return
+		storage = ClientDestination.storage if storage is None else storage
+		translate = MysqlAttributesTranslator.translate
+		passwords, versions = [], []
+		for destination, password_enc, encryption_version in rewrapped:
+			match = f"id = {int(destination['id'])} AND password_enc = {translate(BytesAttribute('password_enc',value=destination['password_enc']))}"
+			passwords.append(f"WHEN {match} THEN {translate(BytesAttribute('password_enc',value=password_enc))}")
+			versions.append(f"WHEN {match} THEN {translate(StringAttribute('encryption_version',value=encryption_version))}")
+		ids = ", ".join([str(int(destination['id'])) for destination, password_enc, encryption_version in rewrapped])
+		# assignments are evaluated left to right: encryption_version must be matched against the old password_enc
+		return storage.executeAndCommit(
+			f"UPDATE {ClientDestination.ENTITY_NAME} SET encryption_version = CASE {' '.join(versions)} ELSE encryption_version END, "
+			f"password_enc = CASE {' '.join(passwords)} ELSE password_enc END WHERE id IN ({ids})"
+		)
+
 
 class RoutingRule(Entity):
 	ENTITY_NAME = "routing_rule"
@@ -1,5 +1,6 @@
 from temod.base.entity import Entity
 from temod.base.attribute import *
+from temod.storage.mysql.mysqlAttributesTranslator import MysqlAttributesTranslator
 
 
 class DeviceType(Entity):
@@ -36,17 +37,40 @@ class Device(Entity):
     UPDATABLE_FIELDS = ['device_type_id','external_ref','name',"metadata_json","working","installed","topic"]
 
 
-class LatestValue(Entity):
-    ENTITY_NAME = "latest_value"
+class PayloadSample(Entity):
+    ENTITY_NAME = "payload_sample"
     ATTRIBUTES = [
-        {"name":"device_id","type":IntegerAttribute,"required":True,"is_id":True,"is_nullable":False},
-        {"name":"key_name","type":StringAttribute,"max_length":128,"required":True,"is_id":True,"is_nullable":False},
-        {"name":"ts","type":DateTimeAttribute,"required":True,"is_nullable":False},
-        {"name":"num_value","type":RealAttribute},
-        {"name":"str_value","type":StringAttribute,"max_length":1024},
-        {"name":"bool_value","type":IntegerAttribute},
-        {"name":"json_value","type":StringAttribute},  # JSON stored as String
-        {"name":"unit","type":StringAttribute,"max_length":32},
-        {"name":"quality","type":EnumAttribute,"values":["good","suspect","bad"],"required":True,"default_value":"good","is_nullable":False},
-        {"name":"meta_json","type":StringAttribute}  # JSON stored as String
-    ]
\ No newline at end of file
+        {"name":"device_type_id","type":IntegerAttribute,"required":True,"is_id":True,"is_nullable":False},
+        {"name":"slot","type":IntegerAttribute,"required":True,"is_id":True,"is_nullable":False},
+        {"name":"topic","type":StringAttribute,"max_length":255,"required":True,"is_nullable":False},
+        {"name":"payload","type":StringAttribute},
+        {"name":"at","type":DateTimeAttribute,"required":True,"is_nullable":False}
+    ]
+
+    # Number of samples kept per device type
+    SLOTS = 10
+
+    def record(topic, payload, at, storage=None):
+        """
+        Stores a raw payload in the sample ring of the device type linked to the topic: in a free slot, or else in
+        the slot of the oldest sample of the type, so that the ring holds its SLOTS most recent samples.
+        Does nothing if no device is linked to the topic.
+        """
+        storage = PayloadSample.storage if storage is None else storage
+        topic = MysqlAttributesTranslator.translate(StringAttribute("topic",value=topic))
+        ring = list(storage.getMany(
+            f"SELECT t.device_type_id, s.slot, s.at FROM (SELECT device_type_id FROM device WHERE topic = {topic} LIMIT 1) t "
+            f"LEFT JOIN {PayloadSample.ENTITY_NAME} s ON s.device_type_id = t.device_type_id"
+        ))
+        if len(ring) == 0:
+            return None
+        samples = {row['slot']:row['at'] for row in ring if row['slot'] is not None}
+        free = [slot for slot in range(PayloadSample.SLOTS) if not slot in samples]
+        slot = free[0] if len(free) else min(samples, key=lambda slot: (samples[slot], slot))
+        payload = MysqlAttributesTranslator.translate(StringAttribute("payload",value=payload))
+        at = MysqlAttributesTranslator.translate(DateTimeAttribute("at",value=at))
+        return storage.executeAndCommit(
+            f"INSERT INTO {PayloadSample.ENTITY_NAME} (device_type_id, slot, topic, payload, at) "
+            f"VALUES ({int(ring[0]['device_type_id'])}, {slot}, {topic}, {payload}, {at}) "
+            f"ON DUPLICATE KEY UPDATE topic = VALUES(topic), payload = VALUES(payload), at = VALUES(at)"
+        )
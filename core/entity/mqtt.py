@@ -1,6 +1,9 @@
 # ** Section ** Imports
 from temod.base.entity import Entity
 from temod.base.attribute import *
+from temod.storage.mysql.mysqlAttributesTranslator import MysqlAttributesTranslator
+
+from datetime import datetime
 from copy import deepcopy
 # ** EndSection ** Imports
 
@@ -19,9 +22,50 @@ class MqttMessage(Entity):
         {"name":"processor","type":UUID4Attribute},
 		{"name":"at","type":DateTimeAttribute, "required":True,"is_nullable":False}
 	]
+
+	def pending(limit=None, after=None, storage=None):
+		"""
+		Unprocessed messages, oldest first, read through the pending_message queue (cost grows with the backlog, not the history).
+		Pages of the queue are read with 'after', the id of the last message of the previous page.
+		"""
+		storage = MqttMessage.storage if storage is None else storage
+		for row in storage.getMany(
+			f"SELECT m.* FROM {PendingMessage.ENTITY_NAME} p JOIN {MqttMessage.ENTITY_NAME} m ON m.id = p.id AND m.at = p.at"
+			+ ("" if after is None else f" WHERE p.id > {int(after)}") + " ORDER BY p.id"
+			+ ("" if limit is None else f" LIMIT {int(limit)}")
+		):
+			yield storage.entity_generator(row)
+
+	def receive(topic, payload, qos, at, storage=None):
+		"""
+		Stores a received message and queues it in pending_message. Both statements are meant to run in one
+		Transaction (tools/transactions.py): a message is never stored without being queued. Returns the message id.
+		"""
+		storage = MqttMessage.storage if storage is None else storage
+		client = MysqlAttributesTranslator.translate(StringAttribute("client",value=topic.split("/")[0]))
+		payload = MysqlAttributesTranslator.translate(StringAttribute("payload",value=payload))
+		qos = MysqlAttributesTranslator.translate(IntegerAttribute("qos",value=qos))
+		topic = MysqlAttributesTranslator.translate(StringAttribute("topic",value=topic))
+		at = MysqlAttributesTranslator.translate(DateTimeAttribute("at",value=at))
+		message_id = storage.executeAndCommit(
+			f"INSERT INTO {MqttMessage.ENTITY_NAME} (client, topic, payload, qos, at) VALUES ({client}, {topic}, {payload}, {qos}, {at})"
+		).lastrowid
+		storage.executeAndCommit(f"INSERT INTO {PendingMessage.ENTITY_NAME} (id, topic, at) VALUES ({int(message_id)}, {topic}, {at})")
+		return message_id
 # ** EndSection ** Entity_MqttMessage
 
 
+# ** Section ** Entity_PendingMessage
+class PendingMessage(Entity):
+	ENTITY_NAME = "pending_message"
+	ATTRIBUTES = [
+		{"name":"id","type":IntegerAttribute, "required":True,"is_id":True, "is_nullable":False},
+		{"name":"topic","type":StringAttribute, "max_length":255, "required":True,"is_nullable":False},
+		{"name":"at","type":DateTimeAttribute, "required":True,"is_nullable":False}
+	]
+# ** EndSection ** Entity_PendingMessage
+
+
 # ** Section ** Entity_MqttTopic
 class MqttTopic(Entity):
     ENTITY_NAME = "mqtt_topic"
@@ -52,4 +96,104 @@ class MqttBroker(Entity):
         {"name":"last_seen_at","type":DateTimeAttribute},
         {"name":"active","type":IntegerAttribute,"required":True,"default_value":1,"is_nullable":False}
     ]
-# ** EndSection ** Entity_MqttBroker
\ No newline at end of file
+# ** EndSection ** Entity_MqttBroker
+
+# ** Section ** Entity_DeviceActivity
+class DeviceActivity(Entity):
+    ENTITY_NAME = "device_activity"
+    ATTRIBUTES = [
+        {"name":"topic","type":StringAttribute,"max_length":255,"required":True,"is_id":True,"is_nullable":False},
+        {"name":"client","type":StringAttribute,"max_length":255,"required":True,"is_nullable":False},
+        {"name":"first_seen","type":DateTimeAttribute,"required":True,"is_nullable":False},
+        {"name":"last_seen","type":DateTimeAttribute,"required":True,"is_nullable":False},
+        {"name":"message_count","type":IntegerAttribute,"is_nullable":False,"default_value":0},
+        {"name":"window_start","type":DateTimeAttribute,"required":True,"is_nullable":False},
+        {"name":"window_count","type":IntegerAttribute,"is_nullable":False,"default_value":0},
+        {"name":"previous_count","type":IntegerAttribute,"is_nullable":False,"default_value":0}
+    ]
+
+    # Length (in seconds) of the rolling window used to compute availability. Messages are counted in consecutive
+    # periods of WINDOW seconds (window_count since window_start, previous_count over the period before it), from
+    # which the count over the last WINDOW seconds is approximated (see received).
+    WINDOW = 24*3600
+
+    def record(topic, client, at, storage=None):
+        """
+        Upserts the activity row of a topic for a message received at 'at'.
+        Meant to be called once per ingested message: a single round trip, no read.
+        """
+        storage = DeviceActivity.storage if storage is None else storage
+        topic = MysqlAttributesTranslator.translate(StringAttribute("topic",value=topic))
+        client = MysqlAttributesTranslator.translate(StringAttribute("client",value=client))
+        at = MysqlAttributesTranslator.translate(DateTimeAttribute("at",value=at))
+        values = f"{topic}, {client}, {at}, {at}, 1, {at}, 1, 0"
+        # the current period is over: it becomes the previous one, unless the next period is over too (nothing is left)
+        period_over = f"VALUES(last_seen) >= window_start + INTERVAL {DeviceActivity.WINDOW} SECOND"
+        periods_over = f"VALUES(last_seen) >= window_start + INTERVAL {2*DeviceActivity.WINDOW} SECOND"
+        # assignments are applied in order: previous_count and window_count read window_start before it moves
+        return storage.executeAndCommit(
+            f"INSERT INTO {DeviceActivity.ENTITY_NAME} (topic, client, first_seen, last_seen, message_count, window_start, window_count, previous_count) VALUES ({values}) "
+            f"ON DUPLICATE KEY UPDATE previous_count = IF({periods_over}, 0, IF({period_over}, window_count, previous_count)), "
+            f"window_count = IF({period_over}, 1, window_count + 1), "
+            f"window_start = IF({periods_over}, VALUES(last_seen), IF({period_over}, window_start + INTERVAL {DeviceActivity.WINDOW} SECOND, window_start)), "
+            f"first_seen = LEAST(first_seen, VALUES(first_seen)), last_seen = GREATEST(last_seen, VALUES(last_seen)), message_count = message_count + 1"
+        )
+
+    def received(self, now=None):
+        """
+        Estimated number of messages received over the last WINDOW seconds: the messages of the current period, plus
+        those of the previous period weighted by the part of it still inside the window (spread evenly over the period).
+        """
+        now = datetime.now() if now is None else now
+        elapsed = max(0, (now - self['window_start']).total_seconds())
+        current, previous = self['window_count'], self['previous_count']
+        if elapsed >= DeviceActivity.WINDOW:
+            # no message since the current period ended: it is the previous one now
+            current, previous, elapsed = 0, (current if elapsed < 2*DeviceActivity.WINDOW else 0), elapsed - DeviceActivity.WINDOW
+        return current + previous*max(0, 1 - elapsed/DeviceActivity.WINDOW)
+
+    def availability(self, emission_rate, now=None):
+        """
+        Percentage of the expected messages (one every emission_rate ms) received over the last WINDOW seconds,
+        or since the topic was first seen when that is more recent.
+        """
+        now = datetime.now() if now is None else now
+        if not emission_rate:
+            return 0
+        observed = min(DeviceActivity.WINDOW, max((now - self['first_seen']).total_seconds(), emission_rate/1000))
+        return min(100, 100*self.received(now)/(observed/(emission_rate/1000)))
+# ** EndSection ** Entity_DeviceActivity
+
+
+# ** Section ** Entity_MqttSender
+class MqttSender(Entity):
+    ENTITY_NAME = "mqtt_sender"
+    ATTRIBUTES = [
+        {"name":"slug","type":StringAttribute,"max_length":255,"required":True,"is_id":True,"is_nullable":False},
+        {"name":"first_seen","type":DateTimeAttribute,"required":True,"is_nullable":False},
+        {"name":"last_seen","type":DateTimeAttribute,"required":True,"is_nullable":False},
+        {"name":"message_count","type":IntegerAttribute,"is_nullable":False,"default_value":0}
+    ]
+
+    def record(slug, at, storage=None):
+        """
+        Upserts the registry row of a sender slug (first topic level) for a message received at 'at'.
+        """
+        storage = MqttSender.storage if storage is None else storage
+        slug = MysqlAttributesTranslator.translate(StringAttribute("slug",value=slug))
+        at = MysqlAttributesTranslator.translate(DateTimeAttribute("at",value=at))
+        return storage.executeAndCommit(
+            f"INSERT INTO {MqttSender.ENTITY_NAME} (slug, first_seen, last_seen, message_count) VALUES ({slug}, {at}, {at}, 1) "
+            f"ON DUPLICATE KEY UPDATE first_seen = LEAST(first_seen, VALUES(first_seen)), last_seen = GREATEST(last_seen, VALUES(last_seen)), message_count = message_count + 1"
+        )
+
+    def unknown(storage=None):
+        """
+        Senders that are not linked to any client (anti-join on client.slug).
+        """
+        storage = MqttSender.storage if storage is None else storage
+        for row in storage.getMany(
+            f"SELECT s.* FROM {MqttSender.ENTITY_NAME} s LEFT JOIN client c ON c.slug = s.slug WHERE c.id IS NULL ORDER BY s.last_seen DESC"
+        ):
+            yield storage.entity_generator(row)
+# ** EndSection ** Entity_MqttSender
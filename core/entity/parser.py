@@ -1,5 +1,6 @@
 from temod.base.entity import Entity
 from temod.base.attribute import *
+from temod.storage.mysql.mysqlAttributesTranslator import MysqlAttributesTranslator
 
 class Parser(Entity):
     ENTITY_NAME = "parser"
@@ -28,7 +29,9 @@ class Extraction(Entity):
         {"name":"parsed_at","type":DateTimeAttribute,"required":True,"is_nullable":False},
         {"name":"success","type":IntegerAttribute,"required":True,"is_nullable":False},
         {"name":"error_text","type":StringAttribute},
-        {"name":"extracted_count","type":IntegerAttribute,"required":True,"default_value":0,"is_nullable":False}
+        {"name":"extracted_count","type":IntegerAttribute,"required":True,"default_value":0,"is_nullable":False},
+        {"name":"parse_ms","type":RealAttribute},  # wall time of the parser call
+        {"name":"cpu_ms","type":RealAttribute},  # CPU time of the parser call
     ]
 
 class Metric(Entity):
@@ -60,6 +63,29 @@ class ParsedPoint(Entity):
         {"name":"meta_json","type":StringAttribute}  # JSON stored as String
     ]
 
+    def insert(*batches, storage=None):
+        """
+        Inserts the points of PointBatches (tools/points.py) in a single statement, without an entity per point.
+        A literal is translated once per distinct (field, value): the fields shared by the points of an extraction once per batch.
+        """
+        storage = ParsedPoint.storage if storage is None else storage
+        attributes = {attribute['name']:attribute for attribute in ParsedPoint.ATTRIBUTES if not attribute.get('is_auto',False)}
+        fields = list(attributes)
+        literals = {}
+        def literal(field, value):
+            if not (field, value) in literals:
+                attribute = attributes[field]
+                literals[(field, value)] = MysqlAttributesTranslator.translate(attribute['type'](
+                    field, value=value, **{a:b for a,b in attribute.items() if not (a in ['name','type','required'])}
+                ))
+            return literals[(field, value)]
+        rows = ", ".join([
+            "("+", ".join([literal(field, value) for field, value in zip(fields, row)])+")" for batch in batches for row in batch.rows(fields)
+        ])
+        if len(rows) == 0:
+            return
+        return storage.executeAndCommit(f"INSERT INTO {ParsedPoint.ENTITY_NAME} ({', '.join(fields)}) VALUES {rows}")
+
 class LatestValue(Entity):
     ENTITY_NAME = "latest_value"
     ATTRIBUTES = [
@@ -73,4 +99,25 @@ class LatestValue(Entity):
         {"name":"unit","type":StringAttribute,"max_length":32},
         {"name":"quality","type":EnumAttribute,"values":["good","suspect","bad"],"required":True,"default_value":"good","is_nullable":False},
         {"name":"meta_json","type":StringAttribute}  # JSON stored as String
-    ]
\ No newline at end of file
+    ]
+
+    # Fields overwritten when a value at least as recent as the stored one is upserted
+    VALUE_FIELDS = ["num_value","str_value","bool_value","json_value","unit","quality","meta_json"]
+
+    def upsert(*values, storage=None):
+        """
+        Upserts a batch of latest values in a single statement.
+        A stored row is only overwritten by a value whose ts is at least as recent, so batches can be written in any order.
+        """
+        if len(values) == 0:
+            return
+        storage = LatestValue.storage if storage is None else storage
+        fields = [attribute['name'] for attribute in LatestValue.ATTRIBUTES]
+        rows = ", ".join([
+            "("+", ".join([MysqlAttributesTranslator.translate(value.attributes[field]) for field in fields])+")" for value in values
+        ])
+        updates = ", ".join([f"{field} = IF(VALUES(ts) >= ts, VALUES({field}), {field})" for field in LatestValue.VALUE_FIELDS])
+        # ts is assigned last: the assignments above must compare against the stored ts
+        return storage.executeAndCommit(
+            f"INSERT INTO {LatestValue.ENTITY_NAME} ({', '.join(fields)}) VALUES {rows} ON DUPLICATE KEY UPDATE {updates}, ts = GREATEST(ts, VALUES(ts))"
+        )
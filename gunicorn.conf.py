@@ -0,0 +1,19 @@
+# Gunicorn settings of the web app (run.sh: gunicorn -c gunicorn.conf.py "run:build_app(defer_mqtt=True, ...)").
+#
+# With preload_app the app is imported and built once in the master: entity registry, blueprints and templates
+# are shared copy-on-write by the workers instead of being loaded by each of them, and a worker restart is a fork.
+# Sockets and threads don't survive the fork, so each worker drops the inherited database connections and
+# connects its own MQTT client in post_fork (run.start_worker).
+# On SIGTERM a worker finishes its requests (graceful_timeout) and drains its MQTT client in worker_exit (run.stop_worker).
+
+preload_app = True
+
+
+def post_fork(server, worker):
+    import run
+    run.start_worker(worker.app.wsgi())
+
+
+def worker_exit(server, worker):
+    import run
+    run.stop_worker(worker.app.wsgi())
@@ -752,7 +752,7 @@ def merge_configs(base_config, merger):
         if type(v) is dict:
             if k in merger:
                 merge_configs(v, merger[k])
-        elif type(v) in [str, int, float, bool, datetime]:
+        elif type(v) in [str, int, float, bool, datetime, list]:
             if k in merger:
                 base_config[k] = merger[k]
         else:
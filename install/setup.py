@@ -23,7 +23,10 @@ import toml
 import re
 
 
-APP_VERSION = "1.0.1"
+APP_VERSION = "1.1.0"
+
+# Recurrent services installed with their systemd timer (services/<name>)
+SERVICES = ["mqtt_transfer", "retention"]
 
 
 def search_existing_database(credentials):
@@ -126,11 +129,11 @@ If you find this method not secure enough, which it is, remove the key from ther
 	return {"key_source":key_source, "key":key}
 
 
-def install_mqtttransfer_service(root_path, virtual_env, logging_dir, services_dir):
-	# Install Overlord service
-	with open(os.path.join(root_path,"services","mqtt_transfer","mqtt_transfer.service")) as file:
+def install_service(service_name, root_path, virtual_env, logging_dir, services_dir):
+	# Install a recurrent service (services/<service_name>) and its timer
+	with open(os.path.join(root_path,"services",service_name,f"{service_name}.service")) as file:
 		service = file.read()
-	service = service.replace("$script_path", os.path.join(root_path,"services","mqtt_transfer","mqtt_transfer.sh"))
+	service = service.replace("$script_path", os.path.join(root_path,"services",service_name,f"{service_name}.sh"))
 	if virtual_env is not None:
 		service = service.replace("$venv_path", f'-v "{os.path.join(virtual_env,"bin","activate")}"')
 	else:
@@ -140,19 +143,25 @@ def install_mqtttransfer_service(root_path, virtual_env, logging_dir, services_d
 	else:
 		service = service.replace("$logging_dir", "")
 	try:
-		with open(os.path.join(services_dir,"mqtt_transfer.service"),"w") as file:
+		with open(os.path.join(services_dir,f"{service_name}.service"),"w") as file:
 			file.write(service)
-		with open(os.path.join(services_dir,"mqtt_transfer.timer"),"w") as file:
-			with open(os.path.join(root_path,"services","mqtt_transfer","mqtt_transfer.timer"),"r") as ofile:
+		with open(os.path.join(services_dir,f"{service_name}.timer"),"w") as file:
+			with open(os.path.join(root_path,"services",service_name,f"{service_name}.timer"),"r") as ofile:
 				file.write(ofile.read())
 	except:
-		LOGGER.error(f"Unable to save mqtt_transfer.service file in directory {services_dir}. You can either install the files in another directory with 'install.py -s [DIRECTORY]' or give enough rights to the install script.")
+		LOGGER.error(f"Unable to save {service_name}.service file in directory {services_dir}. You can either install the files in another directory with 'install.py -s [DIRECTORY]' or give enough rights to the install script.")
 		LOGGER.error("Trace of the exception: ")
 		LOGGER.error(traceback.format_exc())
 		return False
 	return True
 
 
+def install_services(root_path, virtual_env, logging_dir, services_dir, services=SERVICES):
+	return all([
+		install_service(service_name, root_path, virtual_env, logging_dir, services_dir) for service_name in services
+	])
+
+
 def install_preset_objects(credentials, admin_user, crypto_config):	
 
 	mqtt_relay = MqttRelay(version=APP_VERSION)
@@ -181,7 +190,7 @@ def setup(app_paths, args):
 
 	virtual_env = common_funcs.detect_virtual_env(app_paths['root'])
 	logging_dir = args.logging_dir if not args.quiet else None
-	if not install_mqtttransfer_service(app_paths['root'], virtual_env, logging_dir, args.services_dir):
+	if not install_services(app_paths['root'], virtual_env, logging_dir, args.services_dir):
 		return False
 
 	credentials = common_funcs.get_mysql_credentials()
@@ -116,7 +116,21 @@ CREATE TABLE device (
     FOREIGN KEY (device_type_id) REFERENCES device_type(id)
     ON DELETE RESTRICT,
   KEY idx_dev_client (client_id),
-  KEY idx_dev_type (device_type_id)
+  KEY idx_dev_type (device_type_id),
+  KEY idx_dev_topic (topic)
+) ENGINE=InnoDB;
+
+-- Most recent raw payloads per device type (ring of slots, maintained at ingest)
+CREATE TABLE payload_sample (
+  device_type_id BIGINT UNSIGNED NOT NULL,
+  slot           TINYINT UNSIGNED NOT NULL,
+  topic          VARCHAR(255) NOT NULL,
+  payload        TEXT NULL,
+  at             DATETIME NOT NULL,
+  PRIMARY KEY (device_type_id, slot),
+  CONSTRAINT fk_ps_type
+    FOREIGN KEY (device_type_id) REFERENCES device_type(id)
+    ON DELETE CASCADE
 ) ENGINE=InnoDB;
 
 -- =========================
@@ -163,10 +177,41 @@ CREATE TABLE IF NOT EXISTS mqtt_message (
     at DATETIME NOT NULL,
     processed BOOL NOT NULL DEFAULT 0,
     processor VARCHAR(36),
-    PRIMARY KEY (id),
+    PRIMARY KEY (id, at),
     INDEX idx_topic_received (topic, at),
     INDEX idx_received (at)
-);
+)
+-- Partitions by day/month are rolled by the retention service (services/retention)
+PARTITION BY RANGE COLUMNS(at) (PARTITION pmax VALUES LESS THAN (MAXVALUE));
+
+-- Work queue of the unprocessed messages (appended at ingest, deleted by the transfer once processed)
+CREATE TABLE pending_message (
+  id     BIGINT UNSIGNED PRIMARY KEY NOT NULL,
+  topic  VARCHAR(255) NOT NULL,
+  at     DATETIME NOT NULL,
+  KEY idx_pm_at (at)
+) ENGINE=InnoDB;
+
+-- Per-topic activity counters (maintained at ingest, read by the client view)
+CREATE TABLE device_activity (
+  topic          VARCHAR(255) PRIMARY KEY NOT NULL,
+  client         VARCHAR(255) NOT NULL,
+  first_seen     DATETIME NOT NULL,
+  last_seen      DATETIME NOT NULL,
+  message_count  BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  window_start   DATETIME NOT NULL,        -- start of the current 24h period of the rolling availability window
+  window_count   BIGINT UNSIGNED NOT NULL DEFAULT 0,   -- messages since window_start
+  previous_count BIGINT UNSIGNED NOT NULL DEFAULT 0,   -- messages of the 24h period before window_start
+  KEY idx_da_client (client)
+) ENGINE=InnoDB;
+
+-- Registry of the observed sender slugs (first topic level, maintained at ingest)
+CREATE TABLE mqtt_sender (
+  slug           VARCHAR(255) PRIMARY KEY NOT NULL,
+  first_seen     DATETIME NOT NULL,
+  last_seen      DATETIME NOT NULL,
+  message_count  BIGINT UNSIGNED NOT NULL DEFAULT 0
+) ENGINE=InnoDB;
 
 -- =========================
 -- 6) Parsing / Extraction
@@ -191,15 +236,15 @@ CREATE TABLE extraction (
   success        TINYINT(1) NOT NULL,
   error_text     TEXT,
   extracted_count INT UNSIGNED NOT NULL DEFAULT 0,
-  CONSTRAINT fk_ext_msg
-    FOREIGN KEY (message_id) REFERENCES mqtt_message(id)
-    ON DELETE CASCADE,
+  parse_ms       DECIMAL(12,3) NULL,      -- wall time of the parser call
+  cpu_ms         DECIMAL(12,3) NULL,      -- CPU time of the parser call
   CONSTRAINT fk_ext_parser
     FOREIGN KEY (parser_id) REFERENCES parser(id)
     ON DELETE RESTRICT,
   KEY idx_ext_msg (message_id),
   KEY idx_ext_parser (parser_id),
-  KEY idx_ext_parsed_at (parsed_at)
+  KEY idx_ext_parsed_at (parsed_at),
+  KEY idx_ext_parser_time (parser_id, parsed_at)
 ) ENGINE=InnoDB;
 
 -- Dictionary of metrics/fields your pipeline recognizes
@@ -212,8 +257,9 @@ CREATE TABLE metric_catalog (
 ) ENGINE=InnoDB;
 
 -- Normalized time-series points coming out of parsing
+-- Partitioned tables can't hold foreign keys: parsed_point references are not enforced
 CREATE TABLE parsed_point (
-  id            BIGINT UNSIGNED PRIMARY KEY AUTO_INCREMENT,
+  id            BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
   extraction_id VARCHAR(36) NOT NULL,
   device_id     BIGINT UNSIGNED,
   metric_id     BIGINT UNSIGNED,
@@ -225,19 +271,13 @@ CREATE TABLE parsed_point (
   unit          VARCHAR(32),
   quality       ENUM('good','suspect','bad') NOT NULL DEFAULT 'good',
   meta_json     JSON,
-  CONSTRAINT fk_pp_ext
-    FOREIGN KEY (extraction_id) REFERENCES extraction(id)
-    ON DELETE CASCADE,
-  CONSTRAINT fk_pp_dev
-    FOREIGN KEY (device_id) REFERENCES device(id)
-    ON DELETE SET NULL,
-  CONSTRAINT fk_pp_metric
-    FOREIGN KEY (metric_id) REFERENCES metric_catalog(id)
-    ON DELETE SET NULL,
+  PRIMARY KEY (id, ts),
+  KEY idx_pp_ext (extraction_id),
   KEY idx_pp_device_ts (device_id, ts),
   KEY idx_pp_key_ts (metric_id, ts),
   KEY idx_pp_ts (ts)
-) ENGINE=InnoDB;
+) ENGINE=InnoDB
+PARTITION BY RANGE COLUMNS(ts) (PARTITION pmax VALUES LESS THAN (MAXVALUE));
 
 -- Optional materialized “latest” cache (maintained by app/jobs)
 CREATE TABLE latest_value (
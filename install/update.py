@@ -0,0 +1,104 @@
+from temod.storage.mysql import MysqlEntityStorage
+from pathlib import Path
+
+import sys
+import os
+
+if not os.getcwd() in sys.path:
+	sys.path.append(os.getcwd())
+
+from install import common_funcs
+from install.setup import APP_VERSION, SERVICES, install_services
+from core.entity import *
+
+import traceback
+import argparse
+
+
+def parse_version(version):
+	return tuple(int(part) for part in version.strip().split('.'))
+
+
+def list_pending_updates(updates_dir, installed_version):
+	""" Update scripts are named <version>.sql and are applied in version order """
+	pending = []
+	if not os.path.isdir(updates_dir):
+		return pending
+	for file in os.listdir(updates_dir):
+		if not file.endswith('.sql'):
+			continue
+		version = file.rsplit('.sql',1)[0]
+		if parse_version(installed_version) < parse_version(version) <= parse_version(APP_VERSION):
+			pending.append(version)
+	return sorted(pending, key=parse_version)
+
+
+def update(app_paths, args):
+
+	config = common_funcs.load_toml_config(app_paths['config_file'])
+	credentials = {k:v for k,v in config['storage']['credentials'].items() if k in ["host","port","user","password","database"]}
+
+	relay_storage = MysqlEntityStorage(MqttRelay,**credentials)
+	mqtt_relay = relay_storage.get()
+	if mqtt_relay is None:
+		LOGGER.error("No installed version found in the database. Run install/setup.py instead.")
+		return False
+
+	installed_version = mqtt_relay['version']
+	pending = list_pending_updates(app_paths['updates'], installed_version)
+	if len(pending) == 0:
+		LOGGER.info(f"MqttRelay is already up to date (v{installed_version})")
+		return True
+
+	for version in pending:
+		LOGGER.info(f"Applying update v{version}")
+		with open(os.path.join(app_paths['updates'],f"{version}.sql")) as file:
+			if not common_funcs.execute_mysql_script(credentials, file.read().replace("$database",credentials['database'])):
+				LOGGER.error(f"Update v{version} failed. The database is left at v{installed_version}")
+				return False
+		relay_storage.update({"version":version}, version=installed_version)
+		installed_version = version
+
+	template_config = common_funcs.load_toml_config(app_paths['template_config_file'])
+	common_funcs.save_toml_config(common_funcs.merge_configs(template_config, config), app_paths['config_file'])
+
+	# the retention service expires data: it is only installed on update once a policy has been configured
+	services = [service_name for service_name in SERVICES if service_name != "retention" or len(config.get("retention",{}))]
+	if not "retention" in services:
+		LOGGER.info("No retention policy configured in config.toml ([retention.<table>]): the retention service isn't installed")
+
+	virtual_env = common_funcs.detect_virtual_env(app_paths['root'])
+	return install_services(app_paths['root'], virtual_env, args.logging_dir if not args.quiet else None, args.services_dir, services=services)
+
+
+if __name__ == "__main__":
+
+	print("\n"); width = common_funcs.print_pattern("MqttRelay Update"); print(); print("#"*width); print()
+
+	parser = argparse.ArgumentParser(prog="Updates an installed MqttRelay server")
+	parser.add_argument(
+		'-l', '--logging-dir', help='Directory where log files will be stored',
+		default=os.path.join("/","var","log","mqtt_relay")
+	)
+	parser.add_argument('-q', '--quiet', action="store_true", help='No logging', default=False)
+	parser.add_argument(
+		'-s', '--services-dir', 
+		help='Directory where MqttRelay services files will be stored', 
+		default=os.path.join("/","lib","systemd","system")
+	)
+	args = parser.parse_args()
+
+	setattr(__builtins__,'LOGGER', common_funcs.get_logger(args.logging_dir, quiet=args.quiet))
+	app_paths = common_funcs.get_app_paths(Path(os.path.realpath(__file__)).parent)
+
+	try:
+		updated = update(app_paths, args)
+	except:
+		LOGGER.error("Error while updating MqttRelay")
+		LOGGER.error(traceback.format_exc())
+		updated = False
+
+	if updated:
+		LOGGER.info("MqttRelay update completed successfully")
+	else:
+		exit(1)
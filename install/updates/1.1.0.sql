@@ -0,0 +1,122 @@
+/******************************\
+ *  UPDATE 1.0.1 -> 1.1.0
+\******************************/
+
+-- =========================
+-- Device activity
+-- =========================
+CREATE TABLE IF NOT EXISTS device_activity (
+  topic          VARCHAR(255) PRIMARY KEY NOT NULL,
+  client         VARCHAR(255) NOT NULL,
+  first_seen     DATETIME NOT NULL,
+  last_seen      DATETIME NOT NULL,
+  message_count  BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  window_start   DATETIME NOT NULL,
+  window_count   BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  previous_count BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  KEY idx_da_client (client)
+) ENGINE=InnoDB;
+
+-- One-off backfill from the message history (counts of the last two days)
+INSERT INTO device_activity (topic, client, first_seen, last_seen, message_count, window_start, window_count, previous_count)
+SELECT topic, MIN(client), MIN(at), MAX(at), COUNT(*),
+       GREATEST(MIN(at), NOW() - INTERVAL 1 DAY), SUM(at >= NOW() - INTERVAL 1 DAY),
+       SUM(at >= NOW() - INTERVAL 2 DAY AND at < NOW() - INTERVAL 1 DAY)
+FROM mqtt_message
+GROUP BY topic
+ON DUPLICATE KEY UPDATE topic = topic;
+
+-- =========================
+-- Observed senders
+-- =========================
+CREATE TABLE IF NOT EXISTS mqtt_sender (
+  slug           VARCHAR(255) PRIMARY KEY NOT NULL,
+  first_seen     DATETIME NOT NULL,
+  last_seen      DATETIME NOT NULL,
+  message_count  BIGINT UNSIGNED NOT NULL DEFAULT 0
+) ENGINE=InnoDB;
+
+INSERT INTO mqtt_sender (slug, first_seen, last_seen, message_count)
+SELECT client, MIN(first_seen), MAX(last_seen), SUM(message_count)
+FROM device_activity
+GROUP BY client
+ON DUPLICATE KEY UPDATE slug = slug;
+
+-- =========================
+-- Payload samples
+-- =========================
+ALTER TABLE device ADD KEY idx_dev_topic (topic);
+
+CREATE TABLE IF NOT EXISTS payload_sample (
+  device_type_id BIGINT UNSIGNED NOT NULL,
+  slot           TINYINT UNSIGNED NOT NULL,
+  topic          VARCHAR(255) NOT NULL,
+  payload        TEXT NULL,
+  at             DATETIME NOT NULL,
+  PRIMARY KEY (device_type_id, slot),
+  CONSTRAINT fk_ps_type
+    FOREIGN KEY (device_type_id) REFERENCES device_type(id)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+INSERT INTO payload_sample (device_type_id, slot, topic, payload, at)
+SELECT device_type_id, rn - 1, topic, payload, at FROM (
+  SELECT d.device_type_id, m.topic, m.payload, m.at,
+         ROW_NUMBER() OVER (PARTITION BY d.device_type_id ORDER BY m.at DESC) AS rn
+  FROM mqtt_message m
+  JOIN device d ON d.topic = m.topic
+) samples
+WHERE rn <= 10
+ON DUPLICATE KEY UPDATE slot = slot;
+
+-- =========================
+-- Latest values
+-- =========================
+INSERT INTO latest_value (device_id, key_name, ts, num_value, str_value, bool_value, json_value, unit, quality, meta_json)
+SELECT device_id, key_name, ts, num_value, str_value, bool_value, json_value, unit, quality, meta_json FROM (
+  SELECT p.device_id, mc.key_name, p.ts, p.num_value, p.str_value, p.bool_value, p.json_value, p.unit, p.quality, p.meta_json,
+         ROW_NUMBER() OVER (PARTITION BY p.device_id, mc.key_name ORDER BY p.ts DESC, p.id DESC) AS rn
+  FROM parsed_point p
+  JOIN metric_catalog mc ON mc.id = p.metric_id
+  JOIN device d ON d.id = p.device_id
+) latest
+WHERE rn = 1
+ON DUPLICATE KEY UPDATE device_id = device_id;
+
+-- =========================
+-- Time partitioning (rolled by services/retention)
+-- =========================
+-- Partitioned tables can neither hold nor be the target of foreign keys (their implicit indexes are kept)
+ALTER TABLE extraction DROP FOREIGN KEY fk_ext_msg;
+ALTER TABLE parsed_point
+  DROP FOREIGN KEY fk_pp_ext,
+  DROP FOREIGN KEY fk_pp_dev,
+  DROP FOREIGN KEY fk_pp_metric;
+
+ALTER TABLE mqtt_message DROP PRIMARY KEY, ADD PRIMARY KEY (id, at);
+ALTER TABLE mqtt_message PARTITION BY RANGE COLUMNS(at) (PARTITION pmax VALUES LESS THAN (MAXVALUE));
+
+ALTER TABLE parsed_point DROP PRIMARY KEY, ADD PRIMARY KEY (id, ts);
+ALTER TABLE parsed_point PARTITION BY RANGE COLUMNS(ts) (PARTITION pmax VALUES LESS THAN (MAXVALUE));
+
+-- =========================
+-- Pending messages queue
+-- =========================
+CREATE TABLE IF NOT EXISTS pending_message (
+  id     BIGINT UNSIGNED PRIMARY KEY NOT NULL,
+  topic  VARCHAR(255) NOT NULL,
+  at     DATETIME NOT NULL,
+  KEY idx_pm_at (at)
+) ENGINE=InnoDB;
+
+INSERT INTO pending_message (id, topic, at)
+SELECT id, topic, at FROM mqtt_message WHERE processed = 0
+ON DUPLICATE KEY UPDATE id = id;
+
+-- =========================
+-- Parser call timings (per parser latency histograms)
+-- =========================
+ALTER TABLE extraction
+  ADD COLUMN parse_ms DECIMAL(12,3) NULL AFTER extracted_count,
+  ADD COLUMN cpu_ms DECIMAL(12,3) NULL AFTER parse_ms,
+  ADD KEY idx_ext_parser_time (parser_id, parsed_at);
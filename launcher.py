@@ -0,0 +1,245 @@
+"""
+Entry point of a MqttRelay deployment (run.sh): reads config.toml once and supervises the processes of the relay.
+
+	python launcher.py [--only web,ingestor,transfer] [--dry-run]
+	python launcher.py ingestor      # the ingestor process itself, started by the launcher
+
+Children ([launcher] section of config.toml):
+  - web: gunicorn preloading run:build_app (app.prod), or the development server of run.py
+  - ingestor: a single process receiving and storing the mqtt messages, so that the web workers don't each
+    hold a broker connection (prod only: the development server ingests itself)
+  - transfer: the Mqtt Transfer job, started every transfer_interval seconds (0 leaves it to its systemd timer)
+A web server or ingestor which exits is restarted, after a delay doubled on each quick failure.
+SIGTERM/SIGINT drain the children: they get SIGTERM and drain_timeout seconds to finish the requests, the message
+being stored and the dispatches in flight, before being killed.
+"""
+import subprocess
+import threading
+import argparse
+import logging
+import signal
+import toml
+import time
+import sys
+import os
+
+
+ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+LAUNCHER_DEFAULTS = {
+	"web_workers": 0,  # 0: 2 * cpus + 1, up to max_web_workers
+	"max_web_workers": 8,
+	"web_threads": 8,
+	"ingestor": True,  # False: every web worker connects to the broker and ingests
+	"ingestor_metrics_file": os.path.join("db","metrics","ingestor.prom"),  # ingest metrics for the web app telemetry endpoint, "": not written
+	"ingestor_metrics_interval": 15,  # seconds
+	"transfer_interval": 10,  # seconds between two starts of the Mqtt Transfer job, 0: not supervised
+	"logging_dir": "",  # logging directory of the Mqtt Transfer job
+	"drain_timeout": 30,  # seconds
+	"restart_delay": 1,  # seconds, doubled on each exit of a child that ran less than stable_after
+	"max_restart_delay": 60,
+	"stable_after": 60,
+}
+
+ROLES = ["web", "ingestor", "transfer"]
+
+LOGGER = logging.getLogger("launcher")
+
+
+# ** Section ** LoadConfiguration
+def load_config():
+	with open(os.path.join(ROOT_DIR,"config.toml")) as config_file:
+		config = toml.load(config_file)
+	return config, {**LAUNCHER_DEFAULTS, **config.get('launcher',{})}
+
+def cpu_count():
+	""" CPUs this process may run on (cgroup/affinity restricted), not those of the host """
+	if hasattr(os,"sched_getaffinity"):
+		return len(os.sched_getaffinity(0))
+	return os.cpu_count() or 1
+
+def web_workers(settings):
+	if int(settings['web_workers']) > 0:
+		return int(settings['web_workers'])
+	return max(1, min(int(settings['max_web_workers']), 2*cpu_count() + 1))
+# ** EndSection ** LoadConfiguration
+
+
+# ** Section ** Commands
+def web_command(config, settings):
+	if not config['app']['prod']:
+		return [sys.executable, os.path.join(ROOT_DIR,"run.py")]
+	# the secret key is the configured one, or one generated once by build_app in the master and shared by the preloaded workers
+	app_spec = f"run:build_app(defer_mqtt=True, ingest={not settings['ingestor']})"
+	command = [
+		sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT_DIR,"gunicorn.conf.py"), "--preload",
+		"-w", str(web_workers(settings)), "--threads", str(int(settings['web_threads'])),
+		"-b", f"{config['app']['host']}:{config['app']['port']}", "--graceful-timeout", str(int(settings['drain_timeout']))
+	]
+	if config['app'].get('ssl',False):
+		for name in ['ssl_cert','ssl_key']:
+			if not os.path.isfile(config['app'][name]):
+				raise FileNotFoundError(f"Cannot find the {name} file mentionned in the config file: {config['app'][name]}")
+		command += [f"--certfile={config['app']['ssl_cert']}", f"--keyfile={config['app']['ssl_key']}"]
+	return command + [app_spec]
+
+def ingestor_command(config, settings):
+	return [sys.executable, os.path.realpath(__file__), "ingestor"]
+
+def transfer_command(config, settings):
+	command = [sys.executable, os.path.join(ROOT_DIR,"services","mqtt_transfer","mqtt_transfer.py"), "--root-dir", ROOT_DIR]
+	if settings['logging_dir']:
+		command += ["--logging-dir", settings['logging_dir']]
+	return command
+
+def children(config, settings, only=None):
+	roles = [role for role in ROLES if only is None or role in only]
+	if "ingestor" in roles and (not settings['ingestor'] or not config['app']['prod']):
+		roles.remove("ingestor")
+	if "transfer" in roles and float(settings['transfer_interval']) <= 0:
+		roles.remove("transfer")
+	return [
+		Child(role, globals()[f"{role}_command"](config, settings), settings, interval=float(settings['transfer_interval']) if role == "transfer" else None)
+		for role in roles
+	]
+# ** EndSection ** Commands
+
+
+# ** Section ** Supervision
+class Child(object):
+
+	"""
+	A supervised process. Without interval it is restarted when it exits (after restart_delay, doubled while it keeps
+	exiting within stable_after seconds); with an interval it is a job started every interval seconds, never twice at once.
+	"""
+	def __init__(self, name, command, settings, interval=None):
+		super(Child, self).__init__()
+		self.name = name
+		self.command = command
+		self.interval = interval
+		self.restart_delay = float(settings['restart_delay'])
+		self.max_restart_delay = float(settings['max_restart_delay'])
+		self.stable_after = float(settings['stable_after'])
+		self.delay = self.restart_delay
+		self.process = None
+		self.started_at = None
+		self.next_start = time.monotonic()
+		self.restarts = 0
+
+	def start(self):
+		# own session: a Ctrl-C reaches the launcher only, which then drains the children
+		self.process = subprocess.Popen(self.command, cwd=ROOT_DIR, start_new_session=True)
+		self.started_at = time.monotonic()
+		LOGGER.info(f"Started {self.name} (pid {self.process.pid})")
+
+	def poll(self, now):
+		if self.process is None:
+			if now >= self.next_start:
+				self.start()
+			return
+		exit_code = self.process.poll()
+		if exit_code is None:
+			return
+		ran = now - self.started_at
+		self.process = None
+		if self.interval is not None:
+			if exit_code != 0:
+				LOGGER.warning(f"{self.name} exited with code {exit_code} after {ran:.1f}s")
+			self.next_start = self.started_at + self.interval
+			return
+		self.delay = self.restart_delay if ran >= self.stable_after else min(self.max_restart_delay, 2*self.delay)
+		self.next_start = now + self.delay
+		self.restarts += 1
+		LOGGER.warning(f"{self.name} exited with code {exit_code} after {ran:.1f}s, restarting it in {self.delay:g}s")
+
+	def signal(self, signum):
+		if self.process is not None and self.process.poll() is None:
+			self.process.send_signal(signum)
+
+	def alive(self):
+		return self.process is not None and self.process.poll() is None
+
+
+def supervise(processes, drain_timeout):
+	stopping = threading.Event()
+	def stop(signum, frame):
+		LOGGER.info(f"Received signal {signal.Signals(signum).name}: draining {', '.join(child.name for child in processes if child.alive())}")
+		stopping.set()
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+
+	while not stopping.is_set():
+		now = time.monotonic()
+		for child in processes:
+			child.poll(now)
+		stopping.wait(0.5)
+
+	for child in processes:
+		child.signal(signal.SIGTERM)
+	# gunicorn gets drain_timeout as its graceful timeout: a little more is left to its master to reap the workers
+	deadline = time.monotonic() + drain_timeout + 5
+	while any(child.alive() for child in processes) and time.monotonic() < deadline:
+		time.sleep(0.2)
+	for child in processes:
+		if child.alive():
+			LOGGER.warning(f"{child.name} didn't drain within {drain_timeout}s, killing it")
+			child.signal(signal.SIGKILL)
+			child.process.wait()
+	LOGGER.info("All processes stopped")
+# ** EndSection ** Supervision
+
+
+# ** Section ** Ingestor
+def write_ingest_metrics(metrics_file):
+	from tools import metrics
+	try:
+		metrics.REGISTRY.write_textfile(metrics_file)
+	except OSError:
+		LOGGER.warning(f"Ingest metrics couldn't be written to {metrics_file}", exc_info=True)
+
+def run_ingestor(settings):
+	"""
+	The app with only the mqtt and auth blueprints, connected to the broker and serving no request. Its ingest metrics
+	are written to ingestor_metrics_file every ingestor_metrics_interval seconds and on exit: the web app serves them
+	on /telemetry/metrics (textfiles).
+	"""
+	import blueprints
+	import run
+
+	stopping = threading.Event()
+	signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+	signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+	unused = [name[:-len("_blueprint")] for name in blueprints.BLUEPRINTS if not name in ["mqtt_blueprint","auth_blueprint"]]
+	app = run.build_app(app={"blueprints":{name:{"enabled":False} for name in unused}})
+	metrics_file = os.path.join(ROOT_DIR, settings['ingestor_metrics_file']) if settings['ingestor_metrics_file'] else None
+	while not stopping.wait(max(1, float(settings['ingestor_metrics_interval'])) if metrics_file else None):
+		write_ingest_metrics(metrics_file)
+	run.stop_worker(app)
+	if metrics_file:
+		write_ingest_metrics(metrics_file)
+# ** EndSection ** Ingestor
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(prog="Starts and supervises the MqttRelay processes")
+	argparser.add_argument('role', nargs='?', choices=["ingestor"], help='Run a supervised process instead of the launcher', default=None)
+	argparser.add_argument('--only', help=f'Comma separated processes to start among {",".join(ROLES)}', default=None)
+	argparser.add_argument('--dry-run', action="store_true", help='Print the commands of the processes and exit', default=False)
+	args = argparser.parse_args()
+
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', stream=sys.stdout)
+
+	config, settings = load_config()
+	if args.role == "ingestor":
+		run_ingestor(settings)
+		sys.exit(0)
+
+	processes = children(config, settings, only=None if args.only is None else args.only.split(","))
+	LOGGER.info(f"{cpu_count()} cpus: {web_workers(settings)} web workers ({int(settings['web_threads'])} threads each)")
+	if args.dry_run:
+		for child in processes:
+			print(f"{child.name}: {' '.join(child.command)}" + ("" if child.interval is None else f" (every {child.interval:g}s)"))
+		sys.exit(0)
+
+	supervise(processes, float(settings['drain_timeout']))
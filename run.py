@@ -4,8 +4,6 @@ from flask_login import current_user, login_required
 
 from temod_flask.security.authentification import Authenticator, TemodUserHandler
 
-from temod.ext.holders import init_holders
-
 from context import *
 
 import traceback
@@ -13,8 +11,11 @@ import mimetypes
 import yaml
 import toml
 import json
+import time
 import os
 
+STARTED_AT = time.perf_counter()
+
 
 # ** Section ** MimetypesDefinition
 mimetypes.add_type('text/css', '.css')
@@ -34,13 +35,11 @@ with open(os.path.join(os.path.dirname(os.path.realpath(__file__)),"dictionnary.
 
 
 # ** Section ** ContextCreation
-init_holders(
-	entities_dir=os.path.join(config['temod']['core_directory'],r"entity"),
-	joins_dir=os.path.join(config['temod']['core_directory'],r"join"),
-	databases=config['temod']['bound_database'],
-	db_credentials=config['storage']['credentials']
-)
+# startup profile: seconds spent in each phase, logged once the app is built
+STARTUP = {"imports":time.perf_counter() - STARTED_AT}
+init_registry(config, cache_file=config['temod'].get('registry_cache',"db/cache/registry.json"))
 init_context(config)
+STARTUP["registry"] = time.perf_counter() - STARTED_AT - sum(STARTUP.values())
 # ** EndSection ** ContextCreation
 
 # ** Section ** AppCreation
@@ -57,8 +56,13 @@ def update_configuration(original_config, new_config):
     for k in new_keys:
         original_config[k] = new_config[k]
 
-def build_app(**app_configuration):
-
+def build_app(defer_mqtt=False, ingest=True, **app_configuration):
+	"""
+	defer_mqtt: don't connect to the broker yet, start_worker does it. For gunicorn --preload (see gunicorn.conf.py):
+	the app is built once in the master and every forked worker connects its own MQTT client.
+	ingest: receive and store the mqtt messages in this app. False when a dedicated ingestor process does it (launcher.py).
+	"""
+	started = time.perf_counter()
 	update_configuration(config,app_configuration)
 
 	app = Flask(
@@ -74,6 +78,10 @@ def build_app(**app_configuration):
 	app.config['LANGUAGES'] = {language["code"]:language for language in Language.storage.list()}
 	app.config['DICTIONNARY'] = dictionnary
 
+	# keys, subkeys and destination secrets are memoized for the TTL (seconds) and dropped on key rotation
+	from tools.credentials import CREDENTIALS
+	CREDENTIALS.configure(**config['app'].get('credentials',{}))
+
 	# ** Section ** Blueprint
 	import blueprints
 
@@ -87,18 +95,16 @@ def build_app(**app_configuration):
 	auth_blueprint_config = config['app'].get('blueprints',{}).get('auth',{})
 	auth_blueprint_config['authenticator'] = AUTHENTICATOR
 
-	mqtt_blueprint_config = config['app'].get('blueprints',{}).get('mqtt',{})
-	app.register_blueprint(blueprints.destinations_blueprint.setup(config['app'].get('blueprints',{}).get('destinations',{})))
-	app.register_blueprint(blueprints.dashboard_blueprint.setup(config['app'].get('blueprints',{}).get('dashboard',{})))
-	app.register_blueprint(blueprints.clients_blueprint.setup(config['app'].get('blueprints',{}).get('clients',{})))
-	app.register_blueprint(blueprints.devices_blueprint.setup(config['app'].get('blueprints',{}).get('devices',{})))
-	app.register_blueprint(blueprints.parsers_blueprint.setup(config['app'].get('blueprints',{}).get('parsers',{})))
-	app.register_blueprint(blueprints.general_blueprint.setup(config['app'].get('blueprints',{}).get('general',{})))
-	app.register_blueprint(blueprints.metrics_blueprint.setup(config['app'].get('blueprints',{}).get('metrics',{})))
-	app.register_blueprint(blueprints.topics_blueprint.setup(config['app'].get('blueprints',{}).get('topics',{})))
-	app.register_blueprint(blueprints.routes_blueprint.setup(config['app'].get('blueprints',{}).get('routes',{})))
-	app.register_blueprint(blueprints.users_blueprint.setup(config['app'].get('blueprints',{}).get('users',{})))
-	app.register_blueprint(blueprints.mqtt_blueprint.setup(mqtt_blueprint_config).setup_mqtt(Mqtt(app)))
+	# blueprints disabled in the configuration (enabled = false) are not even imported
+	blueprints_config = config['app'].get('blueprints',{})
+	for name in ["destinations","dashboard","clients","devices","parsers","general","metrics","telemetry","topics","routes","users"]:
+		if blueprints_config.get(name,{}).get('enabled',True):
+			app.register_blueprint(getattr(blueprints,f"{name}_blueprint").setup(blueprints_config.get(name,{})))
+	mqtt = Mqtt() if ingest else None
+	app.extensions['mqttrelay.mqtt'] = mqtt
+	if blueprints_config.get('mqtt',{}).get('enabled',True):
+		mqtt_blueprint = blueprints.mqtt_blueprint.setup(blueprints_config.get('mqtt',{}))
+		app.register_blueprint(mqtt_blueprint if mqtt is None else mqtt_blueprint.setup_mqtt(mqtt))
 	app.register_blueprint(blueprints.auth_blueprint.setup(auth_blueprint_config))
 	# ** EndSection ** Blueprint**
 
@@ -109,7 +115,32 @@ def build_app(**app_configuration):
 		return redirect(url_for('clients.listClients'))
 	# ** EndSection ** AppMainRoutes
 
+	STARTUP["build_app"] = time.perf_counter() - started
+	app.config['STARTUP'] = dict(STARTUP)
+	app.logger.info("Startup profile: " + ", ".join([f"{phase} {1000*seconds:.0f}ms" for phase, seconds in STARTUP.items()]))
+
+	if not defer_mqtt:
+		start_worker(app)
 	return app
+
+def start_worker(app):
+	""" Per process start: own database connections and MQTT client (called by build_app, or after the fork with --preload) """
+	reset_connections()
+	mqtt = app.extensions['mqttrelay.mqtt']
+	if mqtt is not None and mqtt.app is None and config['app'].get('blueprints',{}).get('mqtt',{}).get('enabled',True):
+		mqtt.init_app(app)
+
+def stop_worker(app):
+	""" Drain before exit: unsubscribes and waits for the message being stored, if any, then disconnects from the broker """
+	mqtt = app.extensions.get('mqttrelay.mqtt')
+	if mqtt is None or mqtt.app is None:
+		return
+	try:
+		mqtt.unsubscribe_all()
+		mqtt._disconnect()
+		app.logger.info("Disconnected from the MQTT broker")
+	except Exception:
+		app.logger.warning(f"MQTT client didn't disconnect cleanly: {traceback.format_exc()}")
 # ** EndSection ** AppCreation
 
 
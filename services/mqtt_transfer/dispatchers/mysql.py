@@ -2,11 +2,14 @@ from typing import Any, Dict, List, Optional
 from pymysql.cursors import Cursor
 from datetime import datetime
 
+from tools import json_codec, metrics
+
 import pymysql
 import base64
-import json
 
 
+DISPATCHED_ROWS = metrics.counter("mqttrelay_dispatched_rows_total", "Rows written to client destinations by the dispatchers", ["type","outcome"])
+
 
 class MysqlDispatcher(object):
     """Insert parsed_points into a client MySQL database.
@@ -67,6 +70,37 @@ class MysqlDispatcher(object):
                 return x
         return x
 
+    def _row_from_point(p: Dict[str, Any], src_keys: List[str], metas: Dict[str, Any]) -> List[Any]:
+        """Row of a parsed point in the order of src_keys; metas caches the decoded meta_json strings."""
+        row: List[Any] = []
+        raw_meta = p.get("meta_json") or "{}"
+        if isinstance(raw_meta, dict):
+            meta = raw_meta
+        else:
+            meta = metas.get(raw_meta)
+            if meta is None:
+                meta = metas[raw_meta] = json_codec.loads(raw_meta)
+        for key in src_keys:
+            val = p.get(key, None)
+            if key == "ts":
+                val = MysqlDispatcher._iso_to_mysql_dt(val)
+            elif key == "value":
+                non_null_value = [v for k,v in p.items() if k.endswith('_value') and v is not None]
+                if len(non_null_value) == 0:
+                    raise Exception(f"Some parsed point has no values at all {p}")
+                elif len(non_null_value) > 1:
+                    raise Exception(f"Some parsed point has multiple values {p}")
+                val = non_null_value[0]
+            elif key == "device_id":
+                val = meta.get('devices',{}).get(str(val), val)
+            elif key == "metric_id":
+                val = meta.get('metrics',{}).get(str(val), val)
+            elif key in ("json_value", "meta_json") and val is not None and not isinstance(val, (str, bytes)):
+                # Ensure JSON/text columns get serialized JSON
+                val = json_codec.dumps(val)
+            row.append(val)
+        return row
+
     def dispatch(self, parsed_points: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
         parsed_points item example (canonical):
@@ -158,29 +192,8 @@ class MysqlDispatcher(object):
         updated = 0
         ignored = 0
 
-        def _row_from_point(p: Dict[str, Any]) -> List[Any]:
-            row: List[Any] = []
-            meta = json.loads(p.get("meta_json","{}"))
-            for key in src_keys:
-                val = p.get(key, None)
-                if key == "ts":
-                    val = MysqlDispatcher._iso_to_mysql_dt(val)
-                elif key == "value":
-                    non_null_value = [v for k,v in p.items() if k.endswith('_value') and v is not None]
-                    if len(non_null_value) == 0:
-                        raise Exception(f"Some parsed point has no values at all {p}")
-                    elif len(non_null_value) > 1:
-                        raise Exception(f"Some parsed point has multiple values {p}")
-                    val = non_null_value[0]
-                elif key == "device_id":
-                    val = meta.get('devices',{}).get(str(val), val)
-                elif key == "metric_id":
-                    val = meta.get('metrics',{}).get(str(val), val)
-                elif key in ("json_value", "meta_json") and val is not None and not isinstance(val, (str, bytes)):
-                    # Ensure JSON/text columns get serialized JSON
-                    val = json.dumps(val, ensure_ascii=False)
-                row.append(val)
-            return row
+        # points of an extraction share the same meta_json: decode each distinct one once
+        metas: Dict[str, Any] = {}
 
         # Chunked batch insert
         try:
@@ -203,8 +216,7 @@ class MysqlDispatcher(object):
                     # Prepare batches
                     for i in range(0, len(parsed_points), batch_size):
                         batch = parsed_points[i : i + batch_size]
-                        values = [_row_from_point(p) for p in batch]
-                        print(values)
+                        values = [MysqlDispatcher._row_from_point(p, src_keys, metas) for p in batch]
                         cur.executemany(sql, values)
                         conn.commit()
 
@@ -231,6 +243,9 @@ class MysqlDispatcher(object):
                         else:
                             inserted += rc  # "error" mode -> duplicates would have raised already
 
+            for outcome, count in [("inserted", inserted), ("updated", updated), ("ignored", ignored)]:
+                if count:
+                    DISPATCHED_ROWS.inc(count, type="mysql", outcome=outcome)
             return {
                 "status": "sent",
                 "http_status": None,
@@ -1,9 +1,10 @@
 from temod.storage.directory import DirectoryStorage
 from temod.storage import MysqlEntityStorage
+from temod.storage.mysql.mysqlAttributesTranslator import MysqlAttributesTranslator
 from temod.base.condition import *
 from temod.base.attribute import *
 
-from logging.handlers import RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from copy import deepcopy
 from pathlib import Path
@@ -11,9 +12,14 @@ from uuid import uuid4
 
 import importlib
 import traceback
+import atexit
+import hashlib
+import heapq
 import argparse
 import logging
 import math
+import signal
+import threading
 import toml
 import yaml
 import time
@@ -25,6 +31,22 @@ import os
 MQTTT_JOB_NAME = "MqttTransfer"
 MQTTT_LOG_NAME = "mqttt"
 
+# Seconds after which the in-memory route and topic indexes are rebuilt (long runs such as replays)
+INDEX_TTL = 60
+
+# Upper bounds (ms) of the per parser latency histograms logged at the end of a run
+LATENCY_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+# Set on SIGTERM/SIGINT: the run stops taking new messages, finishes the one being stored and dispatched,
+# flushes the latest values and exits normally. Messages not reached stay pending for the next run.
+DRAINING = threading.Event()
+
+REPLAY_DEFAULTS = {
+	"batch_size": 1000,
+	"workers": 2,
+	"rate": 50,  # messages per second
+}
+
 
 # Function to load configuration from TOML file
 def load_configs(root_dir):
@@ -35,46 +57,25 @@ def load_configs(root_dir):
 
 
 # Function to set up logging
-def get_logger(logging_dir):
-	"""Create and configure a logger with file and console handlers"""
-	os.makedirs(logging_dir, exist_ok=True)
-
-	logger = logging.getLogger()
-	logger.setLevel(logging.INFO)
-
-	if logger.handlers:
-		return logger
-
-	# Set up log message format
-	formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-	# Configure file handler if logging directory is valid
-	if logging_dir is not None and os.path.isdir(logging_dir):
-		fh = RotatingFileHandler(
-			os.path.join(logging_dir,f"{MQTTT_JOB_NAME}.log"),
-			maxBytes=5*1024*1024,  # 5MB
-			backupCount=3,
-			encoding='utf-8'
-		) 
-		fh.setLevel(logging.INFO)
-		fh.setFormatter(formatter)
-		logger.addHandler(fh)
-	else:
-		print("No valid logging directory specified. No logs will be kept.")
-
-	# Configure console handler
-	dh = logging.StreamHandler(sys.stdout)
-	dh.setLevel(logging.WARNING)
-	dh.setFormatter(formatter)
-	logger.addHandler(dh)
-
-	return logger
+def get_logger(logging_dir, settings=None):
+	"""
+	Root logger writing asynchronously to the logging directory (JSON lines by default) and, from WARNING, to stdout.
+	Configured by the log_* keys of [mqtt_transfer] (see tools/logs.py); the queued records are written on exit.
+	"""
+	from tools import logs
+	settings = {k[len("log_"):]:v for k,v in (settings or {}).items() if k.startswith("log_") and k[len("log_"):] in logs.LOG_DEFAULTS}
+	atexit.register(logs.setup(logging_dir, MQTTT_JOB_NAME, **{**logs.LOG_DEFAULTS, **settings}).close)
+	return logging.getLogger()
 
 
 class TopicNotFound(Exception):
 	pass
 		
 
+class DisabledTopic(Exception):
+	pass
+		
+
 class DeviceNotFound(Exception):
 	pass
 		
@@ -91,6 +92,10 @@ class ParserCodeNotFound(Exception):
 	pass
 		
 
+class LanguageNotHandled(Exception):
+	pass
+		
+
 class DeviceTypeNotFound(Exception):
 	pass
 		
@@ -108,36 +113,126 @@ class DepositNotFound(Exception):
 		
 		
 
+class CountingStorage(object):
+
+	""" Storage proxy counting the queries (round trips to the database) made through it on its transfer """
+	QUERIES = {"get","list","count","create","update","updateOnSnapshot","delete","getMany","getOne","executeAndCommit","generate_value"}
+
+	def __init__(self, storage, transfer):
+		super(CountingStorage, self).__init__()
+		self.storage = storage
+		self.transfer = transfer
+
+	def __getattr__(self, name):
+		attribute = getattr(self.storage, name)
+		if not name in CountingStorage.QUERIES:
+			return attribute
+		def counted(*args, **kwargs):
+			self.transfer.round_trips += 1
+			return attribute(*args, **kwargs)
+		return counted
+
+
+def transfer_metrics():
+	return {
+		"messages":metrics.counter("mqttrelay_transfer_messages_total", "Messages treated by the Mqtt Transfer service", ["outcome"]),
+		"backlog":metrics.gauge("mqttrelay_transfer_backlog_messages", "Pending messages at the start of the last Mqtt Transfer run"),
+		"parse":metrics.histogram("mqttrelay_parse_duration_seconds", "Wall time of parser calls (amortized over parse_many batches)", ["parser"]),
+		"route_selection":metrics.histogram("mqttrelay_route_selection_duration_seconds", "Time spent selecting the route of a message"),
+		"points":metrics.histogram("mqttrelay_points_per_extraction", "Points produced per extraction", buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500)),
+		"dispatch":metrics.histogram("mqttrelay_dispatch_duration_seconds", "Time spent dispatching an extraction to a client destination", ["destination","type","status"]),
+		"round_trips":metrics.histogram("mqttrelay_db_round_trips_per_message", "Database queries made to treat a message", buckets=(1, 2, 5, 10, 15, 20, 30, 50, 100)),
+	}
+
+
+class RouteIndex(object):
+
+	"""
+	Active routes bucketed by (client_id, topic_id, device_id or None for the device wildcard),
+	each bucket sorted by priority then newest first. Conditions are parsed once, when the index is built.
+	"""
+	def __init__(self, routes):
+		super(RouteIndex, self).__init__()
+		self.built_at = time.time()
+		self.buckets = {}
+		for route in routes:
+			self.buckets.setdefault((route['client_id'], route['topic_id'], route['device_id']), []).append(
+				(route['priority'], -route['created_at'].timestamp(), str(route['id']), route, RouteIndex.parse_conditions(route))
+			)
+		for bucket in self.buckets.values():
+			bucket.sort(key=lambda entry: entry[:3])
+
+	def parse_conditions(route):
+		if route['conditions'] is None or route['conditions'].strip() == "":
+			return None
+		try:
+			return json.loads(route['conditions'])
+		except Exception as e:
+			# raised at selection time, where the failure is logged and ranked
+			return ValueError(f"conditions of route #{route['id']} are not valid json: {e}")
+
+	def candidates(self, client_id, topic_id, device_id):
+		""" (priority, route, conditions) of the device and wildcard routes, in selection order """
+		specific = self.buckets.get((client_id, topic_id, device_id), [])
+		wildcard = self.buckets.get((client_id, topic_id, None), [])
+		for entry in heapq.merge(specific, wildcard, key=lambda entry: entry[:3]):
+			yield entry[0], entry[3], entry[4]
+
+
 class MqttTransfer(object):
 
 	"""docstring for MqttTransfer"""
-	def __init__(self, **mysql_credentials):
+	def __init__(self, latest_values_batch=500, parser_pool=None, parse_batch_size=256, tracer=None, **mysql_credentials):
 		super(MqttTransfer, self).__init__()
 		self.mysql_credentials = mysql_credentials
-		self.storages = {
+		storages = {
 			"mqtt_messages":MysqlEntityStorage(entities.MqttMessage,**mysql_credentials),
+			"pending_messages":MysqlEntityStorage(entities.PendingMessage,**mysql_credentials),
 			"parsers":MysqlEntityStorage(entities.Parser,**mysql_credentials),
 			"metrics":MysqlEntityStorage(entities.Metric,**mysql_credentials),
 			"parsed_points":MysqlEntityStorage(entities.ParsedPoint,**mysql_credentials),
 			"extractions":MysqlEntityStorage(entities.Extraction,**mysql_credentials),
-			"clients":MysqlEntityStorage(entities.Parser,**mysql_credentials),
+			"clients":MysqlEntityStorage(entities.Client,**mysql_credentials),
 			"topics":MysqlEntityStorage(entities.MqttTopic,**mysql_credentials),
 			"devices":MysqlEntityStorage(entities.Device,**mysql_credentials),
 			"routes":MysqlEntityStorage(entities.RoutingRule,**mysql_credentials),
 			"deposits":MysqlEntityStorage(entities.RouteDeposit,**mysql_credentials),
 			"dispatches":MysqlEntityStorage(entities.Dispatch,**mysql_credentials),
 			"destinations":MysqlEntityStorage(entities.ClientDestination,**mysql_credentials),
+			"latest_values":MysqlEntityStorage(entities.LatestValue,**mysql_credentials),
+			"crypto_config":MysqlEntityStorage(entities.CryptoConfig,**mysql_credentials),
+			"crypto_keys":MysqlEntityStorage(entities.CryptoKey,**mysql_credentials),
 		}
+		self.round_trips = 0
+		self.storages = {name:CountingStorage(storage, self) for name, storage in storages.items()}
+		self.instruments = transfer_metrics()
 		self.metrics_cache = {}
 		self.device_types_cache = {}
-
-	def load_parse_python_function(parser):
+		self.latest_values_batch = latest_values_batch
+		self.latest_values = {}
+		self.route_index = None
+		self.topic_index = None
+		self.topic_index_built_at = 0
+		self.parser_pool = parser_pool
+		self.parse_batch_size = max(1, int(parse_batch_size))
+		self.unbatched_parsers = set()
+		self.tracer = tracer
+		self.parse_latencies = {}
+		self.crypto_config = None
+		self.crypto_config_loaded_at = 0
+
+	def parser_module(parser):
+		if parser['language'].lower() != "python":
+			raise LanguageNotHandled(f"The parser #{parser['id']} is coded in an unknown language ({parser['language']})")
 
 		filename = "_".join([parser['name'].lower().replace(" ","_"), parser['version'].lower().replace('.','_')])
 		if not PARSERS_DB.has(filename):
 			raise ParserCodeNotFound(f"Parser #{parser['id']} code not found (should exist at {os.path.join(PARSERS_DB.directory, filename)})")
 
-		module = importlib.import_module(f"db.parsers.{filename.rsplit('.py',1)[0]}")
+		return f"db.parsers.{filename.rsplit('.py',1)[0]}"
+
+	def load_parse_python_function(parser):
+		module = importlib.import_module(MqttTransfer.parser_module(parser))
 		return module.parse
 
 	def load_parse_function(parser):
@@ -164,56 +259,101 @@ class MqttTransfer(object):
 		# TODO
 		return "good"
 
+	def load_topic_index(self):
+		if self.topic_index is None or time.time() - self.topic_index_built_at > INDEX_TTL:
+			self.topic_index = TopicTrie()
+			for topic in self.storages['topics'].list():
+				try:
+					self.topic_index.insert(topic['topic'], topic)
+				except ValueError as e:
+					LOGGER.warning("Topic #%s is ignored: %s", topic['id'], e, extra={"topic_id":topic['id'], "dedup_key":topic['id']})
+			self.topic_index_built_at = time.time()
+		return self.topic_index
+
 	def retrieve_sender(self, message):
-		topic = self.storages['topics'].get(topic=message['topic'],active=True)
-		if topic is None:
-			topic = self.storages['topics'].get(topic=message['topic'])
-			if topic is None:
+		"""
+		The most specific active topic definition (plain topic or +/# filter) matching the message topic identifies
+		the sender: disabled definitions only matter when no active one matches (e.g. a device re-provisioned on its topic).
+		"""
+		topic_index = self.load_topic_index()
+		matched = topic_index.best(message['topic'], accept=lambda topic: topic['active'])
+		if matched is None:
+			disabled = topic_index.best(message['topic'])
+			if disabled is None:
 				raise TopicNotFound(f"Message has been published to an unknown topic {message['topic']}")
-			raise DisabledTopic(f"Message has been published to a disabled topic {message['topic']} (topic: #{topic['id']})")
+			raise DisabledTopic(f"Message has been published to a disabled topic {message['topic']} (topic: #{disabled[1]['id']})")
+		topic = matched[1]
 
-		device = self.storages['devices'].get(id=topic['device_id'])
+		if topic['device_id'] is not None:
+			device = self.storages['devices'].get(id=topic['device_id'])
+		else:
+			# a topic filter shared by several devices: the device is the one publishing on this exact topic
+			device = self.storages['devices'].get(topic=message['topic'])
 		if device is None:
 			raise DeviceNotFound(f"Topic {message['topic']} is not linked to any device")
 
-		client = self.storages['clients'].get(id=topic['client_id'])
+		client = self.storages['clients'].get(id=topic['client_id'] if topic['client_id'] is not None else device['client_id'])
 		if client is None:
 			raise ClientNotFound(f"Topic {message['topic']} is not linked to any client")
 
 		return topic, device, client
 
-	def select_route(self, client, device, topic, message):
+	def load_route_index(self):
+		if self.route_index is None or time.time() - self.route_index.built_at > INDEX_TTL:
+			self.route_index = RouteIndex(self.storages['routes'].list(active=True))
+		return self.route_index
 
-		candidates = []
-		evaluated = {}
-		for route in self.storages['routes'].list(Or(Equals(IntegerAttribute("device_id",value=device['id'])),Equals(IntegerAttribute("device_id"))),client_id=client['id'], topic_id=topic['id'], active=True):
-			context = {
-				"device":device.to_dict(), "device_type": self._load_device_type(device['device_type_id']).to_dict(), "topic": topic.to_dict(),"message": message.to_dict()
-			}
-			if route['conditions'] is not None and route['conditions'].strip() != "":
+	def select_route(self, client, device, topic, message):
+		"""
+		Newest route of the best priority, a route whose conditions hold being preferred over a conditionless one,
+		itself preferred over a route whose conditions failed to be evaluated.
+		Candidates come presorted from the route index: only the conditions of the best priority tier are evaluated.
+		"""
+		context = None
+		selected = None; tier = None; ties = []
+		for priority, route, conditions in self.load_route_index().candidates(client['id'], topic['id'], device['id']):
+			if tier is not None and priority != tier:
+				break
+
+			if conditions is None:
+				rank = 0
+			else:
+				if context is None:
+					context = {
+						"device":device.to_dict(), "device_type": self._load_device_type(device['device_type_id']).to_dict(), "topic": topic.to_dict(),"message": message.to_dict()
+					}
 				try:
-					evaluation = eval_mongo_dsl(route['conditions'], **context)
-					if not eval_mongo_dsl(route['conditions'], **context):
+					if isinstance(conditions, Exception):
+						raise conditions
+					if not eval_mongo_dsl(conditions, context):
 						continue
-					evaluated[route['id']] = 1
-				except:
-					LOGGER.warning(f"condition in route {route['id']} has failed to be evaulated for context {json.dumps(context)}. Route will be considered conditionless and its priority will be decreased.")
-					evaluated[route['id']] = -1
-			candidates.append(route)
-
-		prioritary = []
-		if len(candidates):
-			prioritary = [candidate for candidate in candidates if candidate['priority'] == min([c['priority'] for c in candidates])]
-			prioritary = [candidate for candidate in prioritary if candidate['priority']-evaluated.get(candidate['id'],0) == min([c['priority']-evaluated.get(candidate['id'],0) for c in prioritary])]
-
-		prioritary = sorted(prioritary, key=lambda x:x['created_at'], reverse=True)
-		if len(prioritary) > 1:
-			LOGGER.warning(f"Multiple routes are possible for message #{message['id']} ({','.join(['route #'+str(route['id']) for route in prioritary])}). Newest one will be selected")
-		elif len(prioritary) == 0:
+					rank = 1
+				except Exception as e:
+					# the context is only serialized by the logging thread, and once per route and dedup window
+					LOGGER.warning(
+						"Condition of route #%s failed to be evaluated (%s): the route is considered conditionless and its priority decreased", route['id'], e,
+						extra={"message_id":message['id'], "route_id":route['id'], "context":context, "dedup_key":route['id']}
+					)
+					rank = -1
+
+			tier = priority
+			if selected is None or rank > selected[0]:
+				selected = (rank, route); ties = []
+			elif rank == selected[0]:
+				ties.append(route)
+			if rank == 1:
+				# candidates are sorted newest first within a tier: no route of this tier can do better
+				break
+
+		if selected is None:
 			raise NoRouteFound(f"No route found to manage message #{message['id']}")
-
-		selected = prioritary[0]
-		LOGGER.info(f"Route #{route['id']} has been selected for message #{message['id']}")
+		selected = selected[1]
+		if len(ties):
+			routes = [route['id'] for route in [selected]+ties]
+			LOGGER.warning(
+				"Multiple routes are possible for message #%s (routes %s): the newest one is selected", message['id'], routes,
+				extra={"message_id":message['id'], "routes":routes, "dedup_key":tuple(routes)}
+			)
 
 		try:
 			json.loads(selected['parser_config'] or "{}")
@@ -221,37 +361,204 @@ class MqttTransfer(object):
 			raise ValueError(f"The parser configuration of route #{selected['id']} ({selected['parser_config']}) should be in json format")
 		return selected
 
-	def process_message(self, message):
-		extraction = {"id":self.storages['extractions'].generate_value('id'),"message_id":message['id'], "parsed_at":datetime.now(), "success":True}
-
-		topic, device, client = self.retrieve_sender(message)
-		LOGGER.info(f"{message['id']} sent by device #{device['id']} of client {client['name']} (#{client['id']})")
-
-		route = self.select_route(client, device, topic, message)
-		LOGGER.info(f"route (#{route['id']}) selected for message #{message['id']}")
-
-		parser = self.storages['parsers'].get(id=route['parser_id'])
-		LOGGER.info(f"{parser['name']} selected for message #{message['id']}")
-
-		extraction['parser_id'] = parser['id']
-		extraction['parser_config'] = route['parser_config']
-
-		parse_function = MqttTransfer.load_parse_function(parser)
-
-		results = parse_function(json.loads(message['payload']) if type(message['payload']) is str else message['payload'], **json.loads(route['parser_config'] or "{}"))
+	def start_trace(self, message):
+		if self.tracer is None:
+			return NULL_TRACE
+		return self.tracer.start(message['id'], sender=message['client'])
+
+	def prepare_message(self, message, trace=None):
+		""" Device, route and parser of a message """
+		trace = NULL_TRACE if trace is None else trace
+		with trace.span("retrieve_sender", topic=message['topic']):
+			topic, device, client = self.retrieve_sender(message)
+		trace.set(client_id=client['id'], device_id=device['id'])
+
+		started = time.perf_counter()
+		with trace.span("select_route"):
+			route = self.select_route(client, device, topic, message)
+		self.instruments['route_selection'].observe(time.perf_counter() - started)
+
+		with trace.span("load_parser", parser_id=route['parser_id']):
+			parser = self.storages['parsers'].get(id=route['parser_id'])
+		LOGGER.info(
+			"Message #%s sent by device #%s of client %s: route #%s, parser %s", message['id'], device['id'], client['name'], route['id'], parser['name'],
+			extra={"message_id":message['id'], "client_id":client['id'], "device_id":device['id'], "route_id":route['id'], "parser_id":parser['id']}
+		)
+		trace.set(route_id=route['id'], parser_id=parser['id'])
+
+		return device, route, parser
+
+	def process_message(self, message, trace=None):
+		device, route, parser = self.prepare_message(message, trace)
+		return self.extract(message, device, route, parser, *self.run_parser_safely(parser, route, message, trace), trace=trace)
+
+	def process_batch(self, messages, stop=None):
+		"""
+		Outcome of each message, (points, extraction, route) or the exception raised while processing it.
+		Messages sharing a route and a parser are parsed together, in chunks of parse_batch_size, when the parser defines parse_many.
+		Once the stop event is set no more chunks are parsed: the messages left have a None outcome.
+		"""
+		outcomes = [None]*len(messages)
+		self.batch_round_trips = [0]*len(messages)
+		self.batch_traces = [self.start_trace(message) for message in messages]
+		groups = {}
+		for i, message in enumerate(messages):
+			round_trips = self.round_trips
+			try:
+				device, route, parser = self.prepare_message(message, self.batch_traces[i])
+			except Exception as e:
+				outcomes[i] = e; continue
+			finally:
+				self.batch_round_trips[i] += self.round_trips - round_trips
+			groups.setdefault((route['id'], parser['id']), (route, parser, []))[2].append((i, message, device))
+
+		for route, parser, members in groups.values():
+			for start in range(0, len(members), self.parse_batch_size):
+				if stop is not None and stop.is_set():
+					return outcomes
+				chunk = members[start:start+self.parse_batch_size]
+				parsed = None
+				if len(chunk) > 1:
+					started = now_ns()
+					parsed = self.run_parser_many(parser, route, [message for i, message, device in chunk])
+					if parsed is not None:
+						for i, message, device in chunk:
+							# the batch span is shared by the traces of its sampled messages
+							self.batch_traces[i].add_span("parse_many", started, now_ns(), parser_id=parser['id'], batch_size=len(chunk))
+				for j, (i, message, device) in enumerate(chunk):
+					round_trips = self.round_trips
+					trace = self.batch_traces[i]
+					try:
+						outcome = parsed[j] if parsed is not None else self.run_parser_safely(parser, route, message, trace)
+						outcomes[i] = self.extract(message, device, route, parser, *outcome, trace=trace)
+					except Exception as e:
+						outcomes[i] = e
+					self.batch_round_trips[i] += self.round_trips - round_trips
+		return outcomes
+
+	def run_parser_safely(self, parser, route, message, trace=None):
+		""" (results, timing, error): a parser interrupted by the sandbox makes a failed extraction rather than a failed message """
+		try:
+			with (NULL_TRACE if trace is None else trace).span("parse", parser_id=parser['id']):
+				return (*self.run_parser(parser, route, message), None)
+		except ParserSandboxError as e:
+			LOGGER.warning("Parser #%s interrupted on message #%s: %s", parser['id'], message['id'], e, extra={"message_id":message['id'], "parser_id":parser['id'], "dedup_key":parser['id']})
+			return None, e.timing or {}, str(e)
+
+	def extract(self, message, device, route, parser, results, timing, error=None, trace=None):
+		trace = NULL_TRACE if trace is None else trace
+		extraction = {
+			"id":self.storages['extractions'].generate_value('id'),"message_id":message['id'], "parsed_at":datetime.now(), "success":True,
+			"parser_id":parser['id'], "parser_config":route['parser_config'], "error_text":error
+		}
+		extraction['parse_ms'] = timing.get('wall_ms')
+		extraction['cpu_ms'] = timing.get('cpu_ms')
 
-		if not results:
-			extraction['error'] = f"Parsing function didn't return any result for message #{message['id']}: {json.dumps(message['payload'])}"
-			LOGGER.warning(extraction['error'])
+		if extraction.get('error_text') is not None:
+			extraction['success'] = False
+		elif not results:
+			extraction['error_text'] = f"Parsing function didn't return any result for message #{message['id']}: {json_codec.dumps(message['payload'])}"
+			LOGGER.warning("Parser #%s didn't return any result for message #%s", parser['id'], message['id'], extra={"message_id":message['id'], "parser_id":parser['id'], "dedup_key":parser['id']})
 			extraction['success'] = False
 		else:
 			extraction['extracted_count'] = len(results)
 
+		with trace.span("build_points"):
+			points = self.build_points(results, message, device, extraction['id'])
+		self.instruments['points'].observe(len(points))
+		trace.set(extraction_id=extraction['id'], points=len(points))
+		return points, entities.Extraction(**extraction), route
+
+	def decode_payload(message):
+		return json_codec.loads(message['payload']) if type(message['payload']) in [str, bytes] else message['payload']
+
+	def run_parser(self, parser, route, message):
+		""" Parser results and the {wall_ms, cpu_ms} it took: in a sandbox worker when a parser pool is configured, in-process otherwise """
+		payload = MqttTransfer.decode_payload(message)
+		config = json_codec.loads(route['parser_config'] or "{}")
+		try:
+			if self.parser_pool is not None:
+				results, timing = self.parser_pool.call(MqttTransfer.parser_module(parser), payload, config)
+			else:
+				parse_function = MqttTransfer.load_parse_function(parser)
+				started_wall = time.perf_counter(); started_cpu = time.process_time()
+				results = parse_function(payload, **config)
+				timing = {"wall_ms":1000*(time.perf_counter() - started_wall), "cpu_ms":1000*(time.process_time() - started_cpu)}
+		except ParserSandboxError as e:
+			self.record_parse_latency(parser, (e.timing or {}).get('wall_ms'))
+			raise
+		self.record_parse_latency(parser, timing['wall_ms'])
+		return results, timing
+
+	def run_parser_many(self, parser, route, messages):
+		"""
+		(results, timing) of each message through the optional parse_many(payloads, **config) of the parser, timings being amortized over the batch.
+		None when the parser has no parse_many or the batch failed: the messages are then parsed one by one.
+		"""
+		try:
+			module_name = MqttTransfer.parser_module(parser)
+			if module_name in self.unbatched_parsers:
+				return None
+			payloads = [MqttTransfer.decode_payload(message) for message in messages]
+			config = json_codec.loads(route['parser_config'] or "{}")
+			if self.parser_pool is not None:
+				results, timing = self.parser_pool.call(module_name, payloads, config, function="parse_many", calls=len(payloads))
+			else:
+				parse_many = getattr(importlib.import_module(module_name), "parse_many", None)
+				if parse_many is None:
+					raise ParserFunctionMissing(f"Parser {module_name} has no parse_many function")
+				started_wall = time.perf_counter(); started_cpu = time.process_time()
+				results = parse_many(payloads, **config)
+				timing = {"wall_ms":1000*(time.perf_counter() - started_wall), "cpu_ms":1000*(time.process_time() - started_cpu)}
+			results = list(results) if results is not None else []
+			if len(results) != len(payloads):
+				raise ValueError(f"parse_many returned {len(results)} results for {len(payloads)} payloads")
+		except ParserFunctionMissing:
+			self.unbatched_parsers.add(module_name)
+			return None
+		except Exception as e:
+			LOGGER.warning("parse_many of parser #%s failed on a batch of %s messages, parsing them one by one: %s", parser['id'], len(messages), e, extra={"parser_id":parser['id'], "dedup_key":parser['id']})
+			return None
+
+		timing = {"wall_ms":timing['wall_ms']/len(payloads), "cpu_ms":timing['cpu_ms']/len(payloads)}
+		for result in results:
+			self.record_parse_latency(parser, timing['wall_ms'])
+		return [(result, dict(timing), None) for result in results]
+
+	def record_parse_latency(self, parser, wall_ms):
+		if wall_ms is None:
+			return
+		self.instruments['parse'].observe(wall_ms/1000, parser=parser['id'])
+		histogram = self.parse_latencies.setdefault(parser['id'], [0]*(len(LATENCY_BUCKETS_MS)+1))
+		histogram[next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if wall_ms <= bound), len(LATENCY_BUCKETS_MS))] += 1
+
+	def log_parse_latencies(self):
+		bounds = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+		for parser_id, histogram in sorted(self.parse_latencies.items()):
+			LOGGER.info("Parser #%s latencies (%s calls)", parser_id, sum(histogram), extra={"parser_id":parser_id, "latencies":{bound:count for bound, count in zip(bounds, histogram) if count}})
+		self.parse_latencies = {}
+
+	def route_matches(self, route, client, device, topic, message):
+		""" Whether a route (active or not) would be a candidate for a message """
+		if route['client_id'] != client['id'] or route['topic_id'] != topic['id'] or not route['device_id'] in [None, device['id']]:
+			return False
+		if route['conditions'] is None or route['conditions'].strip() == "":
+			return True
+		context = {
+			"device":device.to_dict(), "device_type": self._load_device_type(device['device_type_id']).to_dict(), "topic": topic.to_dict(),"message": message.to_dict()
+		}
+		return eval_mongo_dsl(json.loads(route['conditions']), context)
+
+	def build_points(self, results, message, device, extraction_id):
 		ts = message['at']
 		if "at" in (results or {}):
 			ts = results['at']
 
-		parsed = []
+		# identical for every point of the extraction: encoded once and shared
+		meta_json = json_codec.dumps({k:v for k,v in (results or {}).items() if not type(k) is int})
+
+		# points are kept as columns (tools/points.py) until they are inserted and dispatched: no entity per point
+		parsed = PointBatch(extraction_id, device['id'], ts, meta_json)
 		for metric_id, value in (results or {}).items():
 			if not (type(metric_id) is int):
 				continue
@@ -265,14 +572,12 @@ class MqttTransfer(object):
 				value_field = "bool_value"
 			elif type(value) in [dict, list]:
 				value_field = "json_value"
-				transformer = lambda x: json.dumps(x)
-			parsed.append(entities.ParsedPoint(
-				id=-1, extraction_id=extraction['id'],device_id=device['id'],metric_id=metric_id, ts=ts, unit=metric['default_unit'], quality=self.judge_data_quality(
-					metric, value
-				), meta_json=json.dumps({k:v for k,v in results.items() if not type(k) is int}),**{value_field:transformer(value)}
-			))
+				transformer = json_codec.dumps
+			else:
+				raise ValueError(f"Value of metric #{metric_id} has an unsupported type {type(value).__name__}")
+			parsed.append(metric_id, value_field, transformer(value), unit=metric['default_unit'], quality=self.judge_data_quality(metric, value))
 
-		return parsed, entities.Extraction(**extraction), route
+		return parsed
 
 
 	def on_data_sent(self, dispatch, **kwargs):
@@ -282,6 +587,34 @@ class MqttTransfer(object):
 		return dispatch["status"].name == "sent"
 
 
+	def _load_crypto_config(self):
+		if self.crypto_config is None or time.time() - self.crypto_config_loaded_at > INDEX_TTL:
+			self.crypto_config = self.storages['crypto_config'].get()
+			self.crypto_config_loaded_at = time.time()
+		return self.crypto_config
+
+	def _decrypt_secret(self, token, encryption_version):
+		crypto_config = self._load_crypto_config()
+		if crypto_config is None:
+			raise RuntimeError("No crypto config defined to decrypt the destination secrets")
+		key_id, version = (None, None) if encryption_version is None else encryption_version.rsplit('.', 1)
+		return crypto_config.decrypt(token, key_id, None if version is None else int(version), storage=self.storages['crypto_keys']).decode('utf-8')
+
+	def destination_password(self, destination):
+		"""
+		Clear password of a destination, decrypted once per (destination, encryption_version) by the credential cache.
+		None for the legacy (base64) secrets, left to the dispatcher.
+		"""
+		token = destination['password_enc']
+		if isinstance(token, (bytes, bytearray)):
+			token = token.decode('ascii', 'replace')
+		if not token or not token.startswith("v1."):
+			return None
+		return CREDENTIALS.secret(
+			("destination", destination['id']), destination['encryption_version'], token,
+			lambda token: self._decrypt_secret(token, destination['encryption_version'])
+		)
+
 	def dispatch_to_deposit(self, deposit, extraction, data_points):
 		destination = self.storages['destinations'].get(id=deposit['destination_id'])
 		if destination is None:
@@ -299,19 +632,27 @@ class MqttTransfer(object):
 
 		dispatcher = dispatcher_class(
 			**{k:v for k,v in destination.to_dict().items() if k != "options_json"},
-			**(json.loads(destination['options_json']) if type(destination['options_json']) is str else destination['options_json'])
+			**{
+				"password":self.destination_password(destination),
+				**(json.loads(destination['options_json']) if type(destination['options_json']) is str else destination['options_json'])
+			}
 		)
-		LOGGER.info(f"Dispatcher of type {dispatcher_class.__name__} has been loaded and initialized successfully")
 		is_asynchronous = getattr(dispatcher,'asynchronous',False)
 		if is_asynchronous:
 			dispatcher.setCallback(lambda *x,**y: self.on_data_sent(deposit, *x, **y))
 
+		started = time.perf_counter()
 		try:
-			results = dispatcher.dispatch(parsed_points=[dp.to_dict() for dp in data_points])
+			results = dispatcher.dispatch(parsed_points=data_points.to_dicts())
 		except:
-			LOGGER.warning(f"Dispatch has failed")
-			LOGGER.warning(traceback.format_exc())
 			results = {"status":"failed", "response_snippet": traceback.format_exc()}
+			LOGGER.warning(
+				"Dispatch to destination #%s has failed", destination['id'], exc_info=True,
+				extra={"extraction_id":extraction['id'], "destination_id":destination['id'], "dedup_key":destination['id']}
+			)
+		self.instruments['dispatch'].observe(
+			time.perf_counter() - started, destination=destination['id'], type=destination['type'].name.lower(), status=results.get('status')
+		)
 
 		if not is_asynchronous:
 			return self.on_data_sent(dispatch, **results)
@@ -319,7 +660,8 @@ class MqttTransfer(object):
 		return True
 
 
-	def send_parsed_data(self, route, extraction, data_points):
+	def send_parsed_data(self, route, extraction, data_points, trace=None):
+		trace = NULL_TRACE if trace is None else trace
 
 		dispatched = []
 		deposits = list(self.storages['deposits'].list(rule_id=route['id']))
@@ -327,50 +669,333 @@ class MqttTransfer(object):
 			raise DepositNotFound(f"No client destination found for routing rule #{route['id']}")
 
 		for deposit in deposits:
-			LOGGER.info(f"Sending {len(data_points)} points of data  from extraction #{extraction['id']} to deposit (rule: #{deposit['rule_id']} - destination {deposit['destination_id']})")
+			LOGGER.info(
+				"Sending %s points of extraction #%s to destination #%s (rule #%s)", len(data_points), extraction['id'], deposit['destination_id'], deposit['rule_id'],
+				extra={"message_id":extraction['message_id'], "extraction_id":extraction['id'], "destination_id":deposit['destination_id'], "rule_id":deposit['rule_id']}
+			)
 			try:
-				dispatched.append(self.dispatch_to_deposit(deposit, extraction, data_points))
+				with trace.span("dispatch_to_deposit", rule_id=deposit['rule_id'], destination_id=deposit['destination_id']):
+					dispatched.append(self.dispatch_to_deposit(deposit, extraction, data_points))
 				if not dispatched[-1]:
-					LOGGER.warning(f"Dispatch to deposit (rule: #{deposit['rule_id']} - destination {deposit['destination_id']}) for extraction #{extraction['id']} didn't end with success")
+					LOGGER.warning(
+						"Dispatch of extraction #%s to destination #%s (rule #%s) didn't end with success", extraction['id'], deposit['destination_id'], deposit['rule_id'],
+						extra={"extraction_id":extraction['id'], "destination_id":deposit['destination_id'], "rule_id":deposit['rule_id'], "dedup_key":deposit['destination_id']}
+					)
 			except:
-				LOGGER.error(f"Error while dispatching data of extraction #{extraction['id']} to destination {deposit['destination_id']}")
-				LOGGER.error(traceback.format_exc())
+				LOGGER.error(
+					"Error while dispatching data of extraction #%s to destination #%s", extraction['id'], deposit['destination_id'], exc_info=True,
+					extra={"extraction_id":extraction['id'], "destination_id":deposit['destination_id']}
+				)
 				dispatched.append(False)
 
 		return all(dispatched)
 
 
+	def track_latest_values(self, points):
+		""" Keeps the newest point per (device, metric key) until the batch is flushed to latest_value """
+		for point in points:
+			if point['device_id'] is None or point['metric_id'] is None:
+				continue
+			key = (point['device_id'], self._load_metric(point['metric_id'])['key_name'])
+			current = self.latest_values.get(key)
+			if current is not None and current['ts'] > point['ts']:
+				continue
+			self.latest_values[key] = entities.LatestValue(
+				device_id=key[0], key_name=key[1], **{field:point[field] for field in entities.LatestValue.VALUE_FIELDS+["ts"]}
+			)
+		if len(self.latest_values) >= self.latest_values_batch:
+			self.flush_latest_values()
+
+	def flush_latest_values(self):
+		if len(self.latest_values) == 0:
+			return
+		try:
+			entities.LatestValue.upsert(*self.latest_values.values(), storage=self.storages['latest_values'])
+			LOGGER.info("%s latest values upserted", len(self.latest_values))
+		except:
+			LOGGER.error("Error while upserting latest values", exc_info=True)
+		self.latest_values = {}
+
+
 	def process(self, directory):
+		backlog = self.storages['pending_messages'].count()
+		LOGGER.info("%s mqtt messages unprocessed", backlog)
+		self.instruments['backlog'].set(backlog)
+		return self.process_messages(self.pending_chunks())
+
+
+	def pending_chunks(self):
+		"""
+		The pending messages, parse_batch_size at a time: a chunk is only read once the previous one is stored and dispatched,
+		so memory doesn't grow with the backlog. Messages left pending by a chunk are not read again during the run.
+		"""
+		after = None
+		while True:
+			chunk = list(entities.MqttMessage.pending(limit=self.parse_batch_size, after=after, storage=self.storages['mqtt_messages']))
+			if len(chunk) == 0:
+				return
+			yield chunk
+			after = chunk[-1]['id']
+
+
+	def process_messages(self, chunks):
+		""" Treats the chunks of messages one after the other, until they are exhausted or the run is drained """
+		data_treated = []
+		for messages in chunks:
+			data_treated += self.treat_messages(messages, stop=DRAINING)
+			if DRAINING.is_set():
+				break
+		self.flush_latest_values()
+		self.log_parse_latencies()
+		return all(data_treated)
+
 
+	def treat_messages(self, messages, stop=None):
+		""" Once the stop event is set the messages left are not treated and stay pending """
 		data_treated = []
-		to_treat = list(self.storages['mqtt_messages'].list(processed=False))
-		LOGGER.info(f"{len(to_treat)} mqtt messages unprocessed")
-		for mqtt_message in to_treat:
+		outcomes = self.process_batch(messages, stop=stop)
+		for i, (mqtt_message, outcome) in enumerate(zip(messages, outcomes)):
+			if stop is not None and stop.is_set():
+				break
+			round_trips = self.round_trips
+			trace = self.batch_traces[i]
 			try:
-
-				points, extraction, route = self.process_message(mqtt_message)
-				self.storages['extractions'].create(extraction)
-				for point in points:
-					self.storages['parsed_points'].create(point)
+				if isinstance(outcome, Exception):
+					raise outcome
+
+				points, extraction, route = outcome
+				with trace.span("store", points=len(points)):
+					self.storages['extractions'].create(extraction)
+					entities.ParsedPoint.insert(points, storage=self.storages['parsed_points'])
+					self.track_latest_values(points)
 				
 				if not extraction['success']:
 					data_treated.append(False); continue
 
-				sent = self.send_parsed_data(route, extraction, points)
-				mqtt_message.takeSnapshot()['processor'] = extraction['id']
-				if sent:
-					mqtt_message["processed"] =True
-				self.storages['mqtt_messages'].updateOnSnapshot(mqtt_message)
+				with trace.span("dispatch"):
+					sent = self.send_parsed_data(route, extraction, points, trace)
+				with trace.span("update_message"):
+					mqtt_message.takeSnapshot()['processor'] = extraction['id']
+					if sent:
+						mqtt_message["processed"] =True
+					self.storages['mqtt_messages'].updateOnSnapshot(mqtt_message)
+					if sent:
+						self.storages['pending_messages'].delete(id=mqtt_message['id'])
 
 				data_treated.append(sent)
 
 			except:
-				LOGGER.error(f"Error while processing mqtt mqtt_message {json.dumps(mqtt_message.to_dict())}")
-				LOGGER.error(traceback.format_exc())
+				LOGGER.error(
+					"Error while processing mqtt message #%s of topic %s", mqtt_message['id'], mqtt_message['topic'], exc_info=True,
+					extra={"message_id":mqtt_message['id'], "topic":mqtt_message['topic']}
+				)
 				data_treated.append(False)
+			finally:
+				self.instruments['round_trips'].observe(self.batch_round_trips[i] + self.round_trips - round_trips)
+				self.instruments['messages'].inc(outcome="treated" if data_treated[-1] else "failed")
+				if self.tracer is not None:
+					trace.set(treated=data_treated[-1], round_trips=self.batch_round_trips[i] + self.round_trips - round_trips)
+					self.tracer.finish(trace)
+
+		return data_treated
+
+
+class MqttReplay(object):
+
+	"""
+	Streams recorded messages (database or cold archives) through the parsing and dispatch pipeline in batches.
+	 - messages still pending are left to the recurrent job
+	 - each batch is shared between 'workers' threads (one MqttTransfer each) and the replay is paced to 'rate' messages per second
+	 - progress is checkpointed after every batch: a replay of the same selection resumes where it stopped
+	"""
+	def __init__(self, transfers, checkpoint_dir, start=None, end=None, topics=None, clients=None, archive=None, batch_size=1000, rate=50):
+		super(MqttReplay, self).__init__()
+		self.transfers = transfers
+		self.selection = {
+			"start":None if start is None else start.isoformat(), "end":None if end is None else end.isoformat(),
+			"topics":sorted(topics or []), "clients":sorted(clients or []), "archive":archive
+		}
+		self.start = start; self.end = end
+		self.topics = topics or []; self.clients = clients or []
+		self.archive = archive
+		self.batch_size = batch_size
+		self.rate = rate
+		key = hashlib.sha1(json.dumps(self.selection, sort_keys=True).encode()).hexdigest()[:16]
+		self.checkpoint_file = os.path.join(checkpoint_dir, f"replay_{key}.json")
+
+	def load_checkpoint(self):
+		if not os.path.isfile(self.checkpoint_file):
+			return {"selection":self.selection, "last_id":0, "treated":0, "failed":0, "done":False}
+		with open(self.checkpoint_file) as file:
+			return json.load(file)
+
+	def save_checkpoint(self, checkpoint):
+		os.makedirs(os.path.dirname(self.checkpoint_file), exist_ok=True)
+		checkpoint['updated_at'] = datetime.now().isoformat()
+		with open(self.checkpoint_file+".part","w") as file:
+			json.dump(checkpoint, file)
+		os.replace(self.checkpoint_file+".part", self.checkpoint_file)
+
+	def select_from_database(self, after_id):
+		storage = self.transfers[0].storages['mqtt_messages']
+		conditions = [f"NOT EXISTS (SELECT 1 FROM {entities.PendingMessage.ENTITY_NAME} p WHERE p.id = m.id)"]
+		if self.start is not None:
+			conditions.append(f"m.at >= {MysqlAttributesTranslator.translate(DateTimeAttribute('at',value=self.start))}")
+		if self.end is not None:
+			conditions.append(f"m.at < {MysqlAttributesTranslator.translate(DateTimeAttribute('at',value=self.end))}")
+		for field, values in [("topic",self.topics),("client",self.clients)]:
+			if len(values):
+				conditions.append(f"m.{field} IN ({', '.join([MysqlAttributesTranslator.translate(StringAttribute(field,value=v)) for v in values])})")
+		while True:
+			rows = list(storage.getMany(
+				f"SELECT m.* FROM {entities.MqttMessage.ENTITY_NAME} m WHERE m.id > {int(after_id)} AND {' AND '.join(conditions)} "
+				f"ORDER BY m.id LIMIT {self.batch_size}"
+			))
+			if len(rows) == 0:
+				return
+			yield [storage.entity_generator(row) for row in rows]
+			after_id = rows[-1]['id']
+
+	def select_from_archive(self, after_id):
+		batch = []
+		for row in cold_archive.read_archives(self.archive, entities.MqttMessage.ENTITY_NAME, self.start, self.end):
+			if row['id'] <= after_id or (len(self.topics) and not row['topic'] in self.topics) or (len(self.clients) and not row['client'] in self.clients):
+				continue
+			batch.append(entities.MqttMessage(**row))
+			if len(batch) >= self.batch_size:
+				yield batch; batch = []
+		if len(batch):
+			yield batch
+
+	def treat_batch(self, executor, batch):
+		chunks = [batch[i::len(self.transfers)] for i in range(len(self.transfers))]
+		def treat(transfer, chunk):
+			treated = transfer.treat_messages(chunk)
+			transfer.flush_latest_values()
+			return treated
+		return [treated for results in executor.map(treat, self.transfers, chunks) for treated in results]
+
+	def run(self, restart=False):
+		checkpoint = self.load_checkpoint() if not restart else {"selection":self.selection, "last_id":0, "treated":0, "failed":0, "done":False}
+		if checkpoint['done']:
+			LOGGER.info("Replay already completed (%s). Use --restart to replay it again", self.checkpoint_file)
+			return True
+		if checkpoint['last_id'] > 0:
+			LOGGER.info("Resuming replay after message #%s (%s messages already replayed)", checkpoint['last_id'], checkpoint['treated'])
+
+		source = self.select_from_archive if self.archive is not None else self.select_from_database
+		started_at = time.time(); replayed = 0
+		with ThreadPoolExecutor(max_workers=len(self.transfers)) as executor:
+			for batch in source(checkpoint['last_id']):
+				if DRAINING.is_set():
+					LOGGER.info("Replay interrupted after message #%s, rerun the same command to resume it", checkpoint['last_id'])
+					return checkpoint['failed'] == 0
+				treated = self.treat_batch(executor, batch)
+				checkpoint['last_id'] = max(message['id'] for message in batch)
+				checkpoint['treated'] += len(treated)
+				checkpoint['failed'] += len([t for t in treated if not t])
+				self.save_checkpoint(checkpoint)
+				LOGGER.info("Replayed %s messages up to #%s (%s failures)", checkpoint['treated'], checkpoint['last_id'], checkpoint['failed'])
+
+				replayed += len(batch)
+				if self.rate:
+					time.sleep(max(0, replayed/self.rate - (time.time() - started_at)))
+
+		checkpoint['done'] = True
+		self.save_checkpoint(checkpoint)
+		return checkpoint['failed'] == 0
+
+
+class ShadowEvaluation(object):
+
+	"""
+	Runs a candidate route (and optionally another parser version) over a local snapshot of recent messages of its topic,
+	next to the route currently selected for each message. Nothing is written nor dispatched: for each side the report
+	gives the match rate, the parse success, the parser CPU time per message and the points produced.
+	"""
+	def __init__(self, transfer, route_id, parser_id=None, sample=1000, snapshot=None, snapshot_dir=None):
+		super(ShadowEvaluation, self).__init__()
+		self.transfer = transfer
+		self.route = transfer.storages['routes'].get(id=route_id)
+		if self.route is None:
+			raise NoRouteFound(f"Routing rule #{route_id} doesn't exist in the database")
+		self.parser = transfer.storages['parsers'].get(id=self.route['parser_id'] if parser_id is None else parser_id)
+		if self.parser is None:
+			raise ParserCodeNotFound(f"Parser #{self.route['parser_id'] if parser_id is None else parser_id} doesn't exist in the database")
+		self.sample = sample
+		self.snapshot = snapshot if snapshot is not None else os.path.join(snapshot_dir, f"shadow_route{route_id}_{sample}{cold_archive.ARCHIVE_EXTENSION}")
+
+	def load_snapshot(self):
+		""" Recent messages of the route topic, read once from the database then from the local snapshot """
+		if not os.path.isfile(self.snapshot):
+			topic = self.transfer.storages['topics'].get(id=self.route['topic_id'])
+			if topic is None:
+				raise TopicNotFound(f"Topic #{self.route['topic_id']} of routing rule #{self.route['id']} doesn't exist in the database")
+			messages = self.transfer.storages['mqtt_messages'].list(topic=topic['topic'], orderby="at DESC", limit=self.sample)
+			count = cold_archive.write_archive(self.snapshot, [[message.to_dict() for message in messages]])
+			LOGGER.info("Snapshot of %s messages of topic %s saved to %s", count, topic['topic'], self.snapshot)
+		return [entities.MqttMessage(**row) for row in cold_archive.read_archive(self.snapshot)]
+
+	def evaluate(self, route, parser, message, device, side):
+		side['matched'] += 1
+		try:
+			results, timing = self.transfer.run_parser(parser, route, message)
+		except ParserSandboxError as e:
+			results, timing = None, e.timing or {}
+			side['errors'] += 1
+		except:
+			results, timing = None, {}
+			side['errors'] += 1
+		if timing.get('cpu_ms') is not None:
+			side['cpu'].append(timing['cpu_ms'])
+		if results:
+			side['parsed'] += 1
+			side['points'] += len(self.transfer.build_points(results, message, device, str(uuid4())))
+
+	def summarize(self, side, total):
+		cpu = sorted(side.pop('cpu'))
+		side.update({
+			"match_rate": round(100*side['matched']/total, 1) if total else 0,
+			"parse_success": round(100*side['parsed']/side['matched'], 1) if side['matched'] else 0,
+			"cpu_ms_avg": round(sum(cpu)/len(cpu), 3) if cpu else 0,
+			"cpu_ms_p95": round(cpu[int(0.95*(len(cpu)-1))], 3) if cpu else 0,
+			"points_per_message": round(side['points']/side['parsed'], 2) if side['parsed'] else 0,
+		})
+		return side
+
+	def run(self):
+		messages = self.load_snapshot()
+		sides = {name:{"matched":0, "parsed":0, "errors":0, "points":0, "cpu":[]} for name in ["active","candidate"]}
+		for message in messages:
+			try:
+				topic, device, client = self.transfer.retrieve_sender(message)
+			except:
+				continue
+			try:
+				active = self.transfer.select_route(client, device, topic, message)
+				self.evaluate(active, self.transfer.storages['parsers'].get(id=active['parser_id']), message, device, sides['active'])
+			except NoRouteFound:
+				pass
+			try:
+				matches = self.transfer.route_matches(self.route, client, device, topic, message)
+			except:
+				LOGGER.warning(
+					"Conditions of routing rule #%s failed to be evaluated for message #%s", self.route['id'], message['id'],
+					extra={"message_id":message['id'], "route_id":self.route['id'], "dedup_key":self.route['id']}
+				)
+				matches = False
+			if matches:
+				self.evaluate(self.route, self.parser, message, device, sides['candidate'])
+
+		return {
+			"route_id":self.route['id'], "parser":f"{self.parser['name']} {self.parser['version']}", "snapshot":self.snapshot, "messages":len(messages),
+			**{name:self.summarize(side, len(messages)) for name, side in sides.items()}
+		}
 
-		return all(data_treated)
 
+def drain(signum, frame):
+	LOGGER.info("Received signal %s: finishing the messages in flight before exiting", signal.Signals(signum).name)
+	DRAINING.set()
 
 def already_running(**mysql_credentials):
 	MqttTransferJob = MysqlEntityStorage(entities.Job, **mysql_credentials).get(name=MQTTT_JOB_NAME)
@@ -393,15 +1018,100 @@ def stop_run(exit_code, **mysql_credentials):
 	if exit_code != 0:
 		sys.exit(exit_code)
 
+def export_metrics(config):
+	""" Metrics of the run, written for the web app telemetry endpoint (or a node_exporter textfile collector) """
+	metrics_file = config.get("mqtt_transfer",{}).get("metrics_file", os.path.join("db","metrics","mqtt_transfer.prom"))
+	if not metrics_file:
+		return
+	try:
+		metrics.REGISTRY.write_textfile(os.path.join(ROOT_DIR, metrics_file))
+	except:
+		LOGGER.warning("Metrics couldn't be written to %s", metrics_file, exc_info=True)
+
+def new_parser_pool(config):
+	""" Parser sandbox pool configured by the parser_* keys of [mqtt_transfer], None when parser_workers is 0 """
+	settings = {**SANDBOX_DEFAULTS, **{k[len("parser_"):]:v for k,v in config.get("mqtt_transfer",{}).items() if k.startswith("parser_")}}
+	if int(settings['workers']) <= 0:
+		return None
+	return ParserPool(**{k:v for k,v in settings.items() if k in SANDBOX_DEFAULTS})
+
+def new_tracer(config):
+	""" Tracer sampling trace_sample_rate of the messages (and all those of the trace_clients senders), None when tracing is off """
+	settings = config.get("mqtt_transfer",{})
+	sample_rate = float(settings.get("trace_sample_rate",0)); clients = settings.get("trace_clients",[])
+	if sample_rate <= 0 and len(clients) == 0:
+		return None
+	trace_format = settings.get("trace_format","chrome")
+	path = trace_file(os.path.join(ROOT_DIR, settings.get("trace_dir",os.path.join("db","traces"))), trace_format)
+	LOGGER.info("Tracing %g%% of the messages%s to %s", 100*sample_rate, " and those of "+", ".join(clients) if len(clients) else "", path)
+	return Tracer(path, sample_rate=sample_rate, format=trace_format, always=clients)
+
+def new_transfer(config, parser_pool=None, tracer=None):
+	CREDENTIALS.configure(ttl=config.get("mqtt_transfer",{}).get("credentials_ttl",300))
+	return MqttTransfer(
+		latest_values_batch=config.get("mqtt_transfer",{}).get("latest_values_batch",500), parser_pool=parser_pool,
+		parse_batch_size=config.get("mqtt_transfer",{}).get("parse_batch_size",256), tracer=tracer, **config["storage"]["credentials"]
+	)
+
+def launch_replay(config, replay):
+	""" Replays run outside of the job lock so that the recurrent job keeps handling live traffic """
+	settings = {**REPLAY_DEFAULTS, **{k[len("replay_"):]:v for k,v in config.get("mqtt_transfer",{}).items() if k.startswith("replay_")}}
+	settings.update({k:v for k,v in replay.items() if k in REPLAY_DEFAULTS and v is not None})
+
+	parser_pool = new_parser_pool(config)
+	tracer = new_tracer(config)
+	replayer = MqttReplay(
+		[new_transfer(config, parser_pool, tracer) for i in range(max(1,int(settings['workers'])))], os.path.join(ROOT_DIR,"db","replays"),
+		start=replay['start'], end=replay['end'], topics=replay['topics'], clients=replay['clients'], archive=replay['archive'],
+		batch_size=int(settings['batch_size']), rate=settings['rate']
+	)
+	try:
+		replayed = replayer.run(restart=replay['restart'])
+	finally:
+		if parser_pool is not None:
+			parser_pool.close()
+		if tracer is not None:
+			tracer.close()
+		export_metrics(config)
+	if replayed:
+		LOGGER.info("Replay completed successfully.")
+		return 0
+	LOGGER.warning("Some replayed messages weren't treated successfully.")
+	return 2
+
+def launch_shadow(config, shadow):
+	parser_pool = new_parser_pool(config)
+	evaluation = ShadowEvaluation(
+		new_transfer(config, parser_pool), shadow['route_id'], parser_id=shadow['parser_id'], sample=shadow['sample'],
+		snapshot=shadow['snapshot'], snapshot_dir=os.path.join(ROOT_DIR,"db","shadow")
+	)
+	try:
+		report = evaluation.run()
+	finally:
+		if parser_pool is not None:
+			parser_pool.close()
+	LOGGER.info("Shadow evaluation of routing rule #%s: %s", shadow['route_id'], json.dumps(report))
+	print(json.dumps(report, indent=2))
+	return 0
+
 def launch(config):
 	if already_running(**config["storage"]["credentials"]):
 		LOGGER.info("Mqtt Transfer job is already ongoing. Postponing execution.")
 		return
 	start_run(**config["storage"]["credentials"])
 
-	mqttt = MqttTransfer(**config["storage"]["credentials"])
+	parser_pool = new_parser_pool(config)
+	tracer = new_tracer(config)
+	mqttt = new_transfer(config, parser_pool, tracer)
 
-	results = mqttt.process(PARSERS_DB_FOLDER)	
+	try:
+		results = mqttt.process(PARSERS_DB_FOLDER)
+	finally:
+		if parser_pool is not None:
+			parser_pool.close()
+		if tracer is not None:
+			tracer.close()
+		export_metrics(config)
 	exit_code=0	
 	if results is not None:
 		if results:
@@ -418,6 +1128,22 @@ if __name__ == "__main__":
 
 	parser.add_argument('-r', '--root-dir', help='Mqtt Relay root directory', default=".")
 	parser.add_argument('-l', '--logging-dir', help='Directory where to store logs.', default=None)
+	parser.add_argument('--replay', action="store_true", help='Replay recorded messages instead of processing the pending ones', default=False)
+	parser.add_argument('--from', dest="start", help='Start (ISO date) of the range to replay', type=datetime.fromisoformat, default=None)
+	parser.add_argument('--to', dest="end", help='End (ISO date, excluded) of the range to replay', type=datetime.fromisoformat, default=None)
+	parser.add_argument('--topic', dest="topics", action="append", help='Topic to replay (repeatable)', default=None)
+	parser.add_argument('--client', dest="clients", action="append", help='Sender slug to replay (repeatable)', default=None)
+	parser.add_argument('--archive', help='Replay the messages exported to this cold archive directory', default=None)
+	parser.add_argument('--batch-size', help='Messages per replay batch', type=int, default=None)
+	parser.add_argument('--workers', help='Replay worker threads', type=int, default=None)
+	parser.add_argument('--rate', help='Maximum replayed messages per second (0: unlimited)', type=float, default=None)
+	parser.add_argument('--restart', action="store_true", help='Ignore the checkpoint of a previous replay of the same selection', default=False)
+	parser.add_argument('--shadow', dest="shadow_route", help='Evaluate this routing rule against recent messages without writing nor dispatching', type=int, default=None)
+	parser.add_argument('--shadow-parser', help='Parser (id) evaluated in place of the one of the shadowed route', type=int, default=None)
+	parser.add_argument('--sample', help='Number of recent messages evaluated in shadow mode', type=int, default=1000)
+	parser.add_argument('--snapshot', help='Snapshot file of the shadow mode sample (created if missing)', default=None)
+	parser.add_argument('--trace-sample', help='Fraction of the messages traced (overrides trace_sample_rate)', type=float, default=None)
+	parser.add_argument('--trace-client', dest="trace_clients", action="append", help='Trace every message of this sender slug (repeatable)', default=None)
 
 	args = parser.parse_args()
 
@@ -435,20 +1161,54 @@ if __name__ == "__main__":
 		os.mkdir(PARSERS_DB_FOLDER)
 
 	PARSERS_DB = DirectoryStorage(PARSERS_DB_FOLDER)
+	ROOT_DIR = args.root_dir
 
-	setattr(__builtins__,'LOGGER', get_logger(args.logging_dir))
+	config = load_configs(args.root_dir)
+	setattr(__builtins__,'LOGGER', get_logger(args.logging_dir, config.get("mqtt_transfer",{})))
+	signal.signal(signal.SIGTERM, drain)
+	signal.signal(signal.SIGINT, drain)
 	
 	from services.mqtt_transfer.dispatchers import DISPATCHERS
+	from services.mqtt_transfer.sandbox import SANDBOX_DEFAULTS, ParserPool, ParserSandboxError, ParserFunctionMissing
 	from tools.json_conditions import eval_mongo_dsl
+	from tools import cold_archive, json_codec, metrics
+	from tools.tracing import NULL_TRACE, Tracer, now_ns, trace_file
+	from tools.topic_trie import TopicTrie
+	from tools.credentials import CREDENTIALS
+	from tools.points import PointBatch
 	import core.entity as entities
 
-	config = load_configs(args.root_dir)
+	json_codec.use(config.get("mqtt_transfer",{}).get("json_codec","auto"))
+	if args.trace_sample is not None:
+		config.setdefault("mqtt_transfer",{})["trace_sample_rate"] = args.trace_sample
+	if args.trace_clients is not None:
+		config.setdefault("mqtt_transfer",{})["trace_clients"] = args.trace_clients
+
+	if args.shadow_route is not None:
+		try:
+			exit_code = launch_shadow(config, {
+				"route_id":args.shadow_route, "parser_id":args.shadow_parser, "sample":args.sample, "snapshot":args.snapshot
+			})
+		except:
+			LOGGER.error("Mqtt Transfer shadow evaluation failed with error", exc_info=True)
+			exit_code = 1
+		sys.exit(exit_code)
+
+	if args.replay or args.archive is not None:
+		try:
+			exit_code = launch_replay(config, {
+				"start":args.start, "end":args.end, "topics":args.topics, "clients":args.clients, "archive":args.archive,
+				"batch_size":args.batch_size, "workers":args.workers, "rate":args.rate, "restart":args.restart
+			})
+		except:
+			LOGGER.error("Mqtt Transfer replay failed with error", exc_info=True)
+			exit_code = 1
+		sys.exit(exit_code)
 
 	try:
 		exit_code = launch(config)
 	except:
-		LOGGER.error("Mqtt Transfer failed with error. Traceback:")
-		LOGGER.error(traceback.format_exc())
+		LOGGER.error("Mqtt Transfer failed with error", exc_info=True)
 		stop_run(1,**config["storage"]["credentials"])
 	else:
 		stop_run(exit_code,**config["storage"]["credentials"])
\ No newline at end of file
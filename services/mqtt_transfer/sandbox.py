@@ -0,0 +1,206 @@
+from multiprocessing import get_context
+
+import importlib
+import traceback
+import resource
+import os
+import signal
+import queue
+import time
+
+
+SANDBOX_DEFAULTS = {
+	"workers": 2,  # 0: parsers run in the transfer process, without limits
+	"wall_timeout": 10,  # seconds
+	"cpu_timeout": 5,  # seconds
+	"max_calls": 1000,
+	"max_rss_mb": 256,
+}
+
+
+class ParserSandboxError(Exception):
+
+	def __init__(self, message, timing=None):
+		super(ParserSandboxError, self).__init__(message)
+		self.timing = timing
+
+
+class ParserTimeout(ParserSandboxError):
+	pass
+
+
+class ParserCrashed(ParserSandboxError):
+	pass
+
+
+class ParserFailed(Exception):
+	pass
+
+
+class ParserFunctionMissing(Exception):
+	pass
+
+
+class CpuLimitExceeded(BaseException):
+	# BaseException so that parsers catching Exception can't swallow it
+	pass
+
+
+def _on_cpu_limit(signum, frame):
+	raise CpuLimitExceeded()
+
+
+def _rss_mb():
+	""" Current resident set size of the process (its peak where /proc isn't available), in MB """
+	try:
+		with open("/proc/self/statm") as statm:
+			return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024*1024)
+	except (OSError, ValueError, IndexError):
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _serve(connection):
+	"""
+	Worker loop: parser modules are imported once and kept warm. ITIMER_PROF counts the CPU time (user + system)
+	of the worker and interrupts a call exceeding its CPU time limit; the wall time limit is enforced by the pool.
+	Each reply carries the RSS grown since the worker started: a forked worker starts with the pages of the transfer
+	process resident, which are not its own.
+	"""
+	# workers are stopped by their pool, not by the signals sent to the whole process group on shutdown
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_IGN)
+	signal.signal(signal.SIGPROF, _on_cpu_limit)
+	functions = {}
+	started_rss = _rss_mb()
+	while True:
+		try:
+			request = connection.recv()
+		except (EOFError, KeyboardInterrupt):
+			return
+		if request is None:
+			return
+
+		module_name, function, payload, config, cpu_timeout = request
+		started_wall = time.perf_counter(); started_cpu = time.process_time()
+		try:
+			if not (module_name, function) in functions:
+				functions[(module_name, function)] = getattr(importlib.import_module(module_name), function, None)
+			if functions[(module_name, function)] is None:
+				reply = ("missing", f"Parser {module_name} has no {function} function")
+			else:
+				signal.setitimer(signal.ITIMER_PROF, cpu_timeout)
+				try:
+					reply = ("ok", functions[(module_name, function)](payload, **config))
+				finally:
+					signal.setitimer(signal.ITIMER_PROF, 0)
+		except CpuLimitExceeded:
+			reply = ("cpu_timeout", f"Parser {module_name} exceeded its CPU time limit ({cpu_timeout}s)")
+		except Exception:
+			reply = ("error", traceback.format_exc())
+
+		timing = {"wall_ms":1000*(time.perf_counter() - started_wall), "cpu_ms":1000*(time.process_time() - started_cpu)}
+		try:
+			connection.send((*reply, timing, _rss_mb() - started_rss))
+		except Exception:
+			connection.send(("error", f"Result of parser {module_name} can't be sent back: {traceback.format_exc()}", timing, _rss_mb() - started_rss))
+
+
+class SandboxWorker(object):
+
+	def __init__(self, context):
+		super(SandboxWorker, self).__init__()
+		self.connection, child_connection = context.Pipe()
+		self.process = context.Process(target=_serve, args=(child_connection,), daemon=True)
+		self.process.start()
+		child_connection.close()
+		self.calls = 0
+
+	def stop(self, kill=False):
+		if not kill:
+			try:
+				self.connection.send(None)
+				self.process.join(1)
+			except Exception:
+				pass
+		if self.process.is_alive():
+			self.process.kill()
+			self.process.join()
+		self.connection.close()
+
+
+class ParserPool(object):
+
+	"""
+	Pre-forked worker processes running the parse functions of db/parsers, each call bounded by a wall and a CPU time limit.
+	A worker is replaced after max_calls calls, once its RSS has grown by max_rss_mb since it started, or when it is killed on timeout.
+	Workers are shared by the threads of a process (replays): a call waits for an idle worker.
+	"""
+	def __init__(self, workers=2, wall_timeout=10, cpu_timeout=5, max_calls=1000, max_rss_mb=256):
+		super(ParserPool, self).__init__()
+		self.context = get_context("fork")
+		self.wall_timeout = float(wall_timeout)
+		self.cpu_timeout = float(cpu_timeout)
+		self.max_calls = int(max_calls)
+		self.max_rss_mb = float(max_rss_mb)
+		self.recycled = 0
+		self.idle = queue.Queue()
+		for i in range(int(workers)):
+			self.idle.put(self.spawn())
+
+	def spawn(self):
+		return SandboxWorker(self.context)
+
+	def recycle(self, worker, kill=False):
+		worker.stop(kill=kill)
+		self.recycled += 1
+		return self.spawn()
+
+	def call(self, module_name, payload, config, function="parse", calls=1):
+		"""
+		Result of a function (parse, or parse_many for a batch of 'calls' payloads, whose time limits are scaled accordingly)
+		of module_name and the {wall_ms, cpu_ms} spent in the worker
+		"""
+		wall_timeout = self.wall_timeout*calls
+		worker = self.idle.get()
+		try:
+			started = time.perf_counter()
+			try:
+				worker.connection.send((module_name, function, payload, config, self.cpu_timeout*calls))
+				if not worker.connection.poll(wall_timeout):
+					worker = self.recycle(worker, kill=True)
+					raise ParserTimeout(
+						f"Parser {module_name} exceeded its wall time limit ({wall_timeout}s)", timing={"wall_ms":1000*(time.perf_counter() - started), "cpu_ms":None}
+					)
+				status, result, timing, rss_mb = worker.connection.recv()
+			except (EOFError, OSError) as e:
+				worker.process.join(0.1)
+				code = worker.process.exitcode
+				worker = self.recycle(worker, kill=True)
+				raise ParserCrashed(
+					f"Parser worker died while running {module_name} (exit code {code}): {e}", timing={"wall_ms":1000*(time.perf_counter() - started), "cpu_ms":None}
+				)
+
+			worker.calls += 1
+			if status == "cpu_timeout":
+				# the interrupted parser may have left its module in an unknown state
+				worker = self.recycle(worker)
+			elif worker.calls >= self.max_calls or rss_mb >= self.max_rss_mb:
+				LOGGER.info("Parser worker recycled after %s calls (RSS grown by %.0fMB)", worker.calls, rss_mb)
+				worker = self.recycle(worker)
+
+			if status == "cpu_timeout":
+				raise ParserTimeout(result, timing=timing)
+			if status == "missing":
+				raise ParserFunctionMissing(result)
+			if status == "error":
+				raise ParserFailed(f"Parser {module_name} failed in its worker process:\n{result}")
+			return result, timing
+		finally:
+			self.idle.put(worker)
+
+	def close(self):
+		while True:
+			try:
+				self.idle.get_nowait().stop()
+			except queue.Empty:
+				return
@@ -0,0 +1,299 @@
+from temod.storage import MysqlEntityStorage
+
+from logging.handlers import RotatingFileHandler
+from datetime import datetime, timedelta
+
+import traceback
+import argparse
+import logging
+import toml
+import sys
+import os
+
+
+RETENTION_JOB_NAME = "Retention"
+
+# Tables partitioned by RANGE COLUMNS on a time column, and that column
+PARTITIONED_TABLES = {
+	"mqtt_message": "at",
+	"parsed_point": "ts",
+}
+
+# Tables referencing the rows of a partitioned table by its time column, purged along with its partitions
+DEPENDENT_TABLES = {
+	"mqtt_message": ["pending_message"],
+}
+
+# Catch-all partition receiving rows past the last dated partition
+CATCH_ALL_PARTITION = "pmax"
+
+# Rows read per query when exporting a partition to a cold archive
+EXPORT_BATCH = 5000
+
+DEFAULT_POLICY = {
+	"granularity": "day",
+	"keep_days": 90,
+	"premake": 7,
+	"action": "drop",
+	"archive_dir": os.path.join("db","archives"),
+}
+
+
+# Function to load configuration from TOML file
+def load_configs(root_dir):
+	"""Load configuration from config.toml file in the specified root directory"""
+	with open(os.path.join(root_dir,"config.toml")) as config_file:
+		config = toml.load(config_file)
+	return config
+
+
+# Function to set up logging
+def get_logger(logging_dir):
+	"""Create and configure a logger with file and console handlers"""
+	logger = logging.getLogger()
+	logger.setLevel(logging.INFO)
+
+	if logger.handlers:
+		return logger
+
+	formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+	if logging_dir is not None and os.path.isdir(logging_dir):
+		fh = RotatingFileHandler(
+			os.path.join(logging_dir,f"{RETENTION_JOB_NAME}.log"),
+			maxBytes=5*1024*1024,  # 5MB
+			backupCount=3,
+			encoding='utf-8'
+		)
+		fh.setLevel(logging.INFO)
+		fh.setFormatter(formatter)
+		logger.addHandler(fh)
+	else:
+		print("No valid logging directory specified. No logs will be kept.")
+
+	dh = logging.StreamHandler(sys.stdout)
+	dh.setLevel(logging.WARNING)
+	dh.setFormatter(formatter)
+	logger.addHandler(dh)
+
+	return logger
+
+
+class TableNotPartitioned(Exception):
+	pass
+
+
+class ArchiveMismatch(Exception):
+	pass
+
+
+class RetentionPolicy(object):
+
+	"""
+	Retention of a partitioned table:
+	 - granularity: size of a partition ("day" or "month")
+	 - keep_days: partitions whose upper bound is older than keep_days are expired
+	 - premake: number of partitions created ahead of the current one
+	 - action: "drop" expired partitions, "archive" them (swapped into standalone <table>_<partition> tables)
+	   or "export" them to compressed files in archive_dir (see tools/cold_archive.py) before dropping them
+	"""
+	def __init__(self, table, granularity="day", keep_days=90, premake=7, action="drop", archive_dir=None):
+		super(RetentionPolicy, self).__init__()
+		if not table in PARTITIONED_TABLES:
+			raise ValueError(f"Table {table} is not a partitioned table ({', '.join(PARTITIONED_TABLES)})")
+		if not granularity in ["day","month"]:
+			raise ValueError(f"Unknown partition granularity {granularity} for table {table}")
+		if not action in ["drop","archive","export"]:
+			raise ValueError(f"Unknown retention action {action} for table {table}")
+		self.table = table
+		self.column = PARTITIONED_TABLES[table]
+		self.granularity = granularity
+		self.keep_days = int(keep_days)
+		self.premake = int(premake)
+		self.action = action
+		self.archive_dir = archive_dir
+
+	def period_start(self, moment):
+		if self.granularity == "month":
+			return datetime(moment.year, moment.month, 1)
+		return datetime(moment.year, moment.month, moment.day)
+
+	def next_period(self, start):
+		if self.granularity == "month":
+			return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+		return start + timedelta(days=1)
+
+	def partition_name(self, start):
+		return "p" + start.strftime("%Y%m" if self.granularity == "month" else "%Y%m%d")
+
+	def partition_start(self, name):
+		return datetime.strptime(name[1:], "%Y%m" if self.granularity == "month" else "%Y%m%d")
+
+
+class RetentionEngine(object):
+
+	"""
+	Keeps the partitions of mqtt_message and parsed_point rolling:
+	future partitions are split from the catch-all one ahead of time (past the first run, the catch-all stays empty so the split is cheap),
+	and expired partitions are dropped or exchanged out of the table, both metadata only operations.
+	"""
+	def __init__(self, policies, **mysql_credentials):
+		super(RetentionEngine, self).__init__()
+		self.policies = policies
+		self.storage = MysqlEntityStorage(entities.MqttMessage,**mysql_credentials)
+
+	def list_partitions(self, table):
+		partitions = [row['name'] for row in self.storage.getMany(
+			"SELECT PARTITION_NAME AS name FROM information_schema.PARTITIONS "
+			f"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table}' ORDER BY PARTITION_ORDINAL_POSITION"
+		)]
+		if len(partitions) == 0 or partitions[-1] != CATCH_ALL_PARTITION:
+			raise TableNotPartitioned(f"Table {table} is not partitioned by range (missing the {CATCH_ALL_PARTITION} partition). Run install/update.py first")
+		return partitions[:-1]
+
+	def ensure_partitions(self, policy, now):
+		""" Creates the partitions from the retention cutoff (first run) or the last partition, up to now + premake """
+		partitions = self.list_partitions(policy.table)
+		if len(partitions):
+			start = policy.next_period(policy.partition_start(partitions[-1]))
+		else:
+			start = policy.period_start(now - timedelta(days=policy.keep_days))
+
+		last = policy.period_start(now)
+		for i in range(policy.premake):
+			last = policy.next_period(last)
+
+		created = []
+		while start <= last:
+			created.append(
+				f"PARTITION {policy.partition_name(start)} VALUES LESS THAN ('{policy.next_period(start).strftime('%Y-%m-%d %H:%M:%S')}')"
+			)
+			start = policy.next_period(start)
+
+		if len(created):
+			self.storage.executeAndCommit(
+				f"ALTER TABLE {policy.table} REORGANIZE PARTITION {CATCH_ALL_PARTITION} INTO "
+				f"({', '.join(created)}, PARTITION {CATCH_ALL_PARTITION} VALUES LESS THAN (MAXVALUE))"
+			)
+			LOGGER.info(f"{len(created)} partitions created on table {policy.table}")
+		return len(created)
+
+	def export_partition(self, policy, partition):
+		""" Streams a partition to its cold archive file and checks the file holds every row of the partition """
+		path = cold_archive.archive_path(policy.archive_dir, policy.table, partition)
+		expected = self.storage.getOne(f"SELECT COUNT(*) AS n FROM {policy.table} PARTITION ({partition})")['n']
+
+		def batches():
+			last = 0
+			while True:
+				rows = list(self.storage.getMany(
+					f"SELECT * FROM {policy.table} PARTITION ({partition}) WHERE id > {last} ORDER BY id LIMIT {EXPORT_BATCH}"
+				))
+				if len(rows) == 0:
+					return
+				yield rows
+				last = rows[-1]['id']
+
+		written = cold_archive.write_archive(path, batches())
+		if written != expected or cold_archive.count_archive(path) != expected:
+			os.remove(path)
+			raise ArchiveMismatch(f"Partition {partition} of table {policy.table} holds {expected} rows but {written} were exported. Nothing dropped")
+		LOGGER.info(f"Partition {partition} of table {policy.table} exported to {path} ({written} rows)")
+		return path
+
+	def expire_partitions(self, policy, now):
+		""" Drops, archives or exports the partitions whose upper bound is before now - keep_days """
+		cutoff = now - timedelta(days=policy.keep_days)
+		partitions = self.list_partitions(policy.table)
+		expired = [partition for partition in partitions if policy.next_period(policy.partition_start(partition)) <= cutoff]
+
+		if len(expired) == 0:
+			return 0
+
+		if policy.action == "archive":
+			for partition in expired:
+				archive = f"{policy.table}_{partition}"
+				self.storage.executeAndCommit(f"CREATE TABLE {archive} LIKE {policy.table}")
+				self.storage.executeAndCommit(f"ALTER TABLE {archive} REMOVE PARTITIONING")
+				self.storage.executeAndCommit(f"ALTER TABLE {policy.table} EXCHANGE PARTITION {partition} WITH TABLE {archive}")
+				LOGGER.info(f"Partition {partition} of table {policy.table} archived into {archive}")
+		elif policy.action == "export":
+			for partition in expired:
+				self.export_partition(policy, partition)
+
+		self.storage.executeAndCommit(f"ALTER TABLE {policy.table} DROP PARTITION {', '.join(expired)}")
+		LOGGER.info(f"{len(expired)} expired partitions dropped from table {policy.table} ({', '.join(expired)})")
+
+		bound = policy.next_period(policy.partition_start(expired[-1])).strftime('%Y-%m-%d %H:%M:%S')
+		for dependent in DEPENDENT_TABLES.get(policy.table,[]):
+			purged = self.storage.executeAndCommit(f"DELETE FROM {dependent} WHERE at < '{bound}'").rowcount
+			LOGGER.info(f"{purged} rows of table {dependent} purged along with the expired partitions of {policy.table}")
+		return len(expired)
+
+	def apply(self, now=None):
+		now = datetime.now() if now is None else now
+		applied = []
+		for policy in self.policies:
+			try:
+				self.ensure_partitions(policy, now)
+				self.expire_partitions(policy, now)
+				applied.append(True)
+			except:
+				LOGGER.error(f"Error while applying the retention policy of table {policy.table}")
+				LOGGER.error(traceback.format_exc())
+				applied.append(False)
+		return all(applied)
+
+
+def load_policies(config, root_dir="."):
+	policies = []
+	for table, policy in config.get("retention",{}).items():
+		policy = {**DEFAULT_POLICY, **policy}
+		policy['archive_dir'] = os.path.join(root_dir, policy['archive_dir'])
+		policies.append(RetentionPolicy(table, **policy))
+	return policies
+
+
+def launch(config, root_dir="."):
+	policies = load_policies(config, root_dir)
+	if len(policies) == 0:
+		LOGGER.info("No retention policy configured.")
+		return 0
+
+	engine = RetentionEngine(policies, **config["storage"]["credentials"])
+	if engine.apply():
+		LOGGER.info("Retention policies applied successfully.")
+		return 0
+	LOGGER.warning("Some retention policies weren't applied successfully.")
+	return 2
+
+
+if __name__ == "__main__":
+	""" Defining and parsing args """
+	parser = argparse.ArgumentParser(prog="Rolls the time partitions of mqtt messages and parsed points and expires the old ones")
+
+	parser.add_argument('-r', '--root-dir', help='Mqtt Relay root directory', default=".")
+	parser.add_argument('-l', '--logging-dir', help='Directory where to store logs.', default=None)
+
+	args = parser.parse_args()
+
+	if not os.path.isdir(args.root_dir):
+		print(f"Root directory path must be a valid directory.")
+		sys.exit(1)
+	if not args.root_dir in sys.path:
+		sys.path.append(args.root_dir)
+
+	setattr(__builtins__,'LOGGER', get_logger(args.logging_dir))
+
+	from tools import cold_archive
+	import core.entity as entities
+
+	config = load_configs(args.root_dir)
+
+	try:
+		exit_code = launch(config, args.root_dir)
+	except:
+		LOGGER.error("Retention failed with error. Traceback:")
+		LOGGER.error(traceback.format_exc())
+		exit_code = 1
+	sys.exit(exit_code)
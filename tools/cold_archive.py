@@ -0,0 +1,94 @@
+import os
+import re
+import gzip
+import json
+from datetime import datetime, date
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Archives are gzip compressed JSON lines, one file per exported partition:
+#   <root>/<table>/<YYYY>/<MM>/<table>_<partition>.jsonl.gz
+ARCHIVE_EXTENSION = ".jsonl.gz"
+
+# --- helpers ---------------------------------------------------------------
+
+def _encode(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    raise TypeError(f'unserializable value of type {type(value).__name__}')
+
+def _partition_start(name: str) -> datetime:
+    # partition names are p<YYYYMMDD> (day) or p<YYYYMM> (month), possibly prefixed by '<table>_'
+    digits = re.search(r'p(\d{8}|\d{6})$', name).group(1)
+    return datetime.strptime(digits, '%Y%m%d' if len(digits) == 8 else '%Y%m')
+
+# --- writer ----------------------------------------------------------------
+
+def archive_path(root: str, table: str, partition: str) -> str:
+    start = _partition_start(partition)
+    return os.path.join(root, table, f'{start.year:04d}', f'{start.month:02d}', f'{table}_{partition}{ARCHIVE_EXTENSION}')
+
+def write_archive(path: str, batches: Iterable[Iterable[Dict[str, Any]]]) -> int:
+    """
+    Streams batches of rows into an archive file and returns the number of rows written.
+    The file is written under a temporary name and only renamed once complete.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.part'
+    count = 0
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        for batch in batches:
+            for row in batch:
+                f.write(json.dumps(row, default=_encode))
+                f.write('\n')
+                count += 1
+    os.replace(tmp, path)
+    return count
+
+def count_archive(path: str) -> int:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+# --- reader ----------------------------------------------------------------
+
+def read_archive(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def list_archives(root: str, table: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+    """
+    Archive files of a table whose partition starts within [start, end), in chronological order.
+    A partition starting before 'start' may still hold rows of the range: filter rows when reading if needed.
+    """
+    found = []
+    table_dir = os.path.join(root, table)
+    if not os.path.isdir(table_dir):
+        return found
+    for directory, _, files in os.walk(table_dir):
+        for file in files:
+            if not file.endswith(ARCHIVE_EXTENSION):
+                continue
+            partition_start = _partition_start(file[:-len(ARCHIVE_EXTENSION)])
+            if end is not None and partition_start >= end:
+                continue
+            found.append((partition_start, os.path.join(directory, file)))
+    found = sorted(found)
+    if start is not None:
+        # keep the partition containing 'start' (the last one starting at or before it)
+        before = [i for i, (partition_start, _) in enumerate(found) if partition_start <= start]
+        found = found[before[-1]:] if before else found
+    return [path for _, path in found]
+
+def read_archives(root: str, table: str, start: Optional[datetime] = None, end: Optional[datetime] = None, column: str = 'at') -> Iterator[Dict[str, Any]]:
+    """ Rows of the archived range [start, end) of a table, filtered on its time column """
+    for path in list_archives(root, table, start, end):
+        for row in read_archive(path):
+            moment = datetime.fromisoformat(row[column])
+            if (start is None or moment >= start) and (end is None or moment < end):
+                yield row
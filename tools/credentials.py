@@ -0,0 +1,108 @@
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Credential cache shared by the web app and the transfer service. It keeps crypto off the hot paths:
+#   - master keys per (key_source, key_id, version): env/KMS/db reads happen once per TTL
+#   - CBC-HMAC subkeys per (key_id, version): the two HKDF derivations happen once per TTL
+#   - decrypted secrets per (owner, encryption_version): a destination password is decrypted once per TTL
+# Entries expire after 'ttl' seconds and are dropped explicitly on key rotation (invalidate).
+
+DEFAULT_TTL = 300
+
+# --- ttl cache -------------------------------------------------------------
+
+class TTLCache(object):
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = float(ttl)
+        self.entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> Any:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """ Cached value of key, or loader() stored for the next ttl seconds. The loader runs outside of the lock """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = self.set(key, loader())
+        return value
+
+    def invalidate(self, match: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """ Drops the entries whose key matches (all of them without match); returns how many were dropped """
+        with self.lock:
+            keys = [key for key in self.entries if match is None or match(key)]
+            for key in keys:
+                del self.entries[key]
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+# --- credentials -----------------------------------------------------------
+
+def _source_name(key_source: Any) -> str:
+    return getattr(key_source, 'name', key_source)
+
+
+class CredentialCache(object):
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.keys = TTLCache(ttl)
+        self.subkeys = TTLCache(ttl)
+        self.secrets = TTLCache(ttl)
+
+    def configure(self, ttl: float = DEFAULT_TTL) -> "CredentialCache":
+        for cache in (self.keys, self.subkeys, self.secrets):
+            cache.ttl = float(ttl)
+        return self
+
+    def master_key(self, key_source: Any, key_id: str, version: int, loader: Callable[[Any, str], bytes]) -> bytes:
+        """ Master key of (key_source, key_id, version); loader(key_source, key_id) is only called on a miss """
+        return self.keys.get_or_load((_source_name(key_source), key_id, version), lambda: loader(key_source, key_id))
+
+    def cbc_hmac_keys(self, master_key: bytes, key_id: str, version: int) -> Tuple[bytes, bytes]:
+        """ (enc_key, mac_key) derived from the master key of (key_id, version) """
+        from tools.crypto_envelopes import derive_cbc_hmac_keys
+        return self.subkeys.get_or_load((key_id, version), lambda: derive_cbc_hmac_keys(master_key, key_id=key_id))
+
+    def secret(self, owner: Hashable, encryption_version: Optional[str], token: str, decrypt: Callable[[str], Any]) -> Any:
+        """
+        Decrypted secret of owner (e.g. ("destination", id)) encrypted under encryption_version.
+        The token is kept along the secret: a secret edited without a version change is decrypted again.
+        """
+        key = (owner, encryption_version)
+        cached = self.secrets.get(key)
+        if cached is not None and cached[0] == token:
+            return cached[1]
+        return self.secrets.set(key, (token, decrypt(token)))[1]
+
+    def invalidate(self, key_id: Optional[str] = None) -> int:
+        """ Drops the keys, subkeys and secrets of key_id (everything without key_id), e.g. after a key rotation """
+        dropped = self.keys.invalidate(None if key_id is None else lambda key: key[1] == key_id)
+        dropped += self.subkeys.invalidate(None if key_id is None else lambda key: key[0] == key_id)
+        # secrets only know their encryption_version ("<key_id>.<version>", None when never re-encrypted)
+        dropped += self.secrets.invalidate(None if key_id is None else lambda key: key[1] is None or key[1].rsplit('.', 1)[0] == key_id)
+        return dropped
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: {"size": len(cache), "hits": cache.hits, "misses": cache.misses}
+                for name, cache in (("keys", self.keys), ("subkeys", self.subkeys), ("secrets", self.secrets))}
+
+
+CREDENTIALS = CredentialCache()
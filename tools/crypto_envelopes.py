@@ -35,6 +35,14 @@ def _hkdf(master_key: bytes, length: int, info: bytes, key_id: str = "PRIMARY")
     )
     return hkdf.derive(master_key)
 
+def derive_cbc_hmac_keys(master_key: bytes, key_id: str = "PRIMARY") -> Tuple[bytes, bytes]:
+    """
+    (enc_key, mac_key) of AES-256-CBC + HMAC-SHA256. Callers encrypting or decrypting
+    many tokens under the same key may derive them once and pass them as subkeys.
+    """
+    _ensure_key_len(master_key, 32)
+    return _hkdf(master_key, 32, b"aes-cbc|enc", key_id=key_id), _hkdf(master_key, 32, b"aes-cbc|mac", key_id=key_id)
+
 # ----------------------- AES-256-GCM (AEAD) ------------------------
 
 def encrypt_aes_gcm(plaintext: bytes | str, key: bytes, *, iv_bytes: int = 12, aad: Optional[bytes] = None) -> str:
@@ -89,7 +97,7 @@ def decrypt_chacha20poly1305(token: str, key: bytes, *, aad: Optional[bytes] = N
 
 # -------------- AES-256-CBC + HMAC-SHA256 (EtM) -------------------
 
-def encrypt_aes_cbc_hmac(plaintext: bytes | str, master_key: bytes, *, key_id: str = "PRIMARY", iv_bytes: int = 16) -> str:
+def encrypt_aes_cbc_hmac(plaintext: bytes | str, master_key: bytes, *, key_id: str = "PRIMARY", iv_bytes: int = 16, subkeys: Optional[Tuple[bytes, bytes]] = None) -> str:
     """
     Encrypt-then-MAC with independent keys derived via HKDF from master_key.
     Token format: base64(iv) + '.' + base64(ciphertext) + '.' + base64(tag)
@@ -99,8 +107,7 @@ def encrypt_aes_cbc_hmac(plaintext: bytes | str, master_key: bytes, *, key_id: s
         plaintext = plaintext.encode("utf-8")
 
     # Derive separate keys to avoid key reuse across ENC/MAC
-    enc_key = _hkdf(master_key, 32, b"aes-cbc|enc", key_id=key_id)
-    mac_key = _hkdf(master_key, 32, b"aes-cbc|mac", key_id=key_id)
+    enc_key, mac_key = subkeys if subkeys is not None else derive_cbc_hmac_keys(master_key, key_id=key_id)
 
     iv = os.urandom(iv_bytes)  # 16 bytes for AES-CBC
     # PKCS7 pad to AES block (128 bits)
@@ -120,14 +127,13 @@ def encrypt_aes_cbc_hmac(plaintext: bytes | str, master_key: bytes, *, key_id: s
 
     return f"{_b64e(iv)}.{_b64e(ct)}.{_b64e(tag)}"
 
-def decrypt_aes_cbc_hmac(token: str, master_key: bytes, *, key_id: str = "PRIMARY") -> bytes:
+def decrypt_aes_cbc_hmac(token: str, master_key: bytes, *, key_id: str = "PRIMARY", subkeys: Optional[Tuple[bytes, bytes]] = None) -> bytes:
     _ensure_key_len(master_key, 32)
     try:
         iv_b64, ct_b64, tag_b64 = token.split(".", 2)
         iv, ct, tag = _b64d(iv_b64), _b64d(ct_b64), _b64d(tag_b64)
 
-        enc_key = _hkdf(master_key, 32, b"aes-cbc|enc", key_id=key_id)
-        mac_key = _hkdf(master_key, 32, b"aes-cbc|mac", key_id=key_id)
+        enc_key, mac_key = subkeys if subkeys is not None else derive_cbc_hmac_keys(master_key, key_id=key_id)
 
         # Verify HMAC before decrypting
         h = hmac.HMAC(mac_key, hashes.SHA256())
@@ -166,9 +172,10 @@ def encrypt_data(plaintext: bytes | str, key: bytes, *, algorithm: str = "aes-25
         raise ValueError(f"Unknown algorithm: {algorithm}")
 
 
-def decrypt_data(token: str, key: bytes, *, key_id: str = "PRIMARY") -> bytes:
+def decrypt_data(token: str, key: bytes, *, key_id: str = "PRIMARY", subkeys: Optional[Tuple[bytes, bytes]] = None) -> bytes:
     """
     Unified decryptor. Accepts tokens produced by encrypt_data.
+    subkeys: pre-derived (enc_key, mac_key) of aes-256-cbc-hmac tokens (see derive_cbc_hmac_keys).
     """
     try:
         prefix, alg, rest = token.split(".", 2)
@@ -184,6 +191,6 @@ def decrypt_data(token: str, key: bytes, *, key_id: str = "PRIMARY") -> bytes:
     elif alg == "chacha20-poly1305":
         return decrypt_chacha20poly1305(rest, key)
     elif alg == "aes-256-cbc-hmac":
-        return decrypt_aes_cbc_hmac(rest, key, key_id=key_id)
+        return decrypt_aes_cbc_hmac(rest, key, key_id=key_id, subkeys=subkeys)
     else:
         raise EncryptionError(f"Unsupported algorithm in token: {alg}")
\ No newline at end of file
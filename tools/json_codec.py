@@ -0,0 +1,77 @@
+import json
+from typing import Any, Callable, Dict, List, Optional, Union
+
+# JSON backends by order of preference, the fastest installed one being used by default:
+#   orjson, msgspec (optional dependencies) and the standard library json module.
+# Every backend encodes to compact UTF-8 text (no ASCII escaping) and accepts a 'default' hook for unsupported types.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+# --- backends --------------------------------------------------------------
+
+def _stdlib_loads(data: Union[str, bytes]) -> Any:
+    return json.loads(data)
+
+def _stdlib_dumps(obj: Any, default: Optional[Callable] = None) -> str:
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':'))
+
+def _orjson_loads(data: Union[str, bytes]) -> Any:
+    return orjson.loads(data)
+
+def _orjson_dumps(obj: Any, default: Optional[Callable] = None) -> str:
+    return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+def _msgspec_loads(data: Union[str, bytes]) -> Any:
+    return msgspec.json.decode(data)
+
+def _msgspec_dumps(obj: Any, default: Optional[Callable] = None) -> str:
+    return msgspec.json.encode(obj, enc_hook=default).decode('utf-8')
+
+_IMPLEMENTATIONS: Dict[str, tuple] = {
+    "orjson": (_orjson_loads, _orjson_dumps),
+    "msgspec": (_msgspec_loads, _msgspec_dumps),
+    "json": (_stdlib_loads, _stdlib_dumps),
+}
+
+def available() -> List[str]:
+    installed = {"orjson": orjson is not None, "msgspec": msgspec is not None, "json": True}
+    return [name for name in BACKENDS if installed[name]]
+
+# --- selection -------------------------------------------------------------
+
+_backend = available()[0]
+_loads, _dumps = _IMPLEMENTATIONS[_backend]
+
+def use(name: Optional[str] = "auto") -> str:
+    """ Selects the backend ("auto" or None: the fastest installed one) and returns its name """
+    global _backend, _loads, _dumps
+    if name in (None, "auto"):
+        name = available()[0]
+    if not name in BACKENDS:
+        raise ValueError(f"Unknown json codec {name} ({', '.join(BACKENDS)})")
+    if not name in available():
+        raise ImportError(f"Json codec {name} is not installed")
+    _backend = name
+    _loads, _dumps = _IMPLEMENTATIONS[name]
+    return name
+
+def backend() -> str:
+    return _backend
+
+# --- api -------------------------------------------------------------------
+
+def loads(data: Union[str, bytes]) -> Any:
+    return _loads(data)
+
+def dumps(obj: Any, default: Optional[Callable] = None) -> str:
+    return _dumps(obj, default)
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+# Asynchronous, structured logging of the Mqtt Transfer service:
+#   - callers only put the record on a bounded queue (QueueHandler): formatting, JSON encoding and file writes
+#     happen in the listener thread, and a full queue drops records instead of blocking the pipeline
+#   - messages are formatted lazily (LOGGER.info("... %s", value)), so a record dropped on the way costs no formatting
+#   - records are JSON lines: time, level, logger, message, plus the 'extra' fields (message_id, route_id, ...)
+#   - per-message records (extra message_id) below WARNING are sampled: all the records of a sampled message are kept
+#   - a warning repeated within dedup_window seconds is logged once; the next one reports how many were suppressed
+
+LOG_DEFAULTS = {
+    "format": "json",         # "json" or "text" (log file)
+    "sample_rate": 1.0,       # fraction of the messages whose INFO records are kept
+    "dedup_window": 60,       # seconds, 0: no deduplication
+    "queue_size": 10000,      # records waiting for the listener thread
+}
+
+# attributes of every LogRecord: the others are 'extra' fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+# --- formatting ------------------------------------------------------------
+
+def extra_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if not key in _RECORD_ATTRIBUTES and not key.startswith('_')}
+
+
+class JsonFormatter(logging.Formatter):
+
+    """ One JSON object per record; values that aren't JSON types are written with str() """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record), "level": record.levelname, "logger": record.name,
+            "message": record.getMessage(), **extra_fields(record)
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+
+    """ The classic format, followed by the extra fields """
+    def __init__(self):
+        super(TextFormatter, self).__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = extra_fields(record)
+        line = super(TextFormatter, self).format(record)
+        return line if len(fields) == 0 else line + " " + json.dumps(fields, default=str)
+
+# --- filters ---------------------------------------------------------------
+
+class MessageSampler(logging.Filter):
+
+    """
+    Keeps the records of sample_rate of the messages (extra message_id) below WARNING. The decision only depends on
+    the (integer) message id, so a message keeps all its records, and is the same in every process and run.
+    """
+    def __init__(self, sample_rate: float = 1.0):
+        super(MessageSampler, self).__init__()
+        self.threshold = int(max(0.0, min(1.0, float(sample_rate))) * 2**32)
+
+    def sampled(self, message_id: Any) -> bool:
+        if self.threshold >= 2**32:
+            return True
+        return (hash(message_id) * 2654435761) % 2**32 < self.threshold
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message_id = getattr(record, "message_id", None)
+        return message_id is None or record.levelno >= logging.WARNING or self.sampled(message_id)
+
+
+class Deduplicator(logging.Filter):
+
+    """
+    Drops WARNING records repeated within window seconds. Records are the same when they share their level, their
+    unformatted message and their extra dedup_key (e.g. the route id), whatever their other arguments (e.g. the message id).
+    The first record after the window carries the number of records suppressed (extra 'suppressed').
+    """
+    def __init__(self, window: float = 60):
+        super(Deduplicator, self).__init__()
+        self.window = float(window)
+        self.seen: Dict[Tuple[Hashable, ...], Tuple[float, int]] = {}
+        self.lock = threading.Lock()
+
+    def key(self, record: logging.LogRecord) -> Tuple[Hashable, ...]:
+        return (record.levelno, record.name, str(record.msg), getattr(record, "dedup_key", None))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.WARNING or self.window <= 0:
+            return True
+        key, now = self.key(record), time.monotonic()
+        with self.lock:
+            first, suppressed = self.seen.get(key, (None, 0))
+            if first is not None and now - first < self.window:
+                self.seen[key] = (first, suppressed + 1)
+                return False
+            self.seen[key] = (now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+    def pending(self) -> Iterable[Tuple[Tuple[Hashable, ...], int]]:
+        """ (key, count) of the records suppressed since their last occurrence was logged """
+        with self.lock:
+            return [(key, suppressed) for key, (first, suppressed) in self.seen.items() if suppressed]
+
+# --- queue -----------------------------------------------------------------
+
+class AsyncHandler(QueueHandler):
+
+    """
+    QueueHandler leaving the formatting to the listener thread: the record is queued as is (the stdlib handler
+    formats it in the caller). A full queue drops the record and counts it.
+    """
+    def __init__(self, queue_size: int = 10000):
+        super(AsyncHandler, self).__init__(queue.Queue(maxsize=max(1, int(queue_size))))
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and record.exc_text is None:
+            # the traceback refers to frames of the caller: rendered now, before they change
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AsyncLogging(object):
+
+    """ The handler installed on the root logger and the listener thread writing its records """
+    def __init__(self, handler: AsyncHandler, listener: QueueListener, deduplicator: Deduplicator):
+        self.handler = handler
+        self.listener = listener
+        self.deduplicator = deduplicator
+
+    def close(self) -> None:
+        """
+        Logs what was suppressed or dropped, writes the records still queued and stops the listener.
+        The records logged afterwards are written synchronously.
+        """
+        logger = logging.getLogger()
+        self.handler.removeFilter(self.deduplicator)
+        for (level, name, msg, dedup_key), count in self.deduplicator.pending():
+            logger.log(level, "%d records suppressed like: %s", count, msg, extra={"dedup_key": dedup_key})
+        if self.handler.dropped:
+            logger.warning("%d log records dropped: the logging queue was full", self.handler.dropped)
+        self.listener.stop()
+        logger.removeHandler(self.handler)
+        for handler in self.listener.handlers:
+            logger.addHandler(handler)
+
+
+def setup(logging_dir: Optional[str], name: str, format: str = "json", sample_rate: float = 1.0, dedup_window: float = 60, queue_size: int = 10000) -> AsyncLogging:
+    """
+    Root logger writing asynchronously to '<logging_dir>/<name>.log' (rotated, 'format' lines) and, from WARNING,
+    to stdout. Without logging_dir only stdout is written to. AsyncLogging.close() must be called on exit.
+    """
+    handlers = []
+    if logging_dir:
+        os.makedirs(logging_dir, exist_ok=True)
+        file_handler = RotatingFileHandler(os.path.join(logging_dir, f"{name}.log"), maxBytes=5*1024*1024, backupCount=3, encoding='utf-8')
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(JsonFormatter() if format == "json" else TextFormatter())
+        handlers.append(file_handler)
+    else:
+        print("No valid logging directory specified. No logs will be kept.")
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.WARNING)
+    console_handler.setFormatter(TextFormatter())
+    handlers.append(console_handler)
+
+    handler = AsyncHandler(queue_size)
+    deduplicator = Deduplicator(dedup_window)
+    handler.addFilter(MessageSampler(sample_rate))
+    handler.addFilter(deduplicator)
+    listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    for previous in list(logger.handlers):
+        logger.removeHandler(previous)
+    logger.addHandler(handler)
+    listener.start()
+    return AsyncLogging(handler, listener, deduplicator)
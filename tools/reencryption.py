@@ -0,0 +1,166 @@
+import os
+import json
+import fcntl
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# Bulk re-encryption of stored secrets under the active crypto config, run in a background thread of the web app:
+#   - the rows still encrypted under another "<key_id>.<version>" are streamed by id, chunk_size at a time
+#   - a chunk is decrypted and re-encrypted in a thread pool (the cryptography AEAD calls release the GIL)
+#     and written back in a single statement, so one transaction per chunk
+#   - progress is saved to a state file after every chunk: any worker process of the web app can report it,
+#     and a job interrupted by a restart resumes after the last chunk written
+#   - a job is started under an exclusive lock on the state file (see locked), so two requests can't both start one
+#   - the pool threads load keys through CryptoKey.storage, whose connections are per thread (context.thread_safe_storage)
+# Entity types taking part expose count_to_reencrypt, to_reencrypt and update_secrets (see ClientDestination).
+
+HEARTBEAT_TIMEOUT = 120  # seconds without a saved chunk after which a running job is considered dead
+MAX_ERRORS = 20          # errors kept in the state file
+
+# --- state -----------------------------------------------------------------
+
+def load_state(path: str) -> Dict[str, Any]:
+    if not os.path.isfile(path):
+        return {"state": "idle"}
+    with open(path) as f:
+        state = json.load(f)
+    if state.get("state") == "running" and time.time() - state.get("heartbeat", 0) > HEARTBEAT_TIMEOUT:
+        state["state"] = "interrupted"
+    return state
+
+def save_state(path: str, state: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    state["heartbeat"] = time.time()
+    state["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    with open(path + '.part', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.part', path)
+
+class locked(object):
+
+    """
+    with locked(state_file): ...
+
+    Exclusive lock (flock on '<state_file>.lock') held by one thread of one process of the web app at a time
+    """
+    def __init__(self, path: str):
+        self.path = path + '.lock'
+        self.file = None
+
+    def __enter__(self) -> "locked":
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        finally:
+            self.file.close()
+            self.file = None
+        return False
+
+def progress(state: Dict[str, Any]) -> Dict[str, Any]:
+    """ The state as served by the progress endpoint """
+    total, treated = state.get("total", 0), state.get("updated", 0) + state.get("failed", 0)
+    return {
+        **{k: v for k, v in state.items() if k != "heartbeat"},
+        "percent": 100.0 if total == 0 else round(min(100.0, 100.0*treated/total), 1)
+    }
+
+# --- job -------------------------------------------------------------------
+
+class ReencryptionJob(object):
+
+    """
+    Re-encrypts the secrets of entity_types under the active version of crypto_config ("<key_id>.<version>").
+    A job with the same target version as an unfinished state file resumes after its last written id per entity type.
+    """
+    def __init__(self, entity_types: Sequence[Any], crypto_config: Any, state_file: str, chunk_size: int = 200, workers: int = 4):
+        self.entity_types = list(entity_types)
+        self.crypto_config = crypto_config
+        self.target = f"{crypto_config['key_id']}.{crypto_config['version']}"
+        self.state_file = state_file
+        self.chunk_size = max(1, int(chunk_size))
+        self.workers = max(1, int(workers))
+        self.thread: Optional[threading.Thread] = None
+
+    def initial_state(self) -> Dict[str, Any]:
+        previous = load_state(self.state_file)
+        if previous.get("target") == self.target and previous.get("state") in ("running", "interrupted", "failed"):
+            previous.update(state="running", resumed_at=datetime.now().isoformat(timespec="seconds"))
+            # rows that failed before are still left to re-encrypt: they are counted once, in 'failed'
+            previous["total"] = previous.get("updated", 0) + self.remaining()
+            return previous
+        last_ids = {entity_type.ENTITY_NAME: 0 for entity_type in self.entity_types}
+        return {
+            "state": "running", "target": self.target, "total": self.remaining(), "updated": 0, "failed": 0, "chunks": 0,
+            "last_ids": last_ids, "errors": [], "started_at": datetime.now().isoformat(timespec="seconds"), "pid": os.getpid()
+        }
+
+    def remaining(self) -> int:
+        return sum(entity_type.count_to_reencrypt(self.target) for entity_type in self.entity_types)
+
+    def rewrap(self, row: Any) -> Tuple[Any, bytes, str]:
+        """ (row, secret encrypted under the active version, active version) """
+        key_id, version = row['encryption_version'].rsplit('.', 1)
+        plaintext = self.crypto_config.decrypt(row['password_enc'].decode('ascii'), key_id, int(version))
+        return row, self.crypto_config.encrypt(plaintext, self.active_key, subkeys=self.active_subkeys).encode('ascii'), self.target
+
+    def run(self, state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """ state: the initial state, already saved (see start) """
+        if state is None:
+            state = self.initial_state()
+            save_state(self.state_file, state)
+        try:
+            self.active_key = self.crypto_config.key()
+            self.active_subkeys = self.crypto_config.subkeys(self.active_key)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for entity_type in self.entity_types:
+                    name = entity_type.ENTITY_NAME
+                    while True:
+                        chunk = list(entity_type.to_reencrypt(self.target, after_id=state["last_ids"].get(name, 0), limit=self.chunk_size))
+                        if len(chunk) == 0:
+                            break
+                        rewrapped = []
+                        for row, result in zip(chunk, executor.map(self.try_rewrap, chunk)):
+                            if isinstance(result, Exception):
+                                state["failed"] += 1
+                                state["errors"] = (state["errors"] + [f"{name} #{row['id']}: {result}"])[-MAX_ERRORS:]
+                            else:
+                                rewrapped.append(result)
+                        entity_type.update_secrets(*rewrapped)
+                        state["updated"] += len(rewrapped)
+                        state["chunks"] += 1
+                        state["last_ids"][name] = chunk[-1]['id']
+                        save_state(self.state_file, state)
+            state["state"] = "done"
+        except Exception as e:
+            traceback.print_exc()
+            state["state"] = "failed"
+            state["errors"] = (state["errors"] + [f"{type(e).__name__}: {e}"])[-MAX_ERRORS:]
+        state["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        save_state(self.state_file, state)
+        return state
+
+    def try_rewrap(self, row: Any):
+        try:
+            return self.rewrap(row)
+        except Exception as e:
+            return e
+
+    def start(self) -> threading.Thread:
+        """
+        Runs the job in a daemon thread. The job is saved as running before this returns: called under locked,
+        the next request to start one sees it.
+        """
+        state = self.initial_state()
+        save_state(self.state_file, state)
+        self.thread = threading.Thread(target=self.run, args=(state,), name="reencryption", daemon=True)
+        self.thread.start()
+        return self.thread
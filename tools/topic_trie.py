@@ -0,0 +1,107 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# MQTT topic filters: levels are separated by '/', '+' matches exactly one level and
+# '#' (last level only) matches any number of remaining levels, including none.
+SEPARATOR = '/'
+SINGLE_LEVEL = '+'
+MULTI_LEVEL = '#'
+
+# --- helpers ---------------------------------------------------------------
+
+def _split(topic: str) -> List[str]:
+    return topic.split(SEPARATOR)
+
+def is_pattern(topic: str) -> bool:
+    return any(level in (SINGLE_LEVEL, MULTI_LEVEL) for level in _split(topic))
+
+def specificity(pattern: str) -> Tuple[int, ...]:
+    """ Sort key of the patterns matching a same topic: most specific first (literal < '+' < '#', level by level) """
+    return tuple({SINGLE_LEVEL: 1, MULTI_LEVEL: 2}.get(level, 0) for level in _split(pattern))
+
+def validate(pattern: str) -> None:
+    levels = _split(pattern)
+    for i, level in enumerate(levels):
+        if MULTI_LEVEL in level and (level != MULTI_LEVEL or i != len(levels) - 1):
+            raise ValueError(f"'{MULTI_LEVEL}' must be a whole last level in topic filter {pattern}")
+        if SINGLE_LEVEL in level and level != SINGLE_LEVEL:
+            raise ValueError(f"'{SINGLE_LEVEL}' must be a whole level in topic filter {pattern}")
+
+def covers(subscription: str, pattern: str) -> bool:
+    """ Whether every topic matched by 'pattern' is also matched by 'subscription' """
+    sub, pat = _split(subscription), _split(pattern)
+    for i, level in enumerate(sub):
+        if level == MULTI_LEVEL:
+            return True
+        if i >= len(pat) or pat[i] == MULTI_LEVEL:
+            return False
+        if level != SINGLE_LEVEL and level != pat[i]:
+            return False
+    return len(sub) == len(pat)
+
+# --- trie ------------------------------------------------------------------
+
+class _Node(object):
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.values: List[Tuple[str, Any]] = []
+
+
+class TopicTrie(object):
+    """
+    Topic filters indexed level by level. Matching a concrete topic walks at most the literal,
+    '+' and '#' branches of each level: its cost depends on the topic depth, not on the number of filters.
+    """
+
+    def __init__(self, patterns: Optional[Iterable[Tuple[str, Any]]] = None):
+        self.root = _Node()
+        self.size = 0
+        for pattern, value in (patterns or []):
+            self.insert(pattern, value)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def insert(self, pattern: str, value: Any = None) -> None:
+        validate(pattern)
+        node = self.root
+        for level in _split(pattern):
+            node = node.children.setdefault(level, _Node())
+        node.values.append((pattern, value))
+        self.size += 1
+
+    def match(self, topic: str) -> List[Tuple[str, Any]]:
+        """ (pattern, value) of every filter matching the topic """
+        levels = _split(topic)
+        matched = []
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            wildcard = node.children.get(MULTI_LEVEL)
+            # topics starting with '$' are not matched by first level wildcards
+            first_system = depth == 0 and levels[0].startswith('$')
+            if wildcard is not None and not first_system:
+                matched.extend(wildcard.values)
+            if depth == len(levels):
+                matched.extend(node.values)
+                continue
+            child = node.children.get(levels[depth])
+            if child is not None:
+                stack.append((child, depth + 1))
+            child = node.children.get(SINGLE_LEVEL)
+            if child is not None and not first_system:
+                stack.append((child, depth + 1))
+        return matched
+
+    def best(self, topic: str, accept: Optional[Callable[[Any], bool]] = None) -> Optional[Tuple[str, Any]]:
+        """
+        Most specific filter matching the topic, among those whose value is accepted (all by default).
+        Filters as specific as each other are ranked by insertion order.
+        """
+        matched = self.match(topic)
+        if accept is not None:
+            matched = [entry for entry in matched if accept(entry[1])]
+        if not matched:
+            return None
+        return min(matched, key=lambda entry: specificity(entry[0]))
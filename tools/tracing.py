@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterable, List, Optional
+
+# Sampled per-message tracing. A trace gathers the spans (name, start, end, attributes) of one message;
+# finished traces are buffered and appended to a local file, either:
+#   - chrome: Chrome trace event format (JSON array, opened by chrome://tracing or ui.perfetto.dev), one row per message
+#   - otlp: OTLP/JSON, one ExportTraceServiceRequest per line (as written by the OpenTelemetry collector file exporter)
+
+FORMATS = ("chrome", "otlp")
+EXTENSIONS = {"chrome": ".trace.json", "otlp": ".otlp.jsonl"}
+
+# --- clock -----------------------------------------------------------------
+
+_EPOCH_NS = time.time_ns()
+_PERF_NS = time.perf_counter_ns()
+
+def now_ns() -> int:
+    """ Wall clock nanoseconds with the resolution of perf_counter """
+    return _EPOCH_NS + time.perf_counter_ns() - _PERF_NS
+
+# --- traces ----------------------------------------------------------------
+
+class Trace(object):
+
+    def __init__(self, message_id: int, **attributes):
+        self.message_id = message_id
+        self.attributes: Dict[str, Any] = {"message_id": message_id, **attributes}
+        self.trace_id = '%032x' % random.getrandbits(128)
+        self.spans: List[Dict[str, Any]] = []
+        self.stack: List[str] = []
+
+    def __bool__(self) -> bool:
+        return True
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def add_span(self, name: str, start_ns: int, end_ns: int, parent: Optional[str] = None, **attributes) -> str:
+        span_id = '%016x' % random.getrandbits(64)
+        self.spans.append({
+            "name": name, "span_id": span_id, "parent": parent if parent is not None else (self.stack[-1] if self.stack else None),
+            "start": start_ns, "end": end_ns, "attributes": attributes
+        })
+        return span_id
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span_id = '%016x' % random.getrandbits(64)
+        parent = self.stack[-1] if self.stack else None
+        self.stack.append(span_id)
+        start = now_ns()
+        try:
+            yield self
+        finally:
+            self.stack.pop()
+            self.spans.append({"name": name, "span_id": span_id, "parent": parent, "start": start, "end": now_ns(), "attributes": attributes})
+
+
+class _NullTrace(object):
+    """ Trace of a message that wasn't sampled: every operation is a no-op """
+
+    def __bool__(self) -> bool:
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def add_span(self, *args, **kwargs) -> None:
+        pass
+
+    def span(self, name: str, **attributes):
+        return nullcontext(self)
+
+
+NULL_TRACE = _NullTrace()
+
+# --- exporters -------------------------------------------------------------
+
+def _chrome_events(trace: Trace, pid: int) -> Iterable[Dict[str, Any]]:
+    # one row (tid) per message: the spans of a message nest under its root span
+    tid = trace.message_id
+    yield {"name": "process_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": f"mqtt_transfer ({pid})"}}
+    yield {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": f"message #{trace.message_id}"}}
+    for span in sorted(trace.spans, key=lambda span: (span["start"], -span["end"])):
+        yield {
+            "name": span["name"], "cat": "mqtt_transfer", "ph": "X", "pid": pid, "tid": tid,
+            "ts": span["start"] / 1000, "dur": (span["end"] - span["start"]) / 1000,
+            "args": {**trace.attributes, **span["attributes"]}
+        }
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+def _otlp_request(traces: List[Trace], service: str) -> Dict[str, Any]:
+    spans = []
+    for trace in traces:
+        for span in trace.spans:
+            spans.append({
+                "traceId": trace.trace_id, "spanId": span["span_id"], "parentSpanId": span["parent"] or "",
+                "name": span["name"], "kind": 1, "startTimeUnixNano": str(span["start"]), "endTimeUnixNano": str(span["end"]),
+                "attributes": _otlp_attributes({**trace.attributes, **span["attributes"]})
+            })
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": service, "process.pid": os.getpid()})},
+        "scopeSpans": [{"scope": {"name": "mqttrelay"}, "spans": spans}]
+    }]}
+
+# --- tracer ----------------------------------------------------------------
+
+class Tracer(object):
+
+    """
+    Samples messages (sample_rate, or always for the senders listed in 'always') and appends their traces to 'path'
+    every 'flush_every' finished traces and on close. A finished trace gets a root span covering all its spans.
+    """
+    def __init__(self, path: str, sample_rate: float = 0.0, format: str = "chrome", always: Iterable[str] = (), service: str = "mqtt_transfer", flush_every: int = 100):
+        if not format in FORMATS:
+            raise ValueError(f"Unknown trace format {format} ({', '.join(FORMATS)})")
+        self.path = path
+        self.sample_rate = float(sample_rate)
+        self.format = format
+        self.always = set(always)
+        self.service = service
+        self.flush_every = flush_every
+        self.finished: List[Trace] = []
+        self.lock = threading.Lock()
+
+    def start(self, message_id: int, sender: Optional[str] = None, **attributes):
+        """ A new trace for the message, or NULL_TRACE if it isn't sampled """
+        if (sender is not None and sender in self.always) or (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return Trace(message_id, **({"sender": sender} if sender is not None else {}), **attributes)
+        return NULL_TRACE
+
+    def finish(self, trace, root: str = "message") -> None:
+        if not trace or len(trace.spans) == 0:
+            return
+        root_id = trace.add_span(root, min(span["start"] for span in trace.spans), max(span["end"] for span in trace.spans))
+        for span in trace.spans:
+            if span["parent"] is None and span["span_id"] != root_id:
+                span["parent"] = root_id
+        with self.lock:
+            self.finished.append(trace)
+            if len(self.finished) >= self.flush_every:
+                self._flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if len(self.finished) == 0:
+            return
+        traces, self.finished = self.finished, []
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            if self.format == "chrome":
+                # JSON array format: the closing bracket is optional, events are appended as they come
+                if f.tell() == 0:
+                    f.write('[\n')
+                pid = os.getpid()
+                for trace in traces:
+                    for event in _chrome_events(trace, pid):
+                        f.write(json.dumps(event, default=str))
+                        f.write(',\n')
+            else:
+                f.write(json.dumps(_otlp_request(traces, self.service), default=str))
+                f.write('\n')
+
+    def close(self) -> None:
+        self.flush()
+
+
+def trace_file(directory: str, format: str, name: str = "mqtt_transfer") -> str:
+    return os.path.join(directory, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}{EXTENSIONS[format]}")
@@ -0,0 +1,74 @@
+import mysql.connector
+from typing import Any, Dict, Iterator, Optional
+
+# Transactions for the entity helpers written against a temod MysqlStorage (executeAndCommit, getOne, getMany).
+# temod commits and closes its connection after every statement; a Transaction offers the same methods on a
+# connection of its own, opened from the credentials of the storage, and commits all the statements at once.
+# Being opened per transaction, that connection is never shared with the other threads using the storage.
+
+
+class Transaction(object):
+
+    """
+    with Transaction(MqttMessage.storage) as transaction:
+        message_id = MqttMessage.receive(topic, payload, qos, at, storage=transaction)
+
+    Committed when the block exits normally, rolled back when it raises. Savepoints roll back a part of it only.
+    """
+    def __init__(self, storage: Any):
+        self.storage = storage
+        self.connexion = None
+
+    def __enter__(self) -> "Transaction":
+        self.connexion = mysql.connector.connect(**self.storage.credentials)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        try:
+            if exc_type is None:
+                self.connexion.commit()
+            else:
+                try:
+                    self.connexion.rollback()
+                except mysql.connector.Error:
+                    pass  # the connection is lost: the server rolls the transaction back itself
+        finally:
+            self.connexion.close()
+            self.connexion = None
+        return False
+
+    def executeAndCommit(self, query: str) -> Any:
+        """ Runs a statement of the transaction (committed with it): the cursor is returned for its lastrowid """
+        cursor = self.connexion.cursor()
+        try:
+            cursor.execute(query)
+        finally:
+            cursor.close()
+        return cursor
+
+    def getOne(self, query: str) -> Optional[Dict[str, Any]]:
+        cursor = self.connexion.cursor()
+        try:
+            cursor.execute(query)
+            row, columns = cursor.fetchone(), cursor.column_names
+        finally:
+            cursor.close()
+        return None if row is None else dict(zip(columns, row))
+
+    def getMany(self, query: str) -> Iterator[Dict[str, Any]]:
+        cursor = self.connexion.cursor()
+        try:
+            cursor.execute(query)
+            columns = cursor.column_names
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        for row in rows:
+            yield dict(zip(columns, row))
+
+    def savepoint(self, name: str) -> None:
+        self.executeAndCommit(f"SAVEPOINT {name}")
+
+    def rollback_to(self, name: str) -> None:
+        """ Undoes the statements run since the savepoint, keeping the ones before it """
+        self.executeAndCommit(f"ROLLBACK TO SAVEPOINT {name}")